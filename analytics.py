@@ -0,0 +1,117 @@
+# analytics.py
+# 無介面的批次分析：不啟動 Streamlit，以與儀表板相同的處理流程 (pipeline.py) 與資料準備函數 (chart_prep.py)
+# 產生財務比率表格、產業市值與排名等彙總表，寫成 Parquet 或 CSV
+# - 可匯入使用：analyze_frame(df) / analyze_file(path) 回傳 {表格名稱: DataFrame}
+# - 命令列：一次處理整個目錄的資料檔（CSV / Parquet / Feather / XLSX），每個檔案在獨立的程序中執行，可使用多個 CPU 核心
+#
+# 用法（在專案根目錄執行）：
+#   python -m analytics data/ out/
+#   python -m analytics data/ out/ --format csv --workers 4 --pattern "*_2024.parquet"
+# 輸出：out/{檔名（含副檔名）}/{表格名稱}.parquet（或 .csv）；a.csv 與 a.parquet 分別寫到 out/a.csv/ 與 out/a.parquet/
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chart_prep
+import ingest
+import pipeline
+
+OUTPUT_FORMATS = ("parquet", "csv")
+
+
+def load_table(path):
+    # 與儀表板上傳檔案時相同的讀取方式
+    return ingest.read_path(path)
+
+
+def analyze_frame(df):
+    # 回傳 (表格, 提示訊息)；表格為 {名稱: DataFrame}，內容與儀表板顯示的相同
+    df, notice = pipeline.process_frame(df)
+    tables = {"processed": df}
+
+    ratios = pipeline.ratio_table(df)
+    if ratios is not None:
+        tables["ratios"] = ratios
+
+    if {"Industry", "Market Capitalization"}.issubset(df.columns):
+        tables["industry_market"] = chart_prep.prepare_industry_market(df, top_n=pipeline.INDUSTRY_MARKET_TOP_N)["data"]
+
+    for name, (metric, n) in pipeline.TOP_N_RANKINGS.items():
+        if {"Name", metric}.issubset(df.columns):
+            tables[name] = chart_prep.prepare_top_n(df, metric, n=n)["data"]
+    return tables, notice
+
+
+def analyze_file(path):
+    return analyze_frame(load_table(path))
+
+
+def write_tables(tables, out_dir, fmt="parquet"):
+    # 每個表格一個檔案；不保留 pandas 的索引，讀回來時與儀表板顯示的欄位一致
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for name, table in tables.items():
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "parquet":
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False, encoding="utf-8-sig")
+        paths.append(path)
+    return paths
+
+
+def process_file(path, output_dir, fmt="parquet"):
+    # 在工作程序中執行：讀取、處理並寫出一個檔案，回傳摘要（不回傳 DataFrame，避免在程序間搬移大量資料）
+    start = time.perf_counter()
+    tables, notice = analyze_file(path)
+    # 子目錄保留副檔名：只用主檔名時，同名但格式不同的檔案會互相覆寫輸出
+    paths = write_tables(tables, os.path.join(output_dir, os.path.basename(path)), fmt)
+    return {
+        "input": path,
+        "rows": len(tables["processed"]),
+        "tables": sorted(tables),
+        "outputs": paths,
+        "notice": notice[1] if notice else None,
+        "duration_s": time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次處理目錄中的財務資料檔，輸出比率表格與彙總表（不需啟動 Streamlit）")
+    parser.add_argument("input_dir", help="資料檔所在目錄")
+    parser.add_argument("output_dir", help="輸出目錄（每個輸入檔案一個子目錄）")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="parquet", help="輸出格式")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="同時處理的程序數（預設為 CPU 核心數）")
+    parser.add_argument("--pattern", default="*", help="要處理的檔名樣式（只處理支援的格式）")
+    args = parser.parse_args(argv)
+
+    paths = sorted(path for path in glob.glob(os.path.join(args.input_dir, args.pattern)) if ingest.file_format(path))
+    if not paths:
+        print(f"⚠️ {args.input_dir} 中沒有符合 {args.pattern} 的檔案")
+        return 1
+
+    start = time.perf_counter()
+    failures = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(paths)))) as executor:
+        futures = {executor.submit(process_file, path, args.output_dir, args.format): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as exc:
+                failures.append(path)
+                print(f"❌ {path}: {type(exc).__name__}: {exc}")
+                continue
+            print(f"✅ {path}: {summary['rows']} 列 → {', '.join(summary['tables'])}（{summary['duration_s']:.2f} s）")
+            if summary["notice"]:
+                print(f"    {summary['notice']}")
+
+    print(f"完成 {len(paths) - len(failures)} / {len(paths)} 個檔案，總耗時 {time.perf_counter() - start:.2f} s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,76 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import numpy as np
+import atexit
 import os
-import io
+import hashlib
+import uuid
+
+import lazy_imports
+import perf
+
+# --- 延遲匯入 ---
+# pandas / numpy / plotly 與依賴它們的模組在上傳檔案、真正要處理資料或畫圖時才匯入，
+# 未上傳檔案前的首次載入不必支付這些成本；匯入耗時記錄在效能除錯面板
+pd = lazy_imports.lazy("pandas")
+np = lazy_imports.lazy("numpy")
+px = lazy_imports.lazy("plotly.express")
+chart_figures = lazy_imports.lazy("chart_figures")
+chart_prep = lazy_imports.lazy("chart_prep")
+compute_pool = lazy_imports.lazy("compute_pool")
+figure_cache = lazy_imports.lazy("figure_cache")
+pipeline = lazy_imports.lazy("pipeline")
+data_edits = lazy_imports.lazy("data_edits")
+ingest = lazy_imports.lazy("ingest")
+prefetch = lazy_imports.lazy("prefetch")
+compaction = lazy_imports.lazy("compaction")
 
 # --- 頁面配置 ---
 st.set_page_config(page_title="財務分析儀表板", layout="wide")
 st.title("📊 企業財務洞察平台")
 st.markdown("---")
 
+# --- 圖表快取 ---
+# 函數：以檔案內容作為資料集指紋，背景計算與圖表快取的結果都依此區分
+def file_fingerprint(uploaded_file):
+    return hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+
+# 函數：解析上傳的檔案（CSV / Parquet / Feather / XLSX）；同一檔案內容只解析一次，
+# 頁面上方的預覽與下方的分析共用同一份結果，不會重複讀取上傳的檔案
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_uploaded_table(dataset_key, name, _buffer):
+    return ingest.read_table(_buffer, name)
+
+# 全程序共用的圖表快取（跨 rerun 與工作階段保留）
+@st.cache_resource
+def get_figure_cache():
+    return figure_cache.FigureCache()
+
+# 函數：目前工作階段的差異層；換了資料集就重新建立（先前的修改一併捨棄）
+def get_edit_layer(dataset_key, base):
+    layer = st.session_state.get("edit_layer")
+    if layer is None or layer.dataset_key != dataset_key:
+        layer = data_edits.EditLayer(base, dataset_key)
+        st.session_state["edit_layer"] = layer
+    return layer
+
+# 函數：資料集有修改時回傳差異層，否則回傳 None（快取鍵維持不變，與其他工作階段共用）
+def current_edit_layer(dataset_key):
+    layer = st.session_state.get("edit_layer")
+    if layer is None or layer.dataset_key != dataset_key or not layer.edits:
+        return None
+    return layer
+
+# 函數：圖表與參數未變時直接送出快取的圖表（不重新驗證），否則呼叫 build() 重新建圖
+# 資料經過編輯時，快取鍵只加入該圖表讀取欄位的修改摘要，未受影響的圖表仍命中快取
+def render_figure(dataset_key, chart, params, build):
+    layer = current_edit_layer(dataset_key)
+    if layer is not None and chart in pipeline.CHART_REQUIREMENTS:
+        token = layer.token(pipeline.chart_columns(chart, params))
+        if token:
+            dataset_key = f"{dataset_key}:{token}"
+    with perf.get_recorder(st.session_state).span(f"figure:{chart}"):
+        fig = get_figure_cache().get_or_build((dataset_key, chart, params), build)
+        st.plotly_chart(fig, use_container_width=True)
+
 # --- 側邊欄 API Key 設定 ---
 if "GOOGLE_API_KEY" not in st.session_state:
     st.session_state["GOOGLE_API_KEY"] = ""
@@ -24,19 +85,25 @@ if input_key:
     st.session_state["GOOGLE_API_KEY"] = input_key
     st.sidebar.success("✅ API Key 已儲存")
 
+# --- 效能除錯面板 ---
+# 關閉時所有量測都只是空操作；開啟後在側邊欄底部顯示各階段耗時
+recorder = perf.get_recorder(st.session_state)
+recorder.set_enabled(st.sidebar.checkbox("🛠️ 顯示效能除錯面板", value=recorder.enabled))
+recorder.begin_run("app.py")
+
 # --- API Key 檢查 ---
 if not st.session_state["GOOGLE_API_KEY"]:
     st.warning("⚠️ 請先在左側欄輸入 API Key，以使用 CSV 分析功能")
     st.stop()  # 停止執行下面的程式
 
-# --- CSV 上傳 ---
-st.markdown("**請上傳您的 CSV 檔案**")
-uploaded_file = st.file_uploader("📤 上傳合併財務 CSV 檔案", type=["csv"])
+# --- 檔案上傳 ---
+st.markdown("**請上傳您的資料檔案（CSV、Parquet、Feather 或 XLSX）**")
+uploaded_file = st.file_uploader("📤 上傳合併財務資料檔案", type=list(ingest.SUPPORTED_EXTENSIONS))
 
 if uploaded_file:
     try:
-        df = pd.read_csv(uploaded_file)
-        st.success("✅ CSV 檔案上傳成功！")
+        df = load_uploaded_table(file_fingerprint(uploaded_file), uploaded_file.name, uploaded_file.getvalue())
+        st.success("✅ 檔案上傳成功！")
         st.dataframe(df.head())
 
         # --- 基本圖表示範 ---
@@ -49,286 +116,466 @@ if uploaded_file:
             with col2:
                 y_axis = st.selectbox("選擇 Y 軸", numeric_cols, index=1)
 
-            fig = px.scatter(df, x=x_axis, y=y_axis, title=f"{y_axis} vs {x_axis}")
-            st.plotly_chart(fig, use_container_width=True)
+            def build_figure():
+                fig = px.scatter(df, x=x_axis, y=y_axis, title=f"{y_axis} vs {x_axis}")
+                return fig
+            render_figure(file_fingerprint(uploaded_file), "基本圖表示範", (x_axis, y_axis), build_figure)
         else:
-            st.warning("CSV 中沒有數值欄位，無法生成圖表。")
+            st.warning("檔案中沒有數值欄位，無法生成圖表。")
     except Exception as e:
-        st.error(f"❌ CSV 讀取失敗: {e}")
+        st.error(f"❌ 檔案讀取失敗: {e}")
 else:
-    st.info("請上傳 CSV 檔案以進行分析")
+    st.info("請上傳 CSV、Parquet、Feather 或 XLSX 檔案以進行分析")
 
 
 
 # 函數：將 DataFrame 欄位穩健地轉換為數值型
 @st.cache_data # 快取此函數，避免每次互動都重新運行
 def convert_df_to_numeric(df_input):
-    df_output = df_input.copy() # 在副本上操作
-    for col in df_output.columns:
+    return pipeline.coerce_numeric(df_input)
+
+# --- 可編輯資料模式 ---
+# 處理後的資料集依檔案指紋在全程序共用，各工作階段的修改以差異層 (data_edits.EditLayer) 疊加，不修改共用的資料集
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_processed_dataset(dataset_key, _df, _recorder):
+    # 使用自動數值轉換函數
+    with _recorder.span("convert_df_to_numeric"):
+        df = convert_df_to_numeric(_df)
+    with _recorder.span("name_detection"):
+        # 確保必要的名稱欄位存在，且是字符串類型
+        df, name_notice = pipeline.ensure_name_column(df)
+    with _recorder.span("derived_metrics"):
+        # 預先計算可能用到的欄位 (確保原始欄位存在才計算)
+        df = pipeline.add_derived_metrics(df)
+    with _recorder.span("compaction"):
+        # 記憶體壓縮：可無損存放的數值欄位改為 float32，產業等重複值多的文字欄位改以字典編碼
+        df, compaction_report = compaction.compact_frame(df)
+    return df, name_notice, compaction_report
+
+# 函數：單一公司的資料列（壓縮過的欄位還原成原本的數值）
+def company_row(df, name):
+    return compaction.widen(df[df["Name"] == name]).iloc[0]
+
+# 資料編輯器一次最多顯示的列數，較大的資料集請先以產業或公司名稱篩選
+EDITOR_MAX_ROWS = 1000
+# 資料概覽表格最多顯示的列數：只還原（widen）顯示的資料列，不必在每次重新執行時複製整個資料集
+OVERVIEW_MAX_ROWS = 5000
+
+# 函數：把資料編輯器的修改套用到差異層（on_change 回呼，在下一次 rerun 之前執行）
+def apply_editor_changes(layer, row_index, editor_key):
+    edited_rows = st.session_state[editor_key]["edited_rows"]
+    changes = {(row_index[int(pos)], column): value for pos, row in edited_rows.items() for column, value in row.items()}
+    if changes:
         try:
-            # 嘗試將欄位轉換為數值類型，無法轉換的設為 NaN
-            temp_series = pd.to_numeric(df_output[col], errors='coerce')
-            original_non_null_count = df_output[col].count()
-            converted_non_null_count = temp_series.count()
-            
-            # 啟發式判斷：如果大部分（例如 > 70%）數據能轉換為數值，則假定它是數值欄位
-            # 並確保它原本不是純粹的物件/布林欄位，除非它確實包含數字
-            if original_non_null_count > 0 and converted_non_null_count / original_non_null_count > 0.7:
-                # 檢查轉換後是否有足夠的非空數值
-                if temp_series.dropna().shape[0] > 0: # 確保有實際的數值數據
-                    df_output[col] = temp_series
-                    # 將無限值替換為 NaN，以避免繪圖或計算錯誤
-                    df_output[col].replace([np.inf, -np.inf], np.nan, inplace=True)
-            elif original_non_null_count == 0 and pd.api.types.is_numeric_dtype(df_output[col]):
-                # 如果欄位是空的數值類型，也保持為數值，只是所有值為 NaN
-                df_output[col] = temp_series
-                df_output[col].replace([np.inf, -np.inf], np.nan, inplace=True)
-        except Exception:
-            # 如果轉換失敗，則跳過此欄位，保持其原始類型
-            pass
-    return df_output
+            layer.apply(changes)
+        except (ValueError, KeyError) as e:
+            st.session_state["edit_error"] = str(e)
+
+def render_data_editor(layer):
+    st.subheader("✏️ 編輯資料")
+    st.caption("修改會疊加在原始資料上，只重新計算受影響的資料列與衍生指標；未讀取被修改欄位的圖表仍使用快取。衍生指標不可直接修改。")
+    view = layer.frame()
+    col1, col2 = st.columns(2)
+    with col1:
+        industry = "全部"
+        if "Industry" in view.columns:
+            industry = st.selectbox("篩選產業", ["全部"] + sorted(view["Industry"].dropna().astype(str).unique().tolist()), key="editor_industry")
+    with col2:
+        name_query = st.text_input("搜尋公司名稱", key="editor_name_query")
+    if industry != "全部":
+        view = view[view["Industry"].astype(str) == industry]
+    if name_query:
+        view = view[view["Name"].str.contains(name_query, case=False, regex=False, na=False)]
+    if len(view) > EDITOR_MAX_ROWS:
+        st.caption(f"共 {len(view):,} 列，只顯示前 {EDITOR_MAX_ROWS:,} 列，請以產業或公司名稱篩選。")
+        view = view.head(EDITOR_MAX_ROWS)
+
+    # 每次套用修改後版本號改變，編輯器以新的資料重新建立（顯示重新計算後的衍生指標）
+    editor_key = f"data_editor_{layer.version}_{hashlib.blake2b(f'{industry}|{name_query}'.encode('utf-8'), digest_size=4).hexdigest()}"
+    st.data_editor(compaction.widen(view), key=editor_key, num_rows="fixed", disabled=sorted(layer.derived_columns),
+                   on_change=apply_editor_changes, args=(layer, view.index, editor_key))
+
+    if st.session_state.get("edit_error"):
+        st.error(st.session_state.pop("edit_error"))
+    if layer.edits:
+        if layer.last_recompute is not None:
+            st.caption(f"最近一次修改重新計算了 {layer.last_recompute['rows']} 列的 "
+                       f"{', '.join(layer.last_recompute['columns'])}，耗時 {layer.last_recompute['ms']:.1f} ms")
+        st.write(f"已修改 {len(layer.edits)} 個儲存格：")
+        st.dataframe(pd.DataFrame(layer.diff()), hide_index=True)
+        st.button("↩️ 還原所有修改", on_click=layer.reset, key="editor_reset")
+
+# 函數：可用圖表判斷；依資料集指紋與相關欄位的修改摘要快取
+@st.cache_data(max_entries=16, show_spinner=False)
+def find_available_charts(dataset_key, edit_token, _df):
+    return pipeline.find_available_charts(_df)
+
+# 全程序共用的背景計算程序池（跨 rerun 與工作階段保留）
+@st.cache_resource
+def get_compute_pool():
+    pool = compute_pool.ComputePool()
+    atexit.register(pool.shutdown) # 伺服器結束時關閉工作程序並釋放共享記憶體中的資料集
+    return pool
+
+# 函數：在背景程序池準備圖表資料；同一工作槽 (slot) 的新請求會取代並取消舊請求
+def prepare_chart_data(dataset_key, df, prep_name, params, slot):
+    if "_session_id" not in st.session_state:
+        st.session_state["_session_id"] = uuid.uuid4().hex
+    # 資料經過編輯時，整份資料以包含所有修改的鍵寫入共享記憶體，結果則只依該準備函數讀取欄位的修改快取
+    publish_key = cache_key = dataset_key
+    layer = current_edit_layer(dataset_key)
+    if layer is not None:
+        publish_key = f"{dataset_key}:{layer.token()}"
+        token = layer.token(chart_prep.prep_columns(prep_name, params, df.columns))
+        if token:
+            cache_key = f"{dataset_key}:{token}"
+    placeholder = st.empty()
+    with perf.get_recorder(st.session_state).span(f"chart_prep:{prep_name}"):
+        result = get_compute_pool().run(
+            publish_key, df, prep_name, params, cache_key=cache_key,
+            slot=(st.session_state["_session_id"], slot),
+            on_wait=lambda: placeholder.caption("⏳ 正在背景計算圖表資料..."), # 等待期間更新畫面，讓 Streamlit 可中斷被取代的 rerun
+        )
+    placeholder.empty()
+    return result
+
+# 異常值偵測的方法選項
+ANOMALY_METHODS = {"穩健 Z 分數 (中位數 / MAD)": "robust_z", "四分位距 (IQR)": "iqr"}
+# 各方法門檻滑桿的 (最小值, 最大值, 預設值, 間距)
+ANOMALY_THRESHOLD_RANGES = {"robust_z": (2.0, 8.0, 3.5, 0.5), "iqr": (1.0, 5.0, 1.5, 0.5)}
+
+# 函數：目前的異常值偵測設定（在「異常公司」檢視中調整，散佈圖的標示沿用相同設定）
+def anomaly_settings():
+    return st.session_state.get("anomaly_settings", ("robust_z", ANOMALY_THRESHOLD_RANGES["robust_z"][2]))
+
+# 函數：散佈圖的異常公司標示；回傳 (加入圖表快取鍵的參數, 為圖表加上標示的函數)，未勾選時回傳 ((), None)
+def anomaly_overlay(dataset_key, df, df_valid, x, y, key):
+    if not st.checkbox("🚩 標示異常公司", key=f"{key}_anomaly_overlay",
+                       help="以「異常公司」檢視中選擇的方法與門檻，標示 X 或 Y 欄位超出產業分佈的公司"):
+        return (), None
+    method, threshold = anomaly_settings()
+    details = prepare_chart_data(dataset_key, df, "anomalies", {"method": method, "threshold": threshold}, slot="anomalies")["details"]
+    details = details[details["column"].isin([x, y]) & details["index"].isin(df_valid.index)]
+    reasons = {}  # {列索引: 異常欄位說明}
+    for index, column in zip(details["index"], details["column"]):
+        reasons.setdefault(index, {})[column] = None
+    reasons = {index: ", ".join(columns) for index, columns in reasons.items()}
+    flagged = df_valid.loc[list(reasons)]
+    st.caption(f"🚩 {len(flagged):,} 家公司的 {x} 或 {y} 為異常值（{method}，門檻 {threshold}）")
+    digest = hashlib.blake2b(repr(sorted(reasons.items())).encode("utf-8"), digest_size=8).hexdigest()
+
+    def overlay(fig):
+        return chart_figures.add_anomaly_overlay(fig, flagged, x, y, reasons, hover_name="Name")
+    return ("anomaly", method, threshold, digest), overlay
+
+# 相關係數的方法選項
+CORRELATION_METHODS = {"Pearson": "pearson", "Spearman（名次）": "spearman"}
+# 相關係數排名列出的欄位組合數
+CORRELATION_TOP_PAIRS = 30
+
+# 函數：從相關係數排名直接開啟該組合的散佈圖（on_click 回呼，在側邊欄圖表選單建立之前設定）
+def open_pair_scatter(x, y):
+    st.session_state["chart_option"] = "任意兩數值欄位散佈圖"
+    st.session_state["scatter_x_col"] = x
+    st.session_state["scatter_y_col"] = y
+
+# 直方圖的分箱方式選項
+HISTOGRAM_BINNINGS = {"等寬": "linear", "對數 (log)": "log", "分位數": "quantile"}
+# 直方圖預設的分箱數
+HISTOGRAM_DEFAULT_BINS = 30
+
+# 函數：在伺服器端分箱後繪製直方圖；分箱結果依 (資料集, 欄位, 箱數, 分箱方式) 快取
+def render_histogram(dataset_key, df, chart, column, title, x_label, key):
+    col1, col2 = st.columns(2)
+    with col1:
+        bins = st.slider("分箱數", min_value=5, max_value=100, value=HISTOGRAM_DEFAULT_BINS, step=5, key=f"{key}_bins")
+    with col2:
+        binning_label = st.radio("分箱方式", list(HISTOGRAM_BINNINGS), horizontal=True, key=f"{key}_binning",
+                                 help="偏態明顯的指標（例如市值）可改用對數或分位數分箱")
+    binning = HISTOGRAM_BINNINGS[binning_label]
+    hist = prepare_chart_data(dataset_key, df, "histogram", {"column": column, "bins": bins, "binning": binning}, slot=key)
+    if hist["dropped"]:
+        st.caption(f"對數分箱只計入正值，已略過 {hist['dropped']:,} 筆小於或等於 0 的數據。")
+    if hist["n"] == 0:
+        st.warning(f"欄位 '{column}' 沒有可繪製的數據。")
+        return
+
+    def build_figure():
+        return chart_figures.histogram_figure(hist, title, x_label)
+    render_figure(dataset_key, chart, (column, bins, binning), build_figure)
+
+# --- 圖表的資料準備參數與建圖函數 ---
+# 圖表分支與背景預先計算共用，預先準備的資料與圖表和點選圖表時的快取鍵一致
+
+# 函數：通用散佈圖的資料準備參數
+def dynamic_scatter_params(df, x, y):
+    return {
+        "x": x, "y": y,
+        "hover_name": "Name" if "Name" in df.columns else None, # 如果有公司名稱欄位，顯示在懸停提示中
+        "color": "Industry" if "Industry" in df.columns else None, # 如果有產業欄位，按產業區分顏色
+    }
+
+# 函數：加上 OLS 趨勢線的散佈圖（通用散佈圖、負債 vs 營運資金、銷售額與淨利潤）
+def ols_scatter_figure(prepared, x, y, title, labels):
+    df_valid = prepared["data"]
+    fig = px.scatter(df_valid, x=x, y=y, title=title, labels=labels,
+                     hover_name="Name" if "Name" in df_valid.columns else None,
+                     color="Industry" if "Industry" in df_valid.columns else None)
+    chart_figures.add_ols_trendlines(fig, prepared["fits"], x, y) # 如果數據點夠多，顯示趨勢線
+    return fig
+
+def dynamic_scatter_figure(prepared, x, y):
+    return ols_scatter_figure(prepared, x, y, f"{x} vs {y} 散佈圖", {x: x, y: y})
+
+def category_figure(counts, column):
+    return chart_figures.category_counts_figure(counts, column, f"{column} 的計數分佈 (前20)")
+
+def correlation_figure(correlation, method_label, industry):
+    return chart_figures.correlation_heatmap(correlation["matrix"], f"{method_label} 相關係數（{industry}）")
+
+def anomaly_counts_figure(anomalies):
+    return chart_figures.category_counts_figure(anomalies["column_counts"].head(20), "column", "各欄位的異常公司數 (前20)")
+
+def pe_roe_figure(prepared, df):
+    fig = px.scatter(prepared["data"],
+                     x="Price to Earning", y="Return on equity",
+                     hover_name="Name",
+                     title="本益比 (P/E) 與股東權益報酬率 (ROE) 的關係",
+                     labels={"Price to Earning": "本益比", "Return on equity": "股東權益報酬率 (%)"},
+                     color="Industry" if "Industry" in df.columns else None, # 如果有產業欄位，可以按產業區分顏色
+                     size="Market Capitalization" if "Market Capitalization" in df.columns else None, # 以市值大小區分點大小
+                     hover_data=["Industry", "Market Capitalization"] if "Industry" in df.columns and "Market Capitalization" in df.columns else None
+                     )
+    return fig
+
+# 排名長條圖：{圖表: (pipeline.TOP_N_RANKINGS 的名稱, 標題, 數值軸標籤)}
+RANKING_CHARTS = {
+    "銷售額成長率排名（前20）": ("top_sales_growth", "銷售額成長率 (3 年) 前 20 名公司", "銷售額成長率 (%)"),
+    "利潤成長率排名（前20）": ("top_profit_growth", "利潤成長率 (3 年) 前 20 名公司", "利潤成長率 (%)"),
+    "平均股東權益報酬率排名（前20）": ("top_roe_avg", "平均股東權益報酬率 (5 年) 前 20 名公司", "平均股東權益報酬率 (%)"),
+}
+
+def ranking_figure(chart, data):
+    ranking, title, label = RANKING_CHARTS[chart]
+    metric = pipeline.TOP_N_RANKINGS[ranking][0]
+    return px.bar(data, x="Name", y=metric, title=title, text_auto=True, labels={metric: label})
+
+def industry_market_figure(data):
+    return px.bar(data,
+                  x="Industry", y="Market Capitalization",
+                  title="前 8 名產業市值",
+                  text_auto=True,
+                  labels={"Market Capitalization": "市值"})
+
+# 固定參數的特定圖表：{圖表: (準備函數, 參數函數(df), 工作槽, 建圖函數(prepared, df))}
+# 建圖函數在資料不足時回傳 None；散佈圖的異常公司標示另外加在建好的圖表上
+FIXED_CHARTS = {
+    "產業市值長條圖（前 8 名）": (
+        "industry_market", lambda df: {"top_n": pipeline.INDUSTRY_MARKET_TOP_N}, "industry_market",
+        lambda prepared, df: industry_market_figure(prepared["data"]) if not prepared["data"].empty else None),
+    "負債 vs 營運資金（散佈圖）": (
+        "scatter", lambda df: {"x": "Debt", "y": "Working capital", "required": ("Name",), "hover_name": "Name",
+                               "color": "Industry" if "Industry" in df.columns else None}, "debt_scatter",
+        lambda prepared, df: ols_scatter_figure(prepared, "Debt", "Working capital", "負債與營運資金的關係",
+                                                {"Debt": "負債", "Working capital": "營運資金"}) if not prepared["data"].empty else None),
+    "本益比與股東權益報酬率散佈圖": (
+        "scatter", lambda df: {"x": "Price to Earning", "y": "Return on equity", "required": ("Name",), "hover_name": "Name",
+                               "extra_cols": tuple(c for c in ("Industry", "Market Capitalization") if c in df.columns),
+                               "trendline": False}, "pe_roe_scatter",
+        lambda prepared, df: pe_roe_figure(prepared, df) if not prepared["data"].empty else None),
+    "銷售額與淨利潤關係散佈圖": (
+        "scatter", lambda df: {"x": "Sales", "y": "Net profit", "required": ("Name",), "hover_name": "Name",
+                               "color": "Industry" if "Industry" in df.columns else None}, "sales_profit_scatter",
+        lambda prepared, df: ols_scatter_figure(prepared, "Sales", "Net profit", "銷售額與淨利潤的關係",
+                                                {"Sales": "銷售額", "Net profit": "淨利潤"}) if not prepared["data"].empty else None),
+}
+for _chart, (_ranking, _, _) in RANKING_CHARTS.items():
+    FIXED_CHARTS[_chart] = (
+        "top_n", lambda df, ranking=_ranking: dict(zip(("metric", "n"), pipeline.TOP_N_RANKINGS[ranking])), "top_n",
+        lambda prepared, df, chart=_chart: ranking_figure(chart, prepared["data"]) if not prepared["data"].empty else None)
+
+# 函數：固定參數圖表的資料準備（與背景預先計算相同的參數）
+def prepare_fixed_chart(dataset_key, df, chart):
+    prep_name, params, slot, _ = FIXED_CHARTS[chart]
+    return prepare_chart_data(dataset_key, df, prep_name, params(df), slot=slot)
+
+# 函數：固定參數圖表的建圖函數（供 render_figure 呼叫）
+def fixed_chart_builder(chart, prepared, df, overlay=None):
+    def build_figure():
+        fig = FIXED_CHARTS[chart][3](prepared, df)
+        return overlay(fig) if overlay else fig
+    return build_figure
+
+# --- 背景預先計算 ---
+# 函數：預先計算的工作：通用圖表（各選項的預設值）與估計成本最低的幾個特定圖表，依估計成本由低到高執行
+def prefetch_tasks(df, charts, specific_charts=None):
+    generic, specific = [], []
+    numeric_cols = sorted(df.select_dtypes(include=['number']).columns.tolist())
+    categorical_cols = sorted(df.select_dtypes(include=['object', 'string', 'category']).columns.tolist())
+
+    def task(chart, prep_name, params, figure_params=None, build=None):
+        return {"chart": chart, "prep": prep_name, "params": params, "figure_params": figure_params, "build": build}
+
+    def histogram_task(chart, column, title, x_label):
+        # 與 render_histogram 的預設選項相同
+        binning = HISTOGRAM_BINNINGS[next(iter(HISTOGRAM_BINNINGS))]
+        return task(chart, "histogram", {"column": column, "bins": HISTOGRAM_DEFAULT_BINS, "binning": binning},
+                    (column, HISTOGRAM_DEFAULT_BINS, binning),
+                    lambda hist: chart_figures.histogram_figure(hist, title, x_label) if hist["n"] else None)
+
+    for chart in charts:
+        if chart == "資料概覽表格":
+            generic.append(task(chart, "overview", {}))
+        elif chart == "數值欄位分佈直方圖" and numeric_cols and df[numeric_cols[0]].notna().any():
+            generic.append(histogram_task(chart, numeric_cols[0], f"{numeric_cols[0]} 的分佈", numeric_cols[0]))
+        elif chart == "類別欄位計數長條圖" and categorical_cols:
+            column = categorical_cols[0]
+            generic.append(task(chart, "category_counts", {"column": column, "top_n": 20}, (column,),
+                                lambda prepared, column=column: category_figure(prepared["data"], column) if not prepared["data"].empty else None))
+        elif chart == "任意兩數值欄位散佈圖" and len(numeric_cols) >= 2:
+            x, y = numeric_cols[0], numeric_cols[1]
+            generic.append(task(chart, "scatter", dynamic_scatter_params(df, x, y), (x, y),
+                                lambda prepared: dynamic_scatter_figure(prepared, x, y) if not prepared["data"].empty else None))
+        elif chart == "相關係數矩陣":
+            method_label = next(iter(CORRELATION_METHODS))
+            method = CORRELATION_METHODS[method_label]
+            generic.append(task(chart, "correlation", {"method": method, "industry": None}, (method, "全部產業"),
+                                lambda prepared: correlation_figure(prepared, method_label, "全部產業") if not prepared["pairs"].empty else None))
+        elif chart == "異常公司":
+            method = next(iter(ANOMALY_METHODS.values()))
+            threshold = ANOMALY_THRESHOLD_RANGES[method][2]
+            generic.append(task(chart, "anomalies", {"method": method, "threshold": threshold}, ("column_counts", method, threshold),
+                                lambda prepared: anomaly_counts_figure(prepared) if not prepared["summary"].empty else None))
+        elif chart == "市值分佈直方圖" and df["Market Capitalization"].notna().any():
+            specific.append(histogram_task(chart, "Market Capitalization", "市場資本化分佈", "市值"))
+        elif chart in FIXED_CHARTS:
+            prep_name, params, _, build = FIXED_CHARTS[chart]
+            specific.append(task(chart, prep_name, params(df), (), lambda prepared, build=build: build(prepared, df)))
+
+    n = prefetch.DEFAULT_SPECIFIC_CHARTS if specific_charts is None else specific_charts
+    tasks = generic + prefetch.cheapest(specific, len(df), n)
+    return sorted(tasks, key=lambda t: prefetch.estimate_cost(t, len(df)))
+
+# 函數：停止目前工作階段的背景預先計算（上傳了新檔案、移除檔案或關閉預先計算時）
+def stop_prefetch(keep_dataset_key=None):
+    prefetcher = st.session_state.get("prefetcher")
+    if prefetcher is not None and prefetcher.dataset_key != keep_dataset_key:
+        prefetcher.stop()
+        del st.session_state["prefetcher"]
+
+# 函數：開始目前資料集的背景預先計算；同一資料集只執行一次
+def start_prefetch(dataset_key, df, charts):
+    stop_prefetch(keep_dataset_key=dataset_key)
+    prefetcher = st.session_state.get("prefetcher")
+    if prefetcher is None:
+        # 工作階段結束時 handle 被回收，背景預先計算隨之停止
+        prefetcher = prefetch.PrefetchHandle(prefetch.Prefetcher(
+            dataset_key, df, prefetch_tasks(df, charts), get_compute_pool(), get_figure_cache()))
+        st.session_state["prefetcher"] = prefetcher
+    return prefetcher
+
+recorder.register_cache("背景計算", lambda: get_compute_pool().stats())
+recorder.register_cache("圖表快取", lambda: get_figure_cache().stats())
+
+if uploaded_file is None:
+    stop_prefetch() # 移除檔案時停止先前資料集的背景預先計算
 
 if uploaded_file is not None:
+    chart_span = None
     try:
-        # 根據檔案類型讀取數據 (現在只讀取 CSV)
-        if uploaded_file.name.lower().endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            st.error("不支援的檔案格式。請上傳 CSV 檔案。") # 更新錯誤訊息
+        # 根據檔案類型讀取數據（與上方預覽共用解析結果）
+        if ingest.file_format(uploaded_file.name) is None:
+            st.error("不支援的檔案格式。請上傳 CSV、Parquet、Feather 或 XLSX 檔案。")
             st.stop()
 
-        df.columns = df.columns.str.strip() # 清理欄位名稱的空白字符
+        dataset_key = file_fingerprint(uploaded_file)
+        stop_prefetch(keep_dataset_key=dataset_key) # 上傳了新檔案：先取消前一個檔案的背景預先計算
+        with recorder.span("parse"):
+            df = load_uploaded_table(dataset_key, uploaded_file.name, uploaded_file.getvalue())
 
         st.success("檔案上傳成功！正在處理數據...")
 
-        # 使用自動數值轉換函數
-        df = convert_df_to_numeric(df)
+        # 數值轉換、名稱欄位、衍生指標與記憶體壓縮：同一檔案只處理一次
+        df, name_notice, compaction_report = load_processed_dataset(dataset_key, df, recorder)
+        recorder.register_metrics("記憶體壓縮", lambda: compaction.summary(compaction_report))
+        if name_notice:
+            level, message = name_notice
+            getattr(st, level)(message)
+
+        # 可編輯資料模式：修改只重新計算受影響的資料列與欄位
+        edit_layer = get_edit_layer(dataset_key, df)
+        recorder.register_metrics("資料編輯", edit_layer.stats)
+        if st.sidebar.toggle("✏️ 可編輯資料模式", key="edit_mode"):
+            render_data_editor(edit_layer)
+        df = edit_layer.frame()
 
-        # 確保必要的名稱欄位存在，且是字符串類型
-        # 嘗試尋找 'Name' 或 'name' 欄位作為公司名稱
-        if 'Name' not in df.columns and 'name' in df.columns:
-            df.rename(columns={'name': 'Name'}, inplace=True)
-        
-        # 如果依然沒有 'Name' 欄位，嘗試尋找其他可能的公司名稱欄位，或設定一個預設
-        if 'Name' not in df.columns:
-            # 尋找包含 '公司', '企業', '名稱' 等關鍵字的欄位
-            potential_name_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in ['公司', '企業', '名稱', 'entity', 'company'])]
-            if potential_name_cols:
-                df.rename(columns={potential_name_cols[0]: 'Name'}, inplace=True)
-                st.info(f"已將 '{potential_name_cols[0]}' 欄位識別為公司名稱 'Name'。")
-            else:
-                # 如果沒有找到，就創建一個索引作為名稱
-                df['Name'] = [f"公司_{i+1}" for i in range(len(df))]
-                st.warning("檔案中缺少 'Name' (或 'name') 欄位，已自動創建 '公司_X' 作為公司名稱。")
-        
-        # 確保 'Name' 欄位是字符串類型
-        df['Name'] = df['Name'].astype(str).str.strip()
-        
         # 將處理後的 DataFrame 儲存到 session_state
         st.session_state['processed_df'] = df
 
-        # 預先計算可能用到的欄位 (確保原始欄位存在才計算)
-        if "Balance sheet total" in df.columns and "Debt" in df.columns:
-            # 避免除以零
-            df["負債比率 (%)"] = df.apply(lambda row: (row["Debt"] / row["Balance sheet total"]) * 100 if row["Balance sheet total"] != 0 else np.nan, axis=1)
-            df["負債比率 (%)"].replace([np.inf, -np.inf], np.nan, inplace=True)
+        # 圖表需求定義在 pipeline.CHART_REQUIREMENTS
+        chart_requirements = pipeline.CHART_REQUIREMENTS
+
+        with recorder.span("availability_checks"):
+            # 動態判斷可用的圖表（只有可用圖表判斷讀取的欄位被修改時才重新判斷）
+            availability_layer = current_edit_layer(dataset_key)
+            sorted_available_charts = find_available_charts(
+                dataset_key, availability_layer.token(pipeline.AVAILABILITY_COLUMNS) if availability_layer else "", df)
+
+        # 背景預先計算（選用）：瀏覽資料時先準備通用圖表與估計成本最低的幾個特定圖表；資料經過編輯時不執行
+        if st.sidebar.toggle("⚡ 背景預先計算圖表", key="prefetch_enabled",
+                             help=f"在背景準備通用圖表與成本最低的 {prefetch.DEFAULT_SPECIFIC_CHARTS} 個特定圖表，"
+                                  f"每個檔案最多 {prefetch.DEFAULT_CPU_BUDGET_S:g} 秒、{prefetch.DEFAULT_MEMORY_BUDGET_BYTES // 1024 // 1024} MB") \
+                and current_edit_layer(dataset_key) is None:
+            prefetcher = start_prefetch(dataset_key, df, sorted_available_charts)
+            recorder.register_metrics("背景預先計算", prefetcher.stats)
+            prefetch_stats = prefetcher.stats()
+            st.sidebar.caption(f"⚡ 已預先準備 {prefetch_stats['done']} / {prefetch_stats['charts']} 個圖表"
+                               + ("（執行中）" if prefetch_stats["running"] else ""))
         else:
-            df["負債比率 (%)"] = np.nan # 如果欄位不存在或總和為零，則為 NaN
-        
-        # 總股東權益
-        if all(col in df.columns for col in ["Equity capital", "Reserves", "Preference capital"]):
-            df["總股東權益"] = df["Equity capital"] + df["Reserves"] + df["Preference capital"]
-        elif "Balance sheet total" in df.columns and "Debt" in df.columns:
-            # 如果沒有詳細股權資訊，則用資產總計減負債估算
-            df["總股東權益"] = df["Balance sheet total"] - df["Debt"]
-        else:
-            df["總股東權益"] = np.nan
-
-        # 流動比率
-        if "Current assets" in df.columns and "Current liabilities" in df.columns:
-            df["流動比率"] = df.apply(lambda row: row["Current assets"] / row["Current liabilities"] if row["Current liabilities"] != 0 else np.nan, axis=1)
-            df["流動比率"].replace([np.inf, -np.inf], np.nan, inplace=True)
-        else:
-            df["流動比率"] = np.nan
-
-        # ----------------------------------------------------
-        # 定義圖表需求 (基於欄位存在性，以字典儲存，方便動態檢查)
-        # 移除了原先硬性定義的檔案名，現在完全基於當前上傳的df來判斷
-        # 新增了更通用的圖表類型，增加彈性
-        # ----------------------------------------------------
-        chart_requirements = {
-            "資料概覽表格": {
-                "required": set(), # 無需特定欄位，顯示前幾行
-                "description": "顯示所有數據，並可滑動查看，同時包含數據類型和描述性統計。", # 更新描述
-                "type": "table_overview"
-            },
-            "數值欄位分佈直方圖": {
-                "required": set(), # 需要至少一個數值欄位，但不指定名稱
-                "description": "選擇一個數值型欄位，顯示其數據分佈的直方圖。",
-                "type": "dynamic_numeric_hist"
-            },
-            "類別欄位計數長條圖": {
-                "required": set(), # 需要至少一個類別欄位，但不指定名稱
-                "description": "選擇一個類別型欄位，顯示各類別項目數量最多的前20名長條圖。",
-                "type": "dynamic_categorical_bar"
-            },
-            "任意兩數值欄位散佈圖": { # 新增的通用散佈圖
-                "required": set(), # 需要至少兩個數值欄位
-                "description": "選擇任意兩個數值型欄位，分析它們之間的關係。",
-                "type": "dynamic_scatter"
-            },
-            "產業市值長條圖（前 8 名）": {
-                "required": {"Industry", "Market Capitalization"},
-                "description": "展示各產業的總市值分佈。",
-                "type": "bar"
-            },
-            "資產結構圓餅圖（單一公司）": {
-                "required": {"Name", "Net block", "Current assets", "Investments"},
-                "description": "顯示單一公司的淨固定資產、流動資產和投資在總資產中的佔比。",
-                "type": "pie"
-            },
-            "負債 vs 營運資金（散佈圖）": {
-                "required": {"Debt", "Working capital", "Name"},
-                "description": "分析負債與營運資金之間的關係，並識別特定公司。",
-                "type": "scatter"
-            },
-            "財務比率表格": {
-                "required": {"Name", "負債比率 (%)", "流動比率", "總股東權益", "Balance sheet total"},
-                "description": "顯示計算後的關鍵財務比率和基本資產負債數據。",
-                "type": "table"
-            },
-            "各年度營收趨勢圖（單一公司）": {
-                "required": {"Name", "Sales", "Sales last year", "Sales preceding year"},
-                "description": "追蹤單一公司在過去三個會計年度的營收變化。",
-                "type": "line"
-            },
-            "各年度淨利潤趨勢圖（單一公司）": {
-                "required": {"Name", "Profit after tax", "Profit after tax last year", "Profit after tax preceding year"},
-                "description": "追蹤單一公司在過去三個會計年度的淨利潤變化。",
-                "type": "line"
-            },
-            "各年度EPS趨勢圖（單一公司）": {
-                "required": {"Name", "EPS", "EPS last year", "EPS preceding year"},
-                "description": "追蹤單一公司在過去三個會計年度的每股盈餘 (EPS) 變化。",
-                "type": "line"
-            },
-            "ROE與ROCE比較圖（單一公司，最新年度）": {
-                "required": {"Name", "Return on equity", "Return on capital employed"},
-                "description": "比較單一公司最新年度的股東權益報酬率 (ROE) 和資本運用報酬率 (ROCE)。",
-                "type": "bar"
-            },
-            "本益比與股東權益報酬率散佈圖": {
-                "required": {"Price to Earning", "Return on equity", "Name"},
-                "description": "分析所有公司在本益比和股東權益報酬率之間的關係，有助於投資者評估。",
-                "type": "scatter"
-            },
-            "銷售額成長率排名（前20）": {
-                "required": {"Name", "Sales growth 3Years"},
-                "description": "列出過去三年銷售額成長最快的前 20 家公司。",
-                "type": "bar"
-            },
-            "利潤成長率排名（前20）": {
-                "required": {"Name", "Profit growth 3Years"},
-                "description": "列出過去三年利潤成長最快的前 20 家公司。",
-                "type": "bar"
-            },
-            "現金流量概覽圓餅圖（單一公司，最近一年）": {
-                "required": {"Name", "Cash from operations last year", "Cash from investing last year", "Cash from financing last year"},
-                "description": "展示單一公司最近一個會計年度的營運、投資和融資現金流分佈。",
-                "type": "pie"
-            },
-            "自由現金流趨勢圖（單一公司）": {
-                "required": {"Name", "Free cash flow last year", "Free cash flow preceding year", "Free cash flow 3years", "Free cash flow 5years", "Free cash flow 7years", "Free cash flow 10years"},
-                "description": "追蹤單一公司過去多年的自由現金流趨勢。",
-                "type": "line"
-            },
-            "股價相對表現趨勢圖（單一公司）": {
-                "required": {"Name", "Current Price", "t_1_price", "Return over 1year", "Return over 3years", "Return over 5years"},
-                "description": "展示單一公司在不同時間段的股價回報率。",
-                "type": "bar" 
-            },
-            "市值分佈直方圖": {
-                "required": {"Market Capitalization"},
-                "description": "顯示市場資本化的分佈情況。",
-                "type": "histogram"
-            },
-            "銷售額與淨利潤關係散佈圖": {
-                "required": {"Sales", "Net profit", "Name"},
-                "description": "分析公司銷售額與淨利潤之間的關係。",
-                "type": "scatter"
-            },
-            "平均股東權益報酬率排名（前20）": {
-                "required": {"Name", "Average return on equity 5Years"},
-                "description": "列出過去五年平均股東權益報酬率最高的前 20 家公司。",
-                "type": "bar"
-            },
-            "發起人持股比例分佈（圓餅圖）": {
-                "required": {"Promoter holding", "FII holding", "DII holding", "Public holding"},
-                "description": "顯示所有公司平均或單一公司發起人、外資、本土機構和公眾持股比例。",
-                "type": "pie"
-            }
-        }
-
-        # 動態判斷可用的圖表
-        available_charts = []
-        numeric_cols_df = df.select_dtypes(include=['number']).columns.tolist()
-        categorical_cols_df = df.select_dtypes(include=['object', 'category']).columns.tolist()
-
-        for chart_name, details in chart_requirements.items():
-            required_cols = details["required"]
-            
-            # 對於動態分佈圖，只需要有數值或類別欄位即可
-            if details["type"] == "table_overview":
-                available_charts.append(chart_name) # 資料概覽始終可用
-            elif details["type"] == "dynamic_numeric_hist" and numeric_cols_df:
-                available_charts.append(chart_name)
-            elif details["type"] == "dynamic_categorical_bar" and categorical_cols_df:
-                available_charts.append(chart_name)
-            elif details["type"] == "dynamic_scatter" and len(numeric_cols_df) >= 2:
-                available_charts.append(chart_name)
-            elif required_cols.issubset(df.columns): # 對於其他特定欄位圖表
-                # 額外檢查關鍵欄位是否至少有非NaN值，避免繪製空圖
-                if all(df[col].dropna().empty for col in required_cols if col in df.columns):
-                    continue # 如果所有關鍵欄位都為空，則跳過此圖表
-                available_charts.append(chart_name)
+            stop_prefetch()
 
         # --- Streamlit Sidebar for Chart Selection ---
         st.sidebar.header("📊 圖表選擇")
-        if available_charts:
-            # 將通用圖表選項排在最前面
-            generic_charts = ["資料概覽表格", "數值欄位分佈直方圖", "類別欄位計數長條圖", "任意兩數值欄位散佈圖"]
-            sorted_available_charts = [c for c in generic_charts if c in available_charts] + \
-                                      sorted([c for c in available_charts if c not in generic_charts])
-            
-            chart_option = st.sidebar.selectbox("🔽 根據資料欄位選擇分析圖表：", sorted_available_charts)
+        if sorted_available_charts:
+            chart_option = st.sidebar.selectbox("🔽 根據資料欄位選擇分析圖表：", sorted_available_charts, key="chart_option")
             st.sidebar.markdown(f"**圖表說明:** {chart_requirements[chart_option]['description']}")
         else:
             chart_option = None
             st.sidebar.warning("當前上傳的檔案沒有足夠的數據來生成任何建議的圖表。")
             
         # --- 主內容區塊的圖表顯示邏輯 ---
+        chart_span = recorder.start_span(f"chart:{chart_option}")
         if chart_option:
             # 顯示資料概覽
             if chart_option == "資料概覽表格":
                 st.subheader("📚 資料集概覽")
                 st.write("這是您的資料集：")
-                st.dataframe(df) # 顯示整個 DataFrame，並可滑動
+                if len(df) > OVERVIEW_MAX_ROWS:
+                    st.caption(f"共 {len(df):,} 列，只顯示前 {OVERVIEW_MAX_ROWS:,} 列；可開啟側邊欄的「可編輯資料模式」以產業或公司名稱篩選。")
+                st.dataframe(compaction.widen(df.head(OVERVIEW_MAX_ROWS))) # 顯示前 OVERVIEW_MAX_ROWS 列，並可滑動
+                with st.expander("🗜️ 記憶體壓縮（各欄位節省的位元組）"):
+                    totals = compaction.summary(compaction_report)
+                    st.caption(f"{totals['before_mb']:.2f} MB → {totals['after_mb']:.2f} MB（節省 {totals['saved_pct']:.1f}%）；"
+                               "float32 欄位只在能還原每個原始數值時使用，圖表與表格顯示的數值與壓縮前相同")
+                    st.dataframe(compaction_report, hide_index=True)
+                overview = prepare_chart_data(dataset_key, df, "overview", {}, slot="overview")
 
                 # 重新加入 df.info()
                 st.write("---") # 分隔線
                 st.write("資料集資訊：")
-                buffer = io.StringIO()
-                df.info(buf=buffer, verbose=True, show_counts=True)
-                st.text(buffer.getvalue())
+                st.text(overview["info"])
                 
                 # 重新加入描述性統計
                 st.write("---") # 分隔線
                 st.write("數值欄位的描述性統計：")
-                st.dataframe(df.describe().T)
+                st.dataframe(overview["numeric_describe"])
                 
                 st.write("---") # 分隔線
                 st.write("類別欄位的描述性統計：")
-                st.dataframe(df.describe(include='object').T)
+                if not overview["object_describe"].empty:
+                    st.dataframe(overview["object_describe"])
+                else:
+                    st.info("資料集中沒有類別型欄位。")
 
             # 動態生成數值欄位直方圖
             elif chart_option == "數值欄位分佈直方圖":
@@ -337,13 +584,9 @@ if uploaded_file is not None:
                 if numeric_cols:
                     selected_num_col = st.selectbox("請選擇一個數值欄位來繪製直方圖：", sorted(numeric_cols), key="dynamic_hist_col")
                     if selected_num_col:
-                        df_valid = df.dropna(subset=[selected_num_col])
-                        if not df_valid.empty:
-                            fig = px.histogram(df_valid, x=selected_num_col,
-                                               title=f"{selected_num_col} 的分佈",
-                                               labels={selected_num_col: selected_num_col},
-                                               nbins=30)
-                            st.plotly_chart(fig, use_container_width=True)
+                        if df[selected_num_col].notna().any():
+                            render_histogram(dataset_key, df, chart_option, selected_num_col,
+                                             f"{selected_num_col} 的分佈", selected_num_col, key="dynamic_hist")
                         else:
                             st.warning(f"欄位 '{selected_num_col}' 沒有足夠的非空數據來繪製直方圖。")
                 else:
@@ -352,21 +595,17 @@ if uploaded_file is not None:
             # 動態生成類別欄位計數長條圖
             elif chart_option == "類別欄位計數長條圖":
                 st.subheader("📊 類別欄位計數長條圖")
-                categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
+                categorical_cols = df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
                 if categorical_cols:
                     selected_cat_col = st.selectbox("請選擇一個類別欄位來繪製長條圖：", sorted(categorical_cols), key="dynamic_bar_col")
                     if selected_cat_col:
-                        df_valid = df.dropna(subset=[selected_cat_col])
-                        if not df_valid.empty:
-                            # 取前20個最常見的類別，避免圖形過於擁擠
-                            top_categories = df_valid[selected_cat_col].value_counts().nlargest(20).index.tolist()
-                            plot_df = df_valid[df_valid[selected_cat_col].isin(top_categories)]
-
-                            fig = px.bar(plot_df, y=selected_cat_col, orientation='h',
-                                         title=f"{selected_cat_col} 的計數分佈 (前20)",
-                                         labels={selected_cat_col: selected_cat_col, "count": "計數"})
-                            fig.update_layout(yaxis={'categoryorder':'total ascending'}) # 讓數量多的在上方
-                            st.plotly_chart(fig, use_container_width=True)
+                        # 在伺服器端計數，只送出前20個最常見類別的計數，避免圖形過於擁擠
+                        counts = prepare_chart_data(dataset_key, df, "category_counts",
+                                                    {"column": selected_cat_col, "top_n": 20}, slot="dynamic_bar")["data"]
+                        if not counts.empty:
+                            def build_figure():
+                                return category_figure(counts, selected_cat_col)
+                            render_figure(dataset_key, chart_option, (selected_cat_col,), build_figure)
                         else:
                             st.warning(f"欄位 '{selected_cat_col}' 沒有足夠的非空數據來繪製長條圖。")
                 else:
@@ -388,15 +627,14 @@ if uploaded_file is not None:
                         col2 = None
 
                     if col1 and col2:
-                        df_valid = df.dropna(subset=[col1, col2])
+                        prepared = prepare_chart_data(dataset_key, df, "scatter", dynamic_scatter_params(df, col1, col2), slot="dynamic_scatter")
+                        df_valid = prepared["data"]
                         if not df_valid.empty:
-                            fig = px.scatter(df_valid, x=col1, y=col2,
-                                             title=f"{col1} vs {col2} 散佈圖",
-                                             labels={col1: col1, col2: col2},
-                                             hover_name="Name" if "Name" in df_valid.columns else None, # 如果有公司名稱欄位，顯示在懸停提示中
-                                             color="Industry" if "Industry" in df_valid.columns else None, # 如果有產業欄位，按產業區分顏色
-                                             trendline="ols" if len(df_valid) > 2 else None) # 如果數據點夠多，顯示趨勢線
-                            st.plotly_chart(fig, use_container_width=True)
+                            overlay_params, overlay = anomaly_overlay(dataset_key, df, df_valid, col1, col2, key="dynamic_scatter")
+                            def build_figure():
+                                fig = dynamic_scatter_figure(prepared, col1, col2)
+                                return overlay(fig) if overlay else fig
+                            render_figure(dataset_key, chart_option, (col1, col2) + overlay_params, build_figure)
                         else:
                             st.warning(f"所選欄位 '{col1}' 和 '{col2}' 沒有足夠的非空數據來繪製散佈圖。")
                     else:
@@ -404,22 +642,103 @@ if uploaded_file is not None:
                 else:
                     st.warning("資料集中數值型欄位不足兩個，無法繪製散佈圖。")
 
+            elif chart_option == "相關係數矩陣":
+                st.subheader("🔗 相關係數矩陣")
+                col1, col2 = st.columns(2)
+                with col1:
+                    method_label = st.radio("方法", list(CORRELATION_METHODS), horizontal=True, key="correlation_method",
+                                            help="Spearman 以名次計算，適合偏態明顯或有極端值的指標")
+                    method = CORRELATION_METHODS[method_label]
+                with col2:
+                    industry = "全部產業"
+                    if "Industry" in df.columns:
+                        industry = st.selectbox("產業", ["全部產業"] + sorted(df["Industry"].dropna().astype(str).unique().tolist()), key="correlation_industry")
+                correlation = prepare_chart_data(dataset_key, df, "correlation", {
+                    "method": method, "industry": None if industry == "全部產業" else industry,
+                }, slot="correlation")
+                matrix, pairs = correlation["matrix"], correlation["pairs"]
+
+                if pairs.empty:
+                    st.warning("數值欄位的共同有效數據不足，無法計算相關係數。")
+                else:
+                    st.caption(f"{correlation['n_rows']:,} 家公司、{len(matrix)} 個數值欄位；缺值逐對排除，共同有效數據少於 3 筆的組合不計算。")
+                    def build_figure():
+                        return correlation_figure(correlation, method_label, industry)
+                    render_figure(dataset_key, chart_option, (method, industry), build_figure)
+
+                    st.write("相關性最強的欄位組合：")
+                    top_pairs = pairs.head(CORRELATION_TOP_PAIRS)
+                    st.dataframe(top_pairs.rename(columns={"x": "欄位 1", "y": "欄位 2", "r": "相關係數", "n": "共同數據筆數"}), hide_index=True)
+                    pair_labels = [f"{x} × {y}（r = {r:.3f}）" for x, y, r in zip(top_pairs["x"], top_pairs["y"], top_pairs["r"])]
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        selected_pair = st.selectbox("選擇欄位組合", range(len(top_pairs)), format_func=lambda i: pair_labels[i], key="correlation_pair")
+                    with col2:
+                        st.button("🔍 查看散佈圖", on_click=open_pair_scatter, key="correlation_open_scatter",
+                                  args=(top_pairs["x"].iloc[selected_pair], top_pairs["y"].iloc[selected_pair]))
+
+            elif chart_option == "異常公司":
+                st.subheader("🚩 異常公司")
+                st.caption("依產業分組，對所有數值欄位計算穩健 Z 分數或四分位距 (IQR) 分數，列出數值明顯偏離同業的公司；"
+                           "同產業公司過少時改與全體公司比較。股東權益為負的公司一律列出。")
+                col1, col2 = st.columns(2)
+                with col1:
+                    method_label = st.radio("判斷方法", list(ANOMALY_METHODS), horizontal=True, key="anomaly_method")
+                    method = ANOMALY_METHODS[method_label]
+                with col2:
+                    low, high, default, step = ANOMALY_THRESHOLD_RANGES[method]
+                    threshold = st.slider("門檻（|分數| 超過即為異常）", min_value=low, max_value=high, value=default, step=step,
+                                          key=f"anomaly_threshold_{method}")
+                st.session_state["anomaly_settings"] = (method, threshold) # 散佈圖的異常標示沿用此設定
+                anomalies = prepare_chart_data(dataset_key, df, "anomalies", {"method": method, "threshold": threshold}, slot="anomalies")
+                summary, details = anomalies["summary"], anomalies["details"]
+
+                if summary.empty:
+                    st.info("沒有找到異常公司。")
+                else:
+                    st.write(f"共 {len(summary):,} / {anomalies['n_rows']:,} 家公司有異常值。")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        industry_options = ["全部"] + sorted(summary["Industry"].dropna().astype(str).unique().tolist())
+                        selected_industry = st.selectbox("產業", industry_options, key="anomaly_industry")
+                    with col2:
+                        selected_columns = st.multiselect("只看這些欄位的異常", anomalies["column_counts"]["column"].tolist(), key="anomaly_columns")
+                    with col3:
+                        min_count = st.number_input("最少異常欄位數", min_value=1, value=1, step=1, key="anomaly_min_count")
+
+                    filtered = summary[summary["anomalies"] >= min_count]
+                    filtered_details = details
+                    if selected_industry != "全部":
+                        filtered = filtered[filtered["Industry"].astype(str) == selected_industry]
+                    if selected_columns:
+                        filtered_details = details[details["column"].isin(selected_columns)]
+                        filtered = filtered[filtered["index"].isin(filtered_details["index"])]
+                    filtered_details = filtered_details[filtered_details["index"].isin(filtered["index"])]
+
+                    st.dataframe(filtered.drop(columns="index").rename(columns={
+                        "Name": "公司", "Industry": "產業", "anomalies": "異常欄位數", "max_abs_score": "最大 |分數|", "columns": "異常欄位",
+                    }), hide_index=True)
+                    st.download_button("📥 下載異常明細 (CSV)", filtered_details.drop(columns="index").to_csv(index=False).encode("utf-8-sig"),
+                                       file_name="anomalies.csv", mime="text/csv", key="anomaly_download")
+
+                    company_options = filtered["Name"].astype(str).tolist()
+                    if company_options:
+                        selected_company = st.selectbox("查看公司的異常明細", company_options, key="anomaly_company")
+                        company_index = filtered.loc[filtered["Name"].astype(str) == selected_company, "index"].iloc[0]
+                        st.dataframe(filtered_details[filtered_details["index"] == company_index].drop(columns=["index", "Name", "Industry"]).rename(columns={
+                            "column": "欄位", "value": "數值", "median": "產業中位數", "score": "分數", "reason": "判斷依據",
+                        }), hide_index=True)
+
+                    def build_figure():
+                        return anomaly_counts_figure(anomalies)
+                    render_figure(dataset_key, chart_option, ("column_counts", method, threshold), build_figure)
+
             elif chart_option == "產業市值長條圖（前 8 名）":
                 st.subheader("🏭 各產業市值分佈 (前 8 名)")
-                df_valid = df.dropna(subset=["Industry", "Market Capitalization"])
-                if not df_valid.empty:
-                    industry_market = df_valid.groupby("Industry", as_index=False)["Market Capitalization"].sum()
-                    industry_market = industry_market.sort_values("Market Capitalization", ascending=False)
-
-                    top_n = 8
-                    top_industries = industry_market.head(top_n) # 只取前 N 名，不包含「其他」
-                    
-                    fig = px.bar(top_industries,
-                                 x="Industry", y="Market Capitalization",
-                                 title="前 8 名產業市值",
-                                 text_auto=True,
-                                 labels={"Market Capitalization": "市值"})
-                    st.plotly_chart(fig, use_container_width=True)
+                # 只取前 N 名，不包含「其他」
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                if not prepared["data"].empty:
+                    render_figure(dataset_key, chart_option, (), fixed_chart_builder(chart_option, prepared, df))
                 else:
                     st.warning("沒有足夠的『Industry』和『Market Capitalization』數據來繪製此圖。")
 
@@ -428,7 +747,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="asset_pie_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     pie_cols = {"Net block": "淨固定資產", "Current assets": "流動資產", "Investments": "投資"}
                     plot_data = pd.DataFrame([
@@ -438,12 +757,14 @@ if uploaded_file is not None:
                     ])
 
                     if not plot_data.empty:
-                        fig = px.pie(plot_data,
-                                     values='金額',
-                                     names='資產類型',
-                                     title=f"{selected_company} 的資產結構",
-                                     hole=0.3)
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.pie(plot_data,
+                                         values='金額',
+                                         names='資產類型',
+                                         title=f"{selected_company} 的資產結構",
+                                         hole=0.3)
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的『淨固定資產』、『流動資產』或『投資』數據（或數據為零/負數）來繪製資產結構圖。")
                 else:
@@ -451,25 +772,19 @@ if uploaded_file is not None:
 
             elif chart_option == "負債 vs 營運資金（散佈圖）":
                 st.subheader("📉 負債 vs 營運資金")
-                df_valid = df.dropna(subset=["Debt", "Working capital", "Name"])
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                df_valid = prepared["data"]
                 if not df_valid.empty:
-                    fig = px.scatter(df_valid,
-                                     x="Debt", y="Working capital",
-                                     hover_name="Name",
-                                     title="負債與營運資金的關係",
-                                     labels={"Debt": "負債", "Working capital": "營運資金"},
-                                     color="Industry" if "Industry" in df_valid.columns else None,
-                                     trendline="ols" if len(df_valid) > 2 else None)
-                    st.plotly_chart(fig, use_container_width=True)
+                    overlay_params, overlay = anomaly_overlay(dataset_key, df, df_valid, "Debt", "Working capital", key="debt_scatter")
+                    render_figure(dataset_key, chart_option, overlay_params, fixed_chart_builder(chart_option, prepared, df, overlay))
                 else:
                     st.warning("沒有足夠的『Debt』或『Working capital』數據來繪製此圖。")
 
             elif chart_option == "財務比率表格":
                 st.subheader("📋 財務比率表格")
-                show_cols = ["Name", "負債比率 (%)", "流動比率", "總股東權益", "Balance sheet total"]
-                available_cols = [col for col in show_cols if col in df.columns]
-                if available_cols:
-                    st.dataframe(df[available_cols].round(2))
+                ratios = pipeline.ratio_table(df)
+                if ratios is not None:
+                    st.dataframe(ratios)
                 else:
                     st.warning("無法顯示財務比率表格，因為缺少所需的計算欄位或原始欄位。")
 
@@ -478,7 +793,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="sales_trend_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     sales_series = {}
                     if "Sales" in company_data and pd.notna(company_data["Sales"]): sales_series["最新年度"] = company_data["Sales"]
@@ -492,11 +807,13 @@ if uploaded_file is not None:
                         sales_df["_sort_key"] = sales_df["年度"].map(year_order)
                         sales_df = sales_df.sort_values("_sort_key").drop(columns="_sort_key")
 
-                        fig = px.line(sales_df, x='年度', y='營收',
-                                      title=f"{selected_company} 年度營收趨勢",
-                                      markers=True,
-                                      labels={"營收": "營收"})
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.line(sales_df, x='年度', y='營收',
+                                          title=f"{selected_company} 年度營收趨勢",
+                                          markers=True,
+                                          labels={"營收": "營收"})
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的年度營收數據來繪製趨勢圖。")
                 else:
@@ -507,7 +824,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="profit_trend_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     profit_series = {}
                     if "Profit after tax" in company_data and pd.notna(company_data["Profit after tax"]): profit_series["最新年度"] = company_data["Profit after tax"]
@@ -521,11 +838,13 @@ if uploaded_file is not None:
                         profit_df["_sort_key"] = profit_df["年度"].map(year_order)
                         profit_df = profit_df.sort_values("_sort_key").drop(columns="_sort_key")
 
-                        fig = px.line(profit_df, x='年度', y='淨利潤',
-                                      title=f"{selected_company} 年度淨利潤趨勢",
-                                      markers=True,
-                                      labels={"淨利潤": "淨利潤"})
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.line(profit_df, x='年度', y='淨利潤',
+                                          title=f"{selected_company} 年度淨利潤趨勢",
+                                          markers=True,
+                                          labels={"淨利潤": "淨利潤"})
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的年度淨利潤數據來繪製趨勢圖。")
                 else:
@@ -536,7 +855,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="eps_trend_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     eps_series = {}
                     if "EPS" in company_data and pd.notna(company_data["EPS"]): eps_series["最新年度"] = company_data["EPS"]
@@ -550,10 +869,12 @@ if uploaded_file is not None:
                         eps_df["_sort_key"] = eps_df["年度"].map(year_order)
                         eps_df = eps_df.sort_values("_sort_key").drop(columns="_sort_key")
 
-                        fig = px.line(eps_df, x='年度', y='EPS',
-                                      title=f"{selected_company} 年度EPS趨勢",
-                                      markers=True)
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.line(eps_df, x='年度', y='EPS',
+                                          title=f"{selected_company} 年度EPS趨勢",
+                                          markers=True)
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的年度EPS數據來繪製趨勢圖。")
                 else:
@@ -564,7 +885,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="roce_roe_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     metrics_data = {}
                     if "Return on equity" in company_data and pd.notna(company_data["Return on equity"]):
@@ -577,11 +898,13 @@ if uploaded_file is not None:
                     metrics_df = metrics_df.dropna()
 
                     if not metrics_df.empty:
-                        fig = px.bar(metrics_df, x='指標', y='數值',
-                                     title=f"{selected_company} 股東權益報酬率與資本運用報酬率 (最新年度)",
-                                     text_auto=True,
-                                     labels={"數值": "百分比 (%)"})
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.bar(metrics_df, x='指標', y='數值',
+                                         title=f"{selected_company} 股東權益報酬率與資本運用報酬率 (最新年度)",
+                                         text_auto=True,
+                                         labels={"數值": "百分比 (%)"})
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的 ROE 或 ROCE 數據來繪製。")
                 else:
@@ -589,46 +912,27 @@ if uploaded_file is not None:
 
             elif chart_option == "本益比與股東權益報酬率散佈圖":
                 st.subheader("💹 本益比與股東權益報酬率")
-                df_valid = df.dropna(subset=["Price to Earning", "Return on equity", "Name"])
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                df_valid = prepared["data"]
                 if not df_valid.empty:
-                    fig = px.scatter(df_valid,
-                                     x="Price to Earning", y="Return on equity",
-                                     hover_name="Name",
-                                     title="本益比 (P/E) 與股東權益報酬率 (ROE) 的關係",
-                                     labels={"Price to Earning": "本益比", "Return on equity": "股東權益報酬率 (%)"},
-                                     color="Industry" if "Industry" in df.columns else None, # 如果有產業欄位，可以按產業區分顏色
-                                     size="Market Capitalization" if "Market Capitalization" in df.columns else None, # 以市值大小區分點大小
-                                     hover_data=["Industry", "Market Capitalization"] if "Industry" in df.columns and "Market Capitalization" in df.columns else None
-                                     )
-                    st.plotly_chart(fig, use_container_width=True)
+                    overlay_params, overlay = anomaly_overlay(dataset_key, df, df_valid, "Price to Earning", "Return on equity", key="pe_roe_scatter")
+                    render_figure(dataset_key, chart_option, overlay_params, fixed_chart_builder(chart_option, prepared, df, overlay))
                 else:
                     st.warning("沒有足夠的『Price to Earning』或『Return on equity』數據來繪製此圖。")
 
             elif chart_option == "銷售額成長率排名（前20）":
                 st.subheader("🏆 銷售額成長率排名 (前 20 名)")
-                df_valid = df.dropna(subset=["Name", "Sales growth 3Years"])
-                if not df_valid.empty:
-                    top_sales_growth = df_valid.sort_values("Sales growth 3Years", ascending=False).head(20)
-                    fig = px.bar(top_sales_growth,
-                                 x="Name", y="Sales growth 3Years",
-                                 title="銷售額成長率 (3 年) 前 20 名公司",
-                                 text_auto=True,
-                                 labels={"Sales growth 3Years": "銷售額成長率 (%)"})
-                    st.plotly_chart(fig, use_container_width=True)
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                if not prepared["data"].empty:
+                    render_figure(dataset_key, chart_option, (), fixed_chart_builder(chart_option, prepared, df))
                 else:
                     st.warning("沒有足夠的『Sales growth 3Years』數據來進行排名。")
 
             elif chart_option == "利潤成長率排名（前20）":
                 st.subheader("💰 利潤成長率排名 (前 20 名)")
-                df_valid = df.dropna(subset=["Name", "Profit growth 3Years"])
-                if not df_valid.empty:
-                    top_profit_growth = df_valid.sort_values("Profit growth 3Years", ascending=False).head(20)
-                    fig = px.bar(top_profit_growth,
-                                 x="Name", y="Profit growth 3Years",
-                                 title="利潤成長率 (3 年) 前 20 名公司",
-                                 text_auto=True,
-                                 labels={"Profit growth 3Years": "利潤成長率 (%)"})
-                    st.plotly_chart(fig, use_container_width=True)
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                if not prepared["data"].empty:
+                    render_figure(dataset_key, chart_option, (), fixed_chart_builder(chart_option, prepared, df))
                 else:
                     st.warning("沒有足夠的『Profit growth 3Years』數據來進行排名。")
             
@@ -637,7 +941,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="cash_flow_pie_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     cash_flow_sources = {
                         "來自營運的現金": company_data.get("Cash from operations last year"),
@@ -651,10 +955,12 @@ if uploaded_file is not None:
                     cash_flow_df = cash_flow_df[cash_flow_df['金額'] != 0] 
 
                     if not cash_flow_df.empty:
-                        fig = px.pie(cash_flow_df, values='金額', names='來源',
-                                     title=f"{selected_company} 最近一年現金流量概覽",
-                                     hole=0.3)
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.pie(cash_flow_df, values='金額', names='來源',
+                                         title=f"{selected_company} 最近一年現金流量概覽",
+                                         hole=0.3)
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的現金流量數據來繪製概覽圖。")
                 else:
@@ -665,7 +971,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="fcf_trend_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     fcf_series = {}
                     if "Free cash flow last year" in company_data and pd.notna(company_data["Free cash flow last year"]): fcf_series["去年"] = company_data["Free cash flow last year"]
@@ -687,11 +993,13 @@ if uploaded_file is not None:
                         fcf_df['sort_key'] = fcf_df['年度/期間'].map(order_map)
                         fcf_df = fcf_df.sort_values('sort_key').drop(columns='sort_key')
 
-                        fig = px.line(fcf_df, x='年度/期間', y='自由現金流',
-                                      title=f"{selected_company} 自由現金流趨勢",
-                                      markers=True,
-                                      labels={"自由現金流": "自由現金流"})
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.line(fcf_df, x='年度/期間', y='自由現金流',
+                                          title=f"{selected_company} 自由現金流趨勢",
+                                          markers=True,
+                                          labels={"自由現金流": "自由現金流"})
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的自由現金流數據來繪製趨勢圖。")
                 else:
@@ -702,7 +1010,7 @@ if uploaded_file is not None:
                 company_list = df["Name"].dropna().unique().tolist()
                 if company_list:
                     selected_company = st.selectbox("請選擇公司", sorted(company_list), key="price_perf_company")
-                    company_data = df[df["Name"] == selected_company].iloc[0]
+                    company_data = company_row(df, selected_company)
 
                     price_metrics = {}
                     if "Return over 1year" in company_data and pd.notna(company_data["Return over 1year"]): price_metrics["1年回報率"] = company_data["Return over 1year"]
@@ -714,11 +1022,13 @@ if uploaded_file is not None:
                     if not price_df.empty:
                         # 可以進一步加入 Current Price vs t_1_price 的比較，如果需要更詳細的點對點趨勢
                         # 但目前的設計更適合 bar chart 顯示不同期間的回報率
-                        fig = px.bar(price_df, x='期間', y='回報率',
-                                     title=f"{selected_company} 股價相對表現",
-                                     text_auto=True,
-                                     labels={"回報率": "回報率 (%)"})
-                        st.plotly_chart(fig, use_container_width=True)
+                        def build_figure():
+                            fig = px.bar(price_df, x='期間', y='回報率',
+                                         title=f"{selected_company} 股價相對表現",
+                                         text_auto=True,
+                                         labels={"回報率": "回報率 (%)"})
+                            return fig
+                        render_figure(dataset_key, chart_option, (selected_company,), build_figure)
                     else:
                         st.warning(f"公司 {selected_company} 沒有足夠的股價回報數據來繪製。")
                 else:
@@ -726,41 +1036,27 @@ if uploaded_file is not None:
 
             elif chart_option == "市值分佈直方圖":
                 st.subheader("📈 市值分佈直方圖")
-                df_valid = df.dropna(subset=["Market Capitalization"])
-                if not df_valid.empty:
-                    fig = px.histogram(df_valid, x="Market Capitalization",
-                                       title="市場資本化分佈",
-                                       labels={"Market Capitalization": "市值"},
-                                       nbins=30)
-                    st.plotly_chart(fig, use_container_width=True)
+                if df["Market Capitalization"].notna().any():
+                    render_histogram(dataset_key, df, chart_option, "Market Capitalization", "市場資本化分佈", "市值",
+                                     key="market_cap_hist")
                 else:
                     st.warning("沒有足夠的『Market Capitalization』數據來繪製此圖。")
 
             elif chart_option == "銷售額與淨利潤關係散佈圖":
                 st.subheader("📈 銷售額與淨利潤關係")
-                df_valid = df.dropna(subset=["Sales", "Net profit", "Name"])
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                df_valid = prepared["data"]
                 if not df_valid.empty:
-                    fig = px.scatter(df_valid, x="Sales", y="Net profit",
-                                     hover_name="Name",
-                                     title="銷售額與淨利潤的關係",
-                                     labels={"Sales": "銷售額", "Net profit": "淨利潤"},
-                                     color="Industry" if "Industry" in df_valid.columns else None,
-                                     trendline="ols" if len(df_valid) > 2 else None)
-                    st.plotly_chart(fig, use_container_width=True)
+                    overlay_params, overlay = anomaly_overlay(dataset_key, df, df_valid, "Sales", "Net profit", key="sales_profit_scatter")
+                    render_figure(dataset_key, chart_option, overlay_params, fixed_chart_builder(chart_option, prepared, df, overlay))
                 else:
                     st.warning("沒有足夠的『Sales』或『Net profit』數據來繪製此圖。")
 
             elif chart_option == "平均股東權益報酬率排名（前20）":
                 st.subheader("🏆 平均股東權益報酬率排名 (前 20 名)")
-                df_valid = df.dropna(subset=["Name", "Average return on equity 5Years"])
-                if not df_valid.empty:
-                    top_roe_avg = df_valid.sort_values("Average return on equity 5Years", ascending=False).head(20)
-                    fig = px.bar(top_roe_avg,
-                                 x="Name", y="Average return on equity 5Years",
-                                 title="平均股東權益報酬率 (5 年) 前 20 名公司",
-                                 text_auto=True,
-                                 labels={"Average return on equity 5Years": "平均股東權益報酬率 (%)"})
-                    st.plotly_chart(fig, use_container_width=True)
+                prepared = prepare_fixed_chart(dataset_key, df, chart_option)
+                if not prepared["data"].empty:
+                    render_figure(dataset_key, chart_option, (), fixed_chart_builder(chart_option, prepared, df))
                 else:
                     st.warning("沒有足夠的『Average return on equity 5Years』數據來進行排名。")
 
@@ -776,7 +1072,7 @@ if uploaded_file is not None:
 
                     if selected_share_option == "顯示所有公司平均持股":
                         # 計算平均持股比例
-                        avg_holdings = df[["Promoter holding", "FII holding", "DII holding", "Public holding"]].mean().dropna()
+                        avg_holdings = compaction.widen(df[["Promoter holding", "FII holding", "DII holding", "Public holding"]]).mean().dropna()
                         
                         if not avg_holdings.empty:
                             holdings_df = pd.DataFrame(avg_holdings.items(), columns=['持股類型', '比例'])
@@ -785,10 +1081,12 @@ if uploaded_file is not None:
                             holdings_df = holdings_df[holdings_df['比例'] > 0] # 移除零值或負值
 
                             if not holdings_df.empty:
-                                fig = px.pie(holdings_df, values='比例', names='持股類型',
-                                             title="所有公司平均持股比例分佈",
-                                             hole=0.3)
-                                st.plotly_chart(fig, use_container_width=True)
+                                def build_figure():
+                                    fig = px.pie(holdings_df, values='比例', names='持股類型',
+                                                 title="所有公司平均持股比例分佈",
+                                                 hole=0.3)
+                                    return fig
+                                render_figure(dataset_key, chart_option, (selected_share_option,), build_figure)
                             else:
                                 st.warning("沒有足夠的平均持股數據來繪製圓餅圖。")
                         else:
@@ -798,7 +1096,7 @@ if uploaded_file is not None:
                         company_list = df["Name"].dropna().unique().tolist()
                         if company_list:
                             selected_company = st.selectbox("請選擇公司", sorted(company_list), key="share_holding_company")
-                            company_data = df[df["Name"] == selected_company].iloc[0]
+                            company_data = company_row(df, selected_company)
 
                             company_holdings = {
                                 "發起人持股": company_data.get("Promoter holding"),
@@ -813,19 +1111,28 @@ if uploaded_file is not None:
                             holdings_df = holdings_df[holdings_df['比例'] > 0] # 移除零值或負值
 
                             if not holdings_df.empty:
-                                fig = px.pie(holdings_df, values='比例', names='持股類型',
-                                             title=f"{selected_company} 持股比例分佈",
-                                             hole=0.3)
-                                st.plotly_chart(fig, use_container_width=True)
+                                def build_figure():
+                                    fig = px.pie(holdings_df, values='比例', names='持股類型',
+                                                 title=f"{selected_company} 持股比例分佈",
+                                                 hole=0.3)
+                                    return fig
+                                render_figure(dataset_key, chart_option, (selected_share_option, selected_company), build_figure)
                             else:
                                 st.warning(f"公司 {selected_company} 沒有足夠的持股比例數據來繪製圓餅圖。")
                         else:
                             st.warning("沒有可供選擇的公司來繪製持股比例圖。")
                 else:
                     st.warning("缺少『Promoter holding』、『FII holding』、『DII holding』或『Public holding』等關鍵持股欄位來繪製此圖。")
+        recorder.end_span(chart_span)
 
     except Exception as e:
+        recorder.end_span(chart_span, error=type(e).__name__) # 圖表區段因例外中斷時仍要結束
         st.error(f"處理檔案時發生錯誤：{e}")
         st.info("請檢查您的檔案格式和數據內容是否符合預期。")
 else:
-    st.info("請上傳您的財務數據檔案以開始分析。")
\ No newline at end of file
+    st.info("請上傳您的財務數據檔案以開始分析。")
+
+# --- 效能除錯面板 ---
+recorder.end_run()
+if recorder.enabled:
+    perf.render_panel(st.sidebar, recorder)
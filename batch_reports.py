@@ -0,0 +1,253 @@
+# batch_reports.py
+# 產業批次報告：為產業內每家選定的公司各產生一份 CFO / COO / CEO 整合報告
+# - 每家公司的提示詞在建立批次時由 processed_df 中該公司的資料列組成，連同批次資訊寫入磁碟
+# - 報告完成一份就寫入一份檔案，進度由磁碟上的檔案判斷，任何工作階段都看得到
+# - 伺服器重啟後，尚未完成的公司可用任一工作階段的 API Key 繼續執行（API Key 不會寫入磁碟）
+# - 請求經由全程序共用的 LLM 排程器送出，另以每個批次的並行上限控制同時送出的數量
+import json
+import numbers
+import os
+import threading
+import time
+import uuid
+
+import compaction
+import lazy_imports
+import llm_scheduler
+
+pd = lazy_imports.lazy("pandas")
+
+JOBS_DIR = os.environ.get("REPORT_JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".report_jobs"))
+REPORT_MODEL = "gemini-1.5-flash"
+DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_REPORT_CONCURRENCY", "3"))
+
+
+# 函數：由公司的資料列組成報告提示詞（只列出有數值的欄位）
+# 數值與儀表板的表格相同，以千分位、小數點後兩位的定點格式呈現，大數值不會變成科學記號
+def build_company_prompt(row, industry):
+    lines = []
+    for col, value in row.items():
+        if col in ("Name", "Industry") or pd.isna(value):
+            continue
+        lines.append(f"- {col}: {value:,.2f}" if isinstance(value, numbers.Real) and not isinstance(value, bool) else f"- {col}: {value}")
+    data = "\n".join(lines)
+    return f"""
+模擬一個由 CFO、COO、CEO 組成的專家團隊，根據以下公司的財務數據生成完整整合報告：
+公司: {row.get("Name")}
+產業: {industry}
+
+財務數據:
+{data}
+
+報告要求：
+1. 📊 CFO 分析: 財務指標、成本效益、投資回報。
+2. 🏭 COO 分析: 營運可行性、流程與風險。
+3. 👑 CEO 最終決策: 綜合以上觀點，提供戰略總結與後續行動建議。
+"""
+
+
+# ---------- 磁碟上的批次資料 ----------
+# {JOBS_DIR}/{批次 ID}/batch.json      批次資訊（產業、模型、公司名稱）
+# {JOBS_DIR}/{批次 ID}/items.json      每家公司的提示詞
+# {JOBS_DIR}/{批次 ID}/reports/{i}.md  已完成的報告
+# {JOBS_DIR}/{批次 ID}/reports/{i}.err 最近一次失敗的錯誤訊息
+
+def _write_atomic(path, text):
+    # 先寫暫存檔再改名，伺服器中途停止也不會留下寫到一半的檔案
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _batch_dir(batch_id, jobs_dir=JOBS_DIR):
+    return os.path.join(jobs_dir, batch_id)
+
+
+def create_batch(df, industry, names, jobs_dir=JOBS_DIR, model=REPORT_MODEL):
+    # 壓縮過的欄位先還原 (compaction.widen)，float32 的數值在小數點後兩位不會出現誤差
+    rows = compaction.widen(df[(df["Industry"] == industry) & df["Name"].isin(names)])
+    batch_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    os.makedirs(os.path.join(_batch_dir(batch_id, jobs_dir), "reports"))
+    items = [{"index": i, "name": str(row["Name"]), "prompt": build_company_prompt(row.to_dict(), industry)}
+             for i, (_, row) in enumerate(rows.iterrows())]
+    _write_atomic(os.path.join(_batch_dir(batch_id, jobs_dir), "items.json"), json.dumps(items, ensure_ascii=False))
+    meta = {"id": batch_id, "industry": str(industry), "model": model, "created_at": time.time(),
+            "names": [item["name"] for item in items]}
+    _write_atomic(os.path.join(_batch_dir(batch_id, jobs_dir), "batch.json"), json.dumps(meta, ensure_ascii=False))
+    return batch_id
+
+
+def load_items(batch_id, jobs_dir=JOBS_DIR):
+    with open(os.path.join(_batch_dir(batch_id, jobs_dir), "items.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def batch_progress(batch_id, jobs_dir=JOBS_DIR):
+    # 回傳 {index: "done" | "failed"}；沒有出現的 index 代表尚未完成
+    status = {}
+    for filename in os.listdir(os.path.join(_batch_dir(batch_id, jobs_dir), "reports")):
+        stem, ext = os.path.splitext(filename)
+        if ext == ".md":
+            status[int(stem)] = "done"
+        elif ext == ".err" and status.get(int(stem)) != "done":
+            status[int(stem)] = "failed"
+    return status
+
+
+def list_batches(jobs_dir=JOBS_DIR):
+    # 依建立時間由新到舊列出所有批次，附上完成 / 失敗數
+    batches = []
+    if not os.path.isdir(jobs_dir):
+        return batches
+    for batch_id in os.listdir(jobs_dir):
+        meta_path = os.path.join(_batch_dir(batch_id, jobs_dir), "batch.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        status = batch_progress(batch_id, jobs_dir)
+        meta["total"] = len(meta["names"])
+        meta["done"] = sum(1 for s in status.values() if s == "done")
+        meta["failed"] = sum(1 for s in status.values() if s == "failed")
+        meta["status"] = status
+        batches.append(meta)
+    return sorted(batches, key=lambda meta: meta["created_at"], reverse=True)
+
+
+def read_report(batch_id, index, jobs_dir=JOBS_DIR):
+    path = os.path.join(_batch_dir(batch_id, jobs_dir), "reports", f"{index}.md")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def combined_report(batch_id, jobs_dir=JOBS_DIR):
+    # 所有已完成的報告合併成一份 Markdown；只在使用者按下下載時才讀取（st.download_button 的 data 可傳入函數）
+    with open(os.path.join(_batch_dir(batch_id, jobs_dir), "batch.json"), encoding="utf-8") as f:
+        names = json.load(f)["names"]
+    return "\n\n---\n\n".join(
+        f"# {names[i]}\n\n{read_report(batch_id, i, jobs_dir)}"
+        for i, status in sorted(batch_progress(batch_id, jobs_dir).items()) if status == "done")
+
+
+def read_error(batch_id, index, jobs_dir=JOBS_DIR):
+    path = os.path.join(_batch_dir(batch_id, jobs_dir), "reports", f"{index}.err")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+# ---------- 背景執行 ----------
+
+class BatchRunner(threading.Thread):
+    # 依序送出尚未完成的公司（含先前失敗的），同時在排程器中的請求數不超過 concurrency
+    def __init__(self, batch_id, api_key, concurrency, scheduler, jobs_dir=JOBS_DIR):
+        super().__init__(name=f"batch-{batch_id}", daemon=True)
+        self.batch_id = batch_id
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.scheduler = scheduler
+        self.jobs_dir = jobs_dir
+        self._slots = threading.Semaphore(concurrency)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._outstanding = {}  # {index: LLMJob}
+
+    def run(self):
+        meta_path = os.path.join(_batch_dir(self.batch_id, self.jobs_dir), "batch.json")
+        with open(meta_path, encoding="utf-8") as f:
+            model = json.load(f)["model"]
+        done = {i for i, s in batch_progress(self.batch_id, self.jobs_dir).items() if s == "done"}
+        for item in load_items(self.batch_id, self.jobs_dir):
+            if item["index"] in done:
+                continue
+            acquired = False
+            while not self._stop_event.is_set() and not acquired:
+                acquired = self._slots.acquire(timeout=0.5)
+            if self._stop_event.is_set():
+                if acquired:
+                    self._slots.release()
+                break
+            job = self.scheduler.submit(self.api_key, model, [{"role": "user", "parts": [item["prompt"]]}],
+                                        priority=llm_scheduler.PRIORITY_REPORT)
+            with self._lock:
+                self._outstanding[item["index"]] = job
+            job.future.add_done_callback(lambda fut, index=item["index"]: self._finish(index, fut))
+        # 等待已送出的請求全部結束
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+
+    def _finish(self, index, fut):
+        reports_dir = os.path.join(_batch_dir(self.batch_id, self.jobs_dir), "reports")
+        try:
+            if fut.cancelled():
+                return
+            if fut.exception() is not None:
+                _write_atomic(os.path.join(reports_dir, f"{index}.err"), f"{type(fut.exception()).__name__}: {fut.exception()}")
+                return
+            _write_atomic(os.path.join(reports_dir, f"{index}.md"), fut.result())
+            error_path = os.path.join(reports_dir, f"{index}.err")
+            if os.path.exists(error_path):
+                os.remove(error_path)
+        finally:
+            with self._lock:
+                self._outstanding.pop(index, None)
+            self._slots.release()
+
+    def stop(self):
+        # 不再送出新的公司，並撤銷仍在排程器中排隊的請求；已在執行的請求完成後仍會寫入磁碟
+        self._stop_event.set()
+        with self._lock:
+            outstanding = list(self._outstanding.values())
+        for job in outstanding:
+            self.scheduler.release(job)
+
+
+class BatchManager:
+    def __init__(self, scheduler, jobs_dir=JOBS_DIR):
+        self.scheduler = scheduler
+        self.jobs_dir = jobs_dir
+        self._lock = threading.Lock()
+        self._runners = {}  # {批次 ID: BatchRunner}
+
+    def start(self, batch_id, api_key, concurrency=DEFAULT_CONCURRENCY):
+        # 開始或繼續執行批次；已在執行中時不做任何事
+        with self._lock:
+            runner = self._runners.get(batch_id)
+            if runner is not None and runner.is_alive():
+                return runner
+            runner = BatchRunner(batch_id, api_key, concurrency, self.scheduler, self.jobs_dir)
+            self._runners[batch_id] = runner
+            runner.start()
+            return runner
+
+    def stop(self, batch_id):
+        with self._lock:
+            runner = self._runners.get(batch_id)
+        if runner is not None:
+            runner.stop()
+
+    def is_running(self, batch_id):
+        with self._lock:
+            runner = self._runners.get(batch_id)
+            return runner is not None and runner.is_alive()
+
+    def any_running(self):
+        with self._lock:
+            return any(runner.is_alive() for runner in self._runners.values())
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    # 各工作階段共用同一個批次管理器
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BatchManager(llm_scheduler.get_scheduler())
+        return _manager
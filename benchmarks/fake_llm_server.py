@@ -0,0 +1,113 @@
+# benchmarks/fake_llm_server.py
+# 本機的假 Gemini REST 伺服器：實作 models/{model}:generateContent，用來測試 LLM 排程器而不連到網路
+# - 可設定回應延遲
+# - 可設定每個 API Key 在時間窗內的請求上限，超過時回傳 429 RESOURCE_EXHAUSTED，模擬配額錯誤
+#
+# 用法（在專案根目錄執行）：
+#   python -m benchmarks.fake_llm_server --port 8765 --latency 1.5 --rpm 10
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:8765 streamlit run app.py
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeModelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, limit=None, window=60.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.calls = defaultdict(deque)  # {API Key: 時間窗內被接受的請求時間}
+        self.accepted = 0
+        self.rejected = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self, api_key):
+        # 依每個 Key 的滑動時間窗判斷是否超過配額
+        now = time.monotonic()
+        with self.lock:
+            window = self.calls[api_key]
+            while window and now - window[0] >= self.window:
+                window.popleft()
+            if self.limit is not None and len(window) >= self.limit:
+                self.rejected += 1
+                return False
+            window.append(now)
+            self.accepted += 1
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        if ":generateContent" not in self.path:
+            self._reply(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        api_key = self.headers.get("x-goog-api-key", "")
+        if not server.admit(api_key):
+            self._reply(429, {"error": {"code": 429, "message": "Resource has been exhausted (fake quota).",
+                                        "status": "RESOURCE_EXHAUSTED"}})
+            return
+        with server.lock:
+            server.concurrent += 1
+            server.max_concurrent = max(server.max_concurrent, server.concurrent)
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            contents = request.get("contents", [])
+            question = contents[-1]["parts"][0].get("text", "") if contents else ""
+            text = f"（假模型回覆，第 {len(contents)} 則訊息）{question[:40]}"
+            self._reply(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                              "finishReason": "STOP", "index": 0}]})
+        finally:
+            with server.lock:
+                server.concurrent -= 1
+
+
+def start_fake_server(latency=0.0, limit=None, window=60.0, port=0):
+    # 在背景執行緒啟動伺服器並回傳；使用完畢後呼叫 server.shutdown()
+    server = FakeModelServer(("127.0.0.1", port), latency=latency, limit=limit, window=window)
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本機假 Gemini REST 伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="每個請求的回應延遲（秒）")
+    parser.add_argument("--rpm", type=int, help="每個 API Key 的每分鐘請求上限，超過回傳 429")
+    args = parser.parse_args(argv)
+    server = FakeModelServer(("127.0.0.1", args.port), latency=args.latency, limit=args.rpm, window=60.0)
+    print(f"假模型伺服器：{server.url}（設定 GEMINI_API_ENDPOINT={server.url} 後啟動 Streamlit）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
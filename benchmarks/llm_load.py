@@ -0,0 +1,109 @@
+# benchmarks/llm_load.py
+# LLM 排程器的負載測試：對本機假模型伺服器同時送出聊天與報告請求，檢查速率限制、並行上限、
+# 聊天優先、相同請求合併與 429 重試，並輸出排隊深度與等待時間
+#
+# 用法（在專案根目錄執行）：
+#   python -m benchmarks.llm_load
+#   python -m benchmarks.llm_load --keys 3 --chats 12 --reports 12 --rpm 300 --server-limit 4
+import argparse
+import os
+import sys
+import threading
+import time
+
+import llm_scheduler
+from benchmarks.fake_llm_server import start_fake_server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLM 排程器負載測試（使用本機假模型伺服器）")
+    parser.add_argument("--keys", type=int, default=2, help="模擬的 API Key 數量")
+    parser.add_argument("--chats", type=int, default=8, help="每個 Key 的聊天請求數")
+    parser.add_argument("--reports", type=int, default=8, help="每個 Key 的報告請求數")
+    parser.add_argument("--duplicates", type=int, default=4, help="每個 Key 重複送出的相同報告數（應被合併）")
+    parser.add_argument("--concurrency", type=int, default=3, help="排程器並行上限")
+    parser.add_argument("--rpm", type=float, default=300, help="排程器每個 Key 的每分鐘請求數")
+    parser.add_argument("--burst", type=float, help="權杖桶容量（預設為並行上限）")
+    parser.add_argument("--server-limit", type=int, default=6, help="假伺服器每個 Key 在時間窗內的請求上限（超過回傳 429）")
+    parser.add_argument("--server-window", type=float, default=2.0, help="假伺服器配額的時間窗（秒）")
+    parser.add_argument("--latency", type=float, default=0.2, help="假伺服器的回應延遲（秒）")
+    parser.add_argument("--backoff", type=float, default=0.25, help="429 重試的初始退避秒數")
+    args = parser.parse_args(argv)
+
+    server = start_fake_server(latency=args.latency, limit=args.server_limit, window=args.server_window)
+    os.environ["GEMINI_API_ENDPOINT"] = server.url
+    scheduler = llm_scheduler.LLMScheduler(max_concurrency=args.concurrency, requests_per_minute=args.rpm,
+                                           burst=args.burst, backoff=args.backoff, max_retries=6)
+
+    # 先讓報告塞滿佇列，再送出聊天，觀察聊天是否插隊
+    jobs = []
+    for k in range(args.keys):
+        api_key = f"fake-key-{k}"
+        for i in range(args.reports):
+            jobs.append(("report", scheduler.submit(api_key, "gemini-1.5-flash", [{"role": "user", "parts": [f"報告 {i}"]}],
+                                                    priority=llm_scheduler.PRIORITY_REPORT)))
+        for _ in range(args.duplicates):
+            jobs.append(("duplicate", scheduler.submit(api_key, "gemini-1.5-flash", [{"role": "user", "parts": ["相同的報告"]}],
+                                                       priority=llm_scheduler.PRIORITY_REPORT)))
+    for k in range(args.keys):
+        api_key = f"fake-key-{k}"
+        for i in range(args.chats):
+            jobs.append(("chat", scheduler.submit(api_key, "gemini-2.5-flash", [{"role": "user", "parts": [f"聊天 {i}"]}],
+                                                  priority=llm_scheduler.PRIORITY_CHAT)))
+
+    # 取樣排隊深度
+    depths = []
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            depths.append(scheduler.stats()["queue_depth"])
+            time.sleep(0.05)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    start = time.monotonic()
+    errors = []
+    finish = {"chat": [], "report": [], "duplicate": []}
+    for kind, job in jobs:
+        try:
+            job.future.result()
+        except Exception as exc:
+            errors.append(f"{kind}: {exc!r}")
+        else:
+            finish[kind].append(job.finished_at - start)
+    elapsed = time.monotonic() - start
+    done.set()
+    sampler.join()
+
+    stats = scheduler.stats()
+    scheduler.shutdown()
+    server.shutdown()
+
+    print(f"總耗時 {elapsed:.2f} s；假伺服器接受 {server.accepted}、拒絕 (429) {server.rejected}、最大並行 {server.max_concurrent}")
+    print(f"最大排隊深度 {max(depths) if depths else 0}")
+    for key, value in stats.items():
+        print(f"    {key:<24}{value:.1f}" if isinstance(value, float) else f"    {key:<24}{value}")
+    for kind, times in finish.items():
+        if times:
+            print(f"    {kind} 平均完成時間 {sum(times) / len(times):.2f} s")
+
+    failures = list(errors)
+    if server.max_concurrent > args.concurrency:
+        failures.append(f"並行數 {server.max_concurrent} 超過上限 {args.concurrency}")
+    unique = args.keys * (args.chats + args.reports + (1 if args.duplicates else 0))
+    if stats["submitted"] != unique:
+        failures.append(f"實際送出 {stats['submitted']} 個請求，預期合併後為 {unique} 個")
+    if finish["chat"] and finish["report"] and sum(finish["chat"]) / len(finish["chat"]) > sum(finish["report"]) / len(finish["report"]):
+        failures.append("聊天請求的平均完成時間晚於報告，優先順序未生效")
+    if failures:
+        print("⚠️ 檢查未通過：")
+        for failure in failures:
+            print(f"    {failure}")
+        return 1
+    print("✅ 速率限制、並行上限、聊天優先與相同請求合併皆符合預期")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
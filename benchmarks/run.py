@@ -0,0 +1,226 @@
+# benchmarks/run.py
+# 儀表板處理流程的效能基準測試（不需啟動 Streamlit、不連網路）
+#
+# 用法（在專案根目錄執行）：
+#   python -m benchmarks.run                               # 1k / 100k / 1M 列，與基準比較
+#   python -m benchmarks.run --sizes 1k,100k --widths 0,100
+#   python -m benchmarks.run --save-baseline               # 以本次結果覆寫基準
+#
+# benchmarks/baseline.json 是以 --sizes 1k,100k --save-baseline 產生並提交的基準，meta 記錄產生時的環境；
+# 1M 列的資料集需要約 8 GB 記憶體，未包含在提交的基準中（基準中沒有的資料集只量測、不比較）
+# 在不同的機器上比較前，先在該機器上以 --save-baseline 重新產生，再執行修改後的版本
+# 有超出容許範圍 (--tolerance / --noise-floor-ms) 的退步時結束代碼為 1，可直接用於 CI
+# 單核心或共用的機器上，相同程式碼連續兩次執行的差異可能超過預設的 25%，比較時可調高 --tolerance
+#
+# 每個資料集依序量測：讀檔、數值轉換、名稱欄位辨識、衍生指標、記憶體壓縮、可用圖表判斷、
+# 各圖表的資料準備 (chart_prep)、圖表建構 + 序列化，以及命中圖表快取時交給 st.plotly_chart 的成本；
+# 每個階段取多次執行的中位數
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+from benchmarks.stubs import install_fake_genai
+
+# 必須在匯入任何可能使用 Gemini 的模組之前替換成假客戶端
+install_fake_genai()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import plotly.express as px  # noqa: E402
+import streamlit as st  # noqa: E402
+
+import chart_figures  # noqa: E402
+import chart_prep  # noqa: E402
+import compaction  # noqa: E402
+import figure_cache  # noqa: E402
+import ingest  # noqa: E402
+import pipeline  # noqa: E402
+from benchmarks.synthetic import ensure_dataset  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BENCH_DIR, ".data")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# 在 Streamlit 伺服器之外呼叫 st.plotly_chart (bare mode) 時每次都會警告缺少執行環境，量測時關閉
+logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+# 與 app.py 各圖表分支相同的資料準備參數
+PREP_CASES = [
+    ("overview", "overview", {}),
+    ("dynamic_scatter", "scatter", {"x": "Sales", "y": "Net profit", "hover_name": "Name", "color": "Industry"}),
+    ("debt_scatter", "scatter", {"x": "Debt", "y": "Working capital", "required": ("Name",), "hover_name": "Name", "color": "Industry"}),
+    ("pe_roe_scatter", "scatter", {"x": "Price to Earning", "y": "Return on equity", "required": ("Name",), "hover_name": "Name",
+                                   "extra_cols": ("Industry", "Market Capitalization"), "trendline": False}),
+    ("industry_market", "industry_market", {"top_n": 8}),
+    ("top_sales_growth", "top_n", {"metric": "Sales growth 3Years", "n": 20}),
+    ("top_profit_growth", "top_n", {"metric": "Profit growth 3Years", "n": 20}),
+    ("top_roe_avg", "top_n", {"metric": "Average return on equity 5Years", "n": 20}),
+    ("market_cap_histogram", "histogram", {"column": "Market Capitalization", "bins": 30, "binning": "linear"}),
+    ("market_cap_histogram_log", "histogram", {"column": "Market Capitalization", "bins": 30, "binning": "log"}),
+    ("market_cap_histogram_quantile", "histogram", {"column": "Market Capitalization", "bins": 30, "binning": "quantile"}),
+    ("category_counts", "category_counts", {"column": "Industry", "top_n": 20}),
+    ("anomalies_robust_z", "anomalies", {"method": "robust_z"}),
+    ("anomalies_iqr", "anomalies", {"method": "iqr"}),
+    ("correlation_pearson", "correlation", {"method": "pearson"}),
+    ("correlation_spearman", "correlation", {"method": "spearman"}),
+]
+
+
+def _figure_dynamic_scatter(df, prepared):
+    data = prepared["dynamic_scatter"]["data"]
+    fig = px.scatter(data, x="Sales", y="Net profit", hover_name="Name", color="Industry")
+    return chart_figures.add_ols_trendlines(fig, prepared["dynamic_scatter"]["fits"], "Sales", "Net profit")
+
+
+def _figure_industry_market(df, prepared):
+    return px.bar(prepared["industry_market"]["data"], x="Industry", y="Market Capitalization", text_auto=True)
+
+
+def _figure_top_sales_growth(df, prepared):
+    return px.bar(prepared["top_sales_growth"]["data"], x="Name", y="Sales growth 3Years", text_auto=True)
+
+
+def _figure_market_cap_histogram(df, prepared):
+    return chart_figures.histogram_figure(prepared["market_cap_histogram"], "市場資本化分佈", "市值")
+
+
+def _figure_category_counts(df, prepared):
+    return chart_figures.category_counts_figure(prepared["category_counts"]["data"], "Industry", "Industry 的計數分佈 (前20)")
+
+
+# 與 app.py 相同的建圖呼叫；figure: 量測建圖並序列化 (figure_cache.serialize_figure) 的成本，
+# figure_hit: 量測命中快取時 app.render_figure 的成本（取出快取的圖表，並由 st.plotly_chart 轉換與序列化）
+FIGURE_CASES = [
+    ("dynamic_scatter", _figure_dynamic_scatter),
+    ("industry_market", _figure_industry_market),
+    ("top_sales_growth", _figure_top_sales_growth),
+    ("market_cap_histogram", _figure_market_cap_histogram),
+    ("category_counts", _figure_category_counts),
+]
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _timed(timings, name, fn, repeat, setup=None):
+    # 執行 repeat 次並記錄中位數 (ms)；setup 的時間不計入
+    samples = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = fn(arg) if setup is not None else fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    timings[name] = statistics.median(samples)
+    return result
+
+
+def run_case(path, repeat):
+    with open(path, "rb") as f:
+        raw = f.read()
+    timings = {}
+    df_raw = _timed(timings, "ingest", lambda: ingest.read_table(raw, os.path.basename(path)), repeat)
+    df = _timed(timings, "coercion", lambda: pipeline.coerce_numeric(df_raw), repeat)
+    df = _timed(timings, "name_detection", lambda d: pipeline.ensure_name_column(d)[0], repeat, setup=df.copy)
+    df = _timed(timings, "derived_metrics", pipeline.add_derived_metrics, repeat, setup=df.copy)
+    # 之後的階段與儀表板相同，使用壓縮後的資料集
+    df = _timed(timings, "compaction", lambda: compaction.compact_frame(df)[0], repeat)
+    _timed(timings, "availability_checks", lambda: pipeline.find_available_charts(df), repeat)
+
+    prepared = {}
+    for name, prep_name, params in PREP_CASES:
+        prepared[name] = _timed(timings, f"prep:{name}", lambda: chart_prep.run_prep(prep_name, df, params), repeat)
+    cache = figure_cache.FigureCache()
+    for name, build in FIGURE_CASES:
+        _timed(timings, f"figure:{name}", lambda: figure_cache.serialize_figure(build(df, prepared)), repeat)
+        cache.put(name, build(df, prepared))
+        _timed(timings, f"figure_hit:{name}", lambda: st.plotly_chart(cache.get(name), width="stretch"), repeat)
+    return timings
+
+
+def compare(results, baseline, tolerance, noise_floor_ms):
+    # 回傳 [(資料集, 階段, 基準 ms, 本次 ms, 比值)]，只列出超出容許範圍的退步
+    regressions = []
+    for case, stages in results.items():
+        for stage, ms in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base is None:
+                continue
+            if ms > base * (1 + tolerance) and ms - base > noise_floor_ms:
+                regressions.append((case, stage, base, ms, ms / base if base else float("inf")))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="財務儀表板處理流程效能基準測試")
+    parser.add_argument("--sizes", default="1k,100k,1M", help="資料列數，以逗號分隔（支援 k / M 後綴）")
+    parser.add_argument("--widths", default="0,100", help="額外數值欄位數，以逗號分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="每個階段重複次數（取中位數）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="合成資料快取目錄")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準結果 JSON 路徑")
+    parser.add_argument("--save-baseline", action="store_true", help="以本次結果覆寫基準")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允許的相對退步比例")
+    parser.add_argument("--noise-floor-ms", type=float, default=2.0, help="小於此差距 (ms) 的變化視為雜訊")
+    parser.add_argument("--output", help="另外把本次結果寫入此 JSON 檔")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for rows in [parse_size(s) for s in args.sizes.split(",") if s.strip()]:
+        for width in [int(w) for w in args.widths.split(",") if w.strip()]:
+            case = f"rows={rows},extra_cols={width}"
+            path = ensure_dataset(args.data_dir, rows, width, args.seed)
+            print(f"▶ {case}", flush=True)
+            results[case] = run_case(path, args.repeat)
+            for stage, ms in results[case].items():
+                print(f"    {stage:<32}{ms:>12.2f} ms")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    exit_code = 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"已寫入基準：{args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for case in results:
+            if case not in baseline["results"]:
+                print(f"基準中沒有 {case}，未比較")
+        regressions = compare(results, baseline["results"], args.tolerance, args.noise_floor_ms)
+        if regressions:
+            print(f"⚠️ 有 {len(regressions)} 個階段比基準慢超過 {args.tolerance:.0%}：")
+            for case, stage, base, ms, ratio in regressions:
+                print(f"    {case} {stage}: {base:.2f} → {ms:.2f} ms (x{ratio:.2f})")
+            exit_code = 1
+        else:
+            print("✅ 沒有超出容許範圍的退步")
+    else:
+        print(f"找不到基準檔 {args.baseline}，可使用 --save-baseline 建立")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# benchmarks/stubs.py
+# 離線用的假 Gemini 客戶端：基準測試開始前替換 google.ai.generativelanguage（llm_scheduler 使用的客戶端），確保不會連到網路
+import sys
+import time
+import types
+
+CANNED_TEXT = "（離線測試回覆）📊 CFO 分析…… 🏭 COO 分析…… 👑 CEO 最終決策……"
+
+
+class _Message(types.SimpleNamespace):
+    # 代替 GenerateContentRequest / Content / Part：只保存建構時的欄位
+    pass
+
+
+class FakeGenerativeServiceClient:
+    latency = 0.0  # 模擬模型回應時間（秒）
+
+    def __init__(self, client_options=None, **kwargs):
+        self.client_options = client_options or {}
+
+    def generate_content(self, request=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        part = _Message(text=CANNED_TEXT)
+        return _Message(candidates=[_Message(content=_Message(role="model", parts=[part]))], prompt_feedback=None)
+
+
+def install_fake_genai(latency=0.0):
+    # 在 sys.modules 註冊假的 google.ai.generativelanguage；之後任何 import 都會拿到這個模組
+    FakeGenerativeServiceClient.latency = latency
+    fake = types.ModuleType("google.ai.generativelanguage")
+    fake.GenerativeServiceClient = FakeGenerativeServiceClient
+    fake.GenerateContentRequest = fake.Content = fake.Part = _Message
+    google = sys.modules.get("google") or types.ModuleType("google")
+    if not hasattr(google, "__path__"):
+        google.__path__ = []
+    ai = sys.modules.get("google.ai") or types.ModuleType("google.ai")
+    if not hasattr(ai, "__path__"):
+        ai.__path__ = []
+    ai.generativelanguage = fake
+    google.ai = ai
+    sys.modules["google"] = google
+    sys.modules["google.ai"] = ai
+    sys.modules["google.ai.generativelanguage"] = fake
+    return fake
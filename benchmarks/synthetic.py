@@ -0,0 +1,113 @@
+# benchmarks/synthetic.py
+# 產生符合 app.py 欄位結構的合成「合併財務」CSV，供效能基準測試使用
+import os
+
+import numpy as np
+import pandas as pd
+
+INDUSTRIES = [
+    "Banks", "IT - Software", "Pharmaceuticals", "Automobile", "FMCG", "Steel",
+    "Cement", "Power Generation", "Telecom", "Chemicals", "Textiles", "Realty",
+]
+
+# 以 (欄位, 分佈) 描述每個數值欄位；分佈為 (種類, 參數...)
+NUMERIC_SCHEMA = [
+    ("Sales", ("lognormal", 7.0, 1.5)),
+    ("Sales last year", ("lognormal", 6.9, 1.5)),
+    ("Sales preceding year", ("lognormal", 6.8, 1.5)),
+    ("Profit after tax", ("normal", 300.0, 900.0)),
+    ("Profit after tax last year", ("normal", 280.0, 850.0)),
+    ("Profit after tax preceding year", ("normal", 260.0, 800.0)),
+    ("Net profit", ("normal", 300.0, 900.0)),
+    ("EPS", ("normal", 25.0, 40.0)),
+    ("EPS last year", ("normal", 23.0, 38.0)),
+    ("EPS preceding year", ("normal", 21.0, 36.0)),
+    ("Free cash flow last year", ("normal", 150.0, 600.0)),
+    ("Free cash flow preceding year", ("normal", 140.0, 580.0)),
+    ("Free cash flow 3years", ("normal", 400.0, 1500.0)),
+    ("Free cash flow 5years", ("normal", 650.0, 2400.0)),
+    ("Free cash flow 7years", ("normal", 900.0, 3300.0)),
+    ("Free cash flow 10years", ("normal", 1300.0, 4700.0)),
+    ("Cash from operations last year", ("normal", 400.0, 1200.0)),
+    ("Cash from investing last year", ("normal", -250.0, 800.0)),
+    ("Cash from financing last year", ("normal", -100.0, 600.0)),
+    ("Debt", ("lognormal", 5.5, 2.0)),
+    ("Working capital", ("normal", 500.0, 2000.0)),
+    ("Balance sheet total", ("lognormal", 8.0, 1.6)),
+    ("Current assets", ("lognormal", 6.5, 1.5)),
+    ("Current liabilities", ("lognormal", 6.0, 1.5)),
+    ("Net block", ("lognormal", 6.0, 1.8)),
+    ("Investments", ("lognormal", 5.0, 2.0)),
+    ("Equity capital", ("lognormal", 4.0, 1.2)),
+    ("Reserves", ("lognormal", 6.5, 1.8)),
+    ("Preference capital", ("lognormal", 0.5, 1.0)),
+    ("Market Capitalization", ("lognormal", 8.5, 1.9)),
+    ("Price to Earning", ("lognormal", 3.2, 0.6)),
+    ("Return on equity", ("normal", 14.0, 12.0)),
+    ("Return on capital employed", ("normal", 16.0, 11.0)),
+    ("Average return on equity 5Years", ("normal", 13.0, 10.0)),
+    ("Sales growth 3Years", ("normal", 10.0, 15.0)),
+    ("Profit growth 3Years", ("normal", 12.0, 30.0)),
+    ("Current Price", ("lognormal", 5.5, 1.3)),
+    ("t_1_price", ("lognormal", 5.5, 1.3)),
+    ("Return over 1year", ("normal", 12.0, 35.0)),
+    ("Return over 3years", ("normal", 14.0, 25.0)),
+    ("Return over 5years", ("normal", 13.0, 20.0)),
+]
+
+# 以文字儲存、含少量 "N/A" 的欄位，讓數值轉換階段有實際的工作量
+TEXT_NUMERIC_COLS = ["Price to Earning", "Return on equity"]
+# 含少量 0 值的分母欄位，走到除以零的分支
+ZERO_PRONE_COLS = ["Balance sheet total", "Current liabilities"]
+
+
+def _draw(rng, spec, rows):
+    kind, a, b = spec
+    if kind == "lognormal":
+        return np.round(rng.lognormal(a, b, rows), 2)
+    return np.round(rng.normal(a, b, rows), 2)
+
+
+def generate_dataset(rows, extra_cols=0, seed=0, missing_rate=0.02):
+    # 產生 rows 列的合成資料；extra_cols 額外加入的數值欄位，用來測試較寬的資料集
+    rng = np.random.default_rng(seed)
+    data = {
+        "Name": [f"Company {i:07d}" for i in range(rows)],
+        "Industry": rng.choice(INDUSTRIES, rows),
+    }
+    for col, spec in NUMERIC_SCHEMA:
+        values = _draw(rng, spec, rows)
+        values[rng.random(rows) < missing_rate] = np.nan
+        if col in ZERO_PRONE_COLS:
+            values[rng.random(rows) < 0.005] = 0.0
+        data[col] = values
+
+    # 持股比例：四類加總為 100
+    holdings = rng.dirichlet([5.0, 2.0, 1.5, 3.0], rows) * 100
+    for i, col in enumerate(["Promoter holding", "FII holding", "DII holding", "Public holding"]):
+        data[col] = np.round(holdings[:, i], 2)
+
+    for i in range(extra_cols):
+        data[f"Extra metric {i + 1}"] = np.round(rng.normal(0.0, 100.0, rows), 3)
+
+    df = pd.DataFrame(data)
+    for col in TEXT_NUMERIC_COLS:
+        text = df[col].map(lambda v: "" if pd.isna(v) else f"{v:.2f}").astype(object)
+        text[rng.random(rows) < 0.01] = "N/A"
+        df[col] = text
+    return df
+
+
+def dataset_path(data_dir, rows, extra_cols=0, seed=0):
+    return os.path.join(data_dir, f"financial_{rows}r_{extra_cols}w_s{seed}.csv")
+
+
+def ensure_dataset(data_dir, rows, extra_cols=0, seed=0):
+    # 產生一次後快取在 data_dir，重複執行基準測試時直接讀取
+    path = dataset_path(data_dir, rows, extra_cols, seed)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        generate_dataset(rows, extra_cols, seed).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return path
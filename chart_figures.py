@@ -0,0 +1,83 @@
+# chart_figures.py
+# 圖表建構的共用輔助函數（app.py 與效能基準測試共用）
+import math
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+# 函數：依 chart_prep.prepare_scatter 算好的迴歸係數補上 OLS 趨勢線，顏色與對應組別的散點一致
+def add_ols_trendlines(fig, fits, x_col, y_col):
+    for trace in list(fig.data):
+        fit = fits.get(trace.name or None) # 沒有分組時 plotly 的 trace 名稱為空字串
+        if fit is None:
+            continue
+        xs = [fit["x_min"], fit["x_max"]]
+        fig.add_scatter(x=xs, y=[fit["slope"] * x + fit["intercept"] for x in xs],
+                        mode="lines", line={"color": trace.marker.color},
+                        name=trace.name, legendgroup=trace.legendgroup, showlegend=False,
+                        hovertemplate=f"<b>OLS trendline</b><br>{y_col} = {fit['slope']:.6g} * {x_col} + {fit['intercept']:.6g}"
+                                      f"<br>R<sup>2</sup>={fit['r2']:.6f}<extra></extra>")
+    return fig
+
+
+# 函數：以 chart_prep.prepare_histogram 算好的分箱邊界與計數繪製直方圖，只送出每個分箱一根長條
+def histogram_figure(hist, title, x_label):
+    edges, counts = hist["edges"], hist["counts"]
+    lower, upper = edges[:-1], edges[1:]
+    if hist["binning"] == "log":
+        # 對數分箱在 log10 空間中等寬，刻度標回原始數值
+        left, right = np.log10(lower), np.log10(upper)
+    else:
+        left, right = lower, upper
+    if hist["binning"] == "quantile":
+        # 分位數分箱寬度不一，以密度（計數 / 箱寬）呈現才不會誤導
+        y, y_label = counts / (upper - lower), "密度（計數 / 箱寬）"
+    else:
+        y, y_label = counts, "計數"
+
+    fig = go.Figure(go.Bar(
+        x=left, y=y, width=right - left, offset=0,
+        customdata=np.column_stack([lower, upper, counts]),
+        hovertemplate=f"{x_label}: %{{customdata[0]:.4g}} – %{{customdata[1]:.4g}}<br>計數: %{{customdata[2]:,}}<extra></extra>",
+    ))
+    fig.update_layout(title=title, xaxis_title=x_label, yaxis_title=y_label, bargap=0)
+    if hist["binning"] == "log" and len(edges):
+        decades = list(range(math.floor(left.min()), math.ceil(right.max()) + 1))
+        fig.update_xaxes(tickvals=decades, ticktext=[f"{10.0 ** k:,.0f}" if k >= 0 else f"{10.0 ** k:g}" for k in decades])
+    return fig
+
+
+# 函數：以 chart_prep.prepare_category_counts 算好的計數繪製水平長條圖（數量多的在上方）
+def category_counts_figure(counts, column, title):
+    fig = go.Figure(go.Bar(x=counts["count"], y=counts[column].astype(str), orientation="h",
+                           hovertemplate="%{y}<br>計數: %{x:,}<extra></extra>"))
+    fig.update_layout(title=title, xaxis_title="計數", yaxis_title=column,
+                      yaxis={"categoryorder": "total ascending"})
+    return fig
+
+
+# 函數：在散佈圖上以空心紅圈標示 chart_prep.prepare_anomalies 判定為異常的公司
+# flagged 為散佈圖資料中被標示的列（需含 x、y 欄位），reasons 為 {列索引: 異常欄位說明}
+def add_anomaly_overlay(fig, flagged, x_col, y_col, reasons=None, hover_name=None):
+    if flagged.empty:
+        return fig
+    reasons = reasons or {}
+    names = flagged[hover_name].astype(str) if hover_name and hover_name in flagged.columns else flagged.index.astype(str)
+    fig.add_scatter(x=flagged[x_col], y=flagged[y_col], mode="markers", name=f"異常公司 ({len(flagged)})",
+                    marker={"symbol": "circle-open", "size": 14, "color": "red", "line": {"width": 2}},
+                    customdata=np.column_stack([names, [reasons.get(i, "") for i in flagged.index]]),
+                    hovertemplate=f"<b>%{{customdata[0]}}</b><br>{x_col}: %{{x:,.4g}}<br>{y_col}: %{{y:,.4g}}"
+                                  "<br>異常欄位: %{customdata[1]}<extra>異常公司</extra>")
+    return fig
+
+
+# 函數：以 chart_prep.prepare_correlation 算好的矩陣繪製相關係數熱度圖（-1 藍、+1 紅）
+def correlation_heatmap(matrix, title):
+    labels = [str(c) for c in matrix.columns]
+    fig = go.Figure(go.Heatmap(z=matrix.to_numpy(), x=labels, y=labels, zmin=-1, zmax=1, zmid=0,
+                               colorscale="RdBu", reversescale=True, colorbar={"title": "r"},
+                               hovertemplate="%{y} × %{x}<br>r = %{z:.3f}<extra></extra>"))
+    size = max(500, min(1600, 18 * len(labels)))
+    fig.update_layout(title=title, height=size, yaxis={"autorange": "reversed"})
+    return fig
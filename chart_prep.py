@@ -0,0 +1,500 @@
+# chart_prep.py
+# 圖表的資料準備函數（只依賴 pandas / numpy，不依賴 Streamlit）
+# 這些函數會在背景程序池中執行，因此必須是模組層級、可被 pickle 的純函數
+# 輸入可能是壓縮過的資料集 (compaction.py)：計算前先還原讀取的欄位，結果與未壓縮時相同
+import io
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import compaction
+
+
+def prepare_overview(df):
+    # 資料概覽：df.info() 文字與數值 / 類別欄位的描述性統計
+    buffer = io.StringIO()
+    df.info(buf=buffer, verbose=True, show_counts=True)  # 顯示實際存放的型別與記憶體用量
+    df = compaction.widen(df)
+    numeric_describe = df.describe().T
+    try:
+        object_describe = df.describe(include=['object', 'string']).T
+    except ValueError:
+        # 沒有類別欄位時 describe 會拋出錯誤
+        object_describe = pd.DataFrame()
+    return {
+        "info": buffer.getvalue(),
+        "numeric_describe": numeric_describe,
+        "object_describe": object_describe,
+    }
+
+
+def prepare_scatter(df, x, y, required=(), hover_name=None, color=None, extra_cols=(), trendline=True):
+    # 散佈圖：去除空值、只保留繪圖所需欄位，並（依 color 分組）計算 OLS 趨勢線
+    subset = [x, y] + [c for c in required if c not in (x, y)]
+    keep = list(dict.fromkeys(subset + [c for c in (hover_name, color, *extra_cols) if c]))
+    keep = [c for c in keep if c in df.columns]
+    df_valid = compaction.widen(df.dropna(subset=subset), keep)
+
+    fits = {}
+    if trendline and len(df_valid) > 2:
+        fits = ols_fits(df_valid, x, y, color)
+    return {"data": df_valid, "fits": fits}
+
+
+def ols_fits(df, x, y, color=None):
+    # 以 bincount 一次算出每組的簡單線性迴歸 (y = slope * x + intercept)，取代逐組呼叫 statsmodels
+    xs = df[x].to_numpy(dtype=float)
+    ys = df[y].to_numpy(dtype=float)
+    if color:
+        codes, groups = pd.factorize(df[color].astype(str), sort=False)
+    else:
+        codes, groups = np.zeros(len(xs), dtype=np.intp), [None]
+    n = np.bincount(codes, minlength=len(groups)).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 先對組內平均置中再求平方和，避免大數值（如市值）相減時的精度損失
+        mean_x = np.bincount(codes, xs, minlength=len(groups)) / n
+        mean_y = np.bincount(codes, ys, minlength=len(groups)) / n
+        dx = xs - mean_x[codes]
+        dy = ys - mean_y[codes]
+        sxx = np.bincount(codes, dx * dx, minlength=len(groups))
+        sxy = np.bincount(codes, dx * dy, minlength=len(groups))
+        syy = np.bincount(codes, dy * dy, minlength=len(groups))
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+        r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 1.0)
+    x_min = np.full(len(groups), np.inf)
+    x_max = np.full(len(groups), -np.inf)
+    np.minimum.at(x_min, codes, xs)
+    np.maximum.at(x_max, codes, xs)
+
+    fits = {}
+    for i, group in enumerate(groups):
+        # 少於兩個點或 X 無變異的組別無法擬合趨勢線
+        if n[i] < 2 or sxx[i] <= 0 or not np.isfinite(slope[i]):
+            continue
+        fits[group] = {
+            "slope": float(slope[i]),
+            "intercept": float(intercept[i]),
+            "r2": float(r2[i]),
+            "x_min": float(x_min[i]),
+            "x_max": float(x_max[i]),
+        }
+    return fits
+
+
+def prepare_industry_market(df, top_n=8):
+    # 產業市值：依產業加總市值後取前 N 名
+    df_valid = compaction.widen(df, ["Industry", "Market Capitalization"]).dropna()
+    industry_market = df_valid.groupby("Industry", as_index=False)["Market Capitalization"].sum()
+    industry_market = industry_market.sort_values("Market Capitalization", ascending=False)
+    return {"data": industry_market.head(top_n)}
+
+
+def prepare_top_n(df, metric, n=20):
+    # 排名長條圖：取指標最高的前 N 家公司
+    df_valid = compaction.widen(df, ["Name", metric]).dropna()
+    series = df_valid[metric]
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) \
+            and not pd.api.types.is_extension_array_dtype(series):
+        # nlargest 只需部分排序；只支援 NumPy 數值欄位
+        return {"data": df_valid.nlargest(n, metric, keep="first")[["Name", metric]]}
+    # 文字或擴充型別（例如未能轉換的欄位、Arrow 型別）：與原本相同，排序後取前 N 名
+    return {"data": df_valid.sort_values(metric, ascending=False).head(n)[["Name", metric]]}
+
+
+def prepare_histogram(df, column, bins=30, binning="linear"):
+    # 直方圖：在伺服器端以 NumPy 分箱，只回傳分箱邊界與計數，瀏覽器不必逐列重新分箱
+    # binning: "linear" 等寬、"log" 對數等寬（只計入正值）、"quantile" 分位數（各箱筆數相近）
+    values = compaction.restore_column(df, column).to_numpy(dtype=float, na_value=np.nan)
+    values = values[np.isfinite(values)]
+    dropped = 0
+    if binning == "log":
+        positive = values > 0
+        dropped = int((~positive).sum())
+        values = values[positive]
+    if values.size == 0:
+        return {"edges": np.empty(0), "counts": np.empty(0, dtype=np.int64), "n": 0, "dropped": dropped, "binning": binning}
+
+    if binning == "log":
+        low, high = values.min(), values.max()
+        if low == high:
+            edges = np.logspace(np.log10(low) - 0.5, np.log10(high) + 0.5, bins + 1)
+        else:
+            edges = np.logspace(np.log10(low), np.log10(high), bins + 1)
+            # 首尾直接使用最小 / 最大值，避免 log10 / 10** 的浮點誤差把極值排除在外
+            edges[0], edges[-1] = low, high
+    elif binning == "quantile":
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        if edges.size < 2:
+            edges = np.array([edges[0] - 0.5, edges[0] + 0.5])
+    else:
+        edges = bins
+    counts, edges = np.histogram(values, bins=edges)
+    return {"edges": edges, "counts": counts, "n": int(values.size), "dropped": dropped, "binning": binning}
+
+
+def prepare_category_counts(df, column, top_n=20):
+    # 類別計數：只回傳最常見的前 N 個類別與其筆數
+    counts = compaction.restore_column(df, column).dropna().value_counts()
+    data = counts.nlargest(top_n).rename_axis(column).reset_index(name="count")
+    return {"data": data, "total_categories": int(counts.size)}
+
+
+# 異常值偵測的方法與預設門檻
+ANOMALY_METHODS = ("robust_z", "iqr")
+ANOMALY_DEFAULT_THRESHOLDS = {"robust_z": 3.5, "iqr": 1.5}
+# 規則型檢查 {判斷依據: (欄位, 條件)}，不論產業分佈一律標示
+ANOMALY_RULES = {"負股東權益": ("總股東權益", lambda values: values < 0)}
+
+
+def _nan_quantiles(values, qs):
+    # 各欄位忽略 NaN 的分位數（線性內插，同 np.nanpercentile）；排序一次即算完所有欄位，
+    # 不像 np.nanmedian 在含 NaN 時逐欄處理
+    ordered = np.sort(values, axis=0)  # NaN 排在最後
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    results = []
+    for q in qs:
+        position = q * np.maximum(counts - 1, 0)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+        low_values = np.take_along_axis(ordered, lower[None, :], axis=0)[0]
+        high_values = np.take_along_axis(ordered, upper[None, :], axis=0)[0]
+        result = low_values + (high_values - low_values) * (position - lower)
+        result[counts == 0] = np.nan
+        results.append(result)
+    return results
+
+
+def _anomaly_stats(values, method):
+    # 對 (列數, 欄位數) 的矩陣一次計算所有欄位的中心與尺度
+    if method == "iqr":
+        q1, median, q3 = _nan_quantiles(values, (0.25, 0.5, 0.75))
+        scale = q3 - q1
+        return median, q1, q3, np.where(scale > 0, scale, np.nan)
+    median, = _nan_quantiles(values, (0.5,))
+    deviation = np.abs(values - median)
+    mad, = _nan_quantiles(deviation, (0.5,))
+    # MAD 為 0（超過一半的值相同）時改用平均絕對離差，兩者都為 0 時不判斷
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整欄皆為 NaN 時 nanmean 會警告，結果為 NaN 即可
+        scale = np.where(mad > 0, mad / 0.6745, 1.253314 * np.nanmean(deviation, axis=0))
+    return median, median, median, np.where(scale > 0, scale, np.nan)
+
+
+def prepare_anomalies(df, method="robust_z", threshold=None, group="Industry", min_group_size=8):
+    # 異常值偵測：依產業分組，對所有數值欄位一次計算穩健 Z 分數 (中位數 / MAD) 或四分位距 (IQR) 分數
+    # 組內公司少於 min_group_size 或沒有產業的公司改用全體資料的統計量
+    # robust_z：分數 = (值 - 中位數) / (MAD / 0.6745)；iqr：分數 = 超出 Q1 / Q3 的距離 / IQR
+    # |分數| > threshold 即標示為異常
+    threshold = ANOMALY_DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+    numeric_cols = [c for c in df.columns
+                    if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    values = compaction.restore_values(df, numeric_cols, df[numeric_cols].to_numpy(dtype=float, na_value=np.nan, copy=True))
+    values[~np.isfinite(values)] = np.nan
+
+    # 每一列對應的組統計量 (中位數, 下界, 上界, 尺度)，形狀與 values 相同
+    stats = [np.empty_like(values) for _ in range(4)]
+    overall = _anomaly_stats(values, method)
+    codes = pd.factorize(df[group])[0] if group in df.columns else np.full(len(df), -1)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0]) if len(order) else np.empty(0, dtype=int)
+    for start, stop in zip(starts, np.r_[starts[1:], len(order)]):
+        rows = order[start:stop]
+        group_stats = overall if codes[rows[0]] < 0 or len(rows) < min_group_size else _anomaly_stats(values[rows], method)
+        for target, stat in zip(stats, group_stats):
+            target[rows] = stat
+    median, lower, upper, scale = stats
+
+    with np.errstate(invalid="ignore"):
+        if method == "iqr":
+            scores = np.where(values > upper, (values - upper) / scale, np.where(values < lower, (values - lower) / scale, 0.0))
+        else:
+            scores = (values - median) / scale
+        flags = np.abs(scores) > threshold
+
+    row_pos, col_pos = np.nonzero(flags)
+    names = df["Name"].to_numpy() if "Name" in df.columns else df.index.to_numpy()
+    groups = df[group].to_numpy() if group in df.columns else np.full(len(df), None)
+    details = pd.DataFrame({
+        "index": df.index.to_numpy()[row_pos],
+        "Name": names[row_pos],
+        "Industry": groups[row_pos],
+        "column": np.asarray(numeric_cols, dtype=object)[col_pos],
+        "value": values[row_pos, col_pos],
+        "median": median[row_pos, col_pos],
+        "score": scores[row_pos, col_pos],
+        "reason": "超出產業分佈",
+    })
+    rule_frames = []
+    for reason, (column, condition) in ANOMALY_RULES.items():
+        if column not in numeric_cols:
+            continue
+        col_values = values[:, numeric_cols.index(column)]
+        with np.errstate(invalid="ignore"):
+            rule_rows = np.flatnonzero(condition(col_values))
+        rule_frames.append(pd.DataFrame({
+            "index": df.index.to_numpy()[rule_rows], "Name": names[rule_rows], "Industry": groups[rule_rows],
+            "column": column, "value": col_values[rule_rows], "median": median[rule_rows, numeric_cols.index(column)],
+            "score": np.nan, "reason": reason,
+        }))
+    if rule_frames:
+        details = pd.concat([details] + rule_frames, ignore_index=True)
+    details = details.sort_values(["index", "column"], kind="stable", ignore_index=True)
+
+    # 每家公司一列：異常欄位數、最大 |分數| 與異常欄位清單（details 已依列索引排序，直接切段彙總）
+    index_values = details["index"].to_numpy()
+    firsts = np.flatnonzero(np.r_[True, index_values[1:] != index_values[:-1]]) if len(details) else np.empty(0, dtype=int)
+    bounds = np.r_[firsts, len(details)]
+    distinct = ~details.duplicated(["index", "column"]).to_numpy()  # 同一欄位同時違反分佈與規則時只算一次
+    columns = [col if keep else None for col, keep in zip(details["column"].tolist(), distinct)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 只有規則型異常的公司沒有分數
+        max_abs_score = np.fmax.reduceat(np.abs(details["score"].to_numpy(dtype=float)), firsts) if len(details) else np.empty(0)
+    summary = pd.DataFrame({
+        "index": index_values[firsts],
+        "Name": details["Name"].to_numpy()[firsts],
+        "Industry": details["Industry"].to_numpy()[firsts],
+        "anomalies": np.add.reduceat(distinct.astype(np.int64), firsts) if len(details) else np.empty(0, dtype=np.int64),
+        "max_abs_score": max_abs_score,
+        "columns": [", ".join(filter(None, columns[start:stop])) for start, stop in zip(bounds[:-1], bounds[1:])],
+    }).sort_values(["anomalies", "max_abs_score"], ascending=False, ignore_index=True)
+    column_counts = details.groupby("column")["index"].nunique().sort_values(ascending=False).rename_axis("column").reset_index(name="count")
+    return {"details": details, "summary": summary, "column_counts": column_counts,
+            "n_rows": len(df), "columns": numeric_cols, "method": method, "threshold": threshold}
+
+
+# 相關係數矩陣的方法
+CORRELATION_METHODS = ("pearson", "spearman")
+
+
+def _pairwise_pearson(values, min_periods=3, chunk_size=256):
+    # values 為 (列數, 欄位數) 且含 NaN 的矩陣；每一對欄位只使用兩者皆非 NaN 的列（pairwise）
+    # 以遮罩矩陣乘法一次算出每一對欄位的 n、Σx、Σy、Σx²、Σy²、Σxy，欄位依 chunk_size 分塊，
+    # 中間陣列最多是 (列數, chunk_size)，很寬的資料集也不必一次展開整個矩陣
+    n_cols = values.shape[1]
+    corr = np.full((n_cols, n_cols), np.nan)
+    counts = np.zeros((n_cols, n_cols), dtype=np.int64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整欄皆為 NaN 時 nanmean 會警告
+        center = np.nan_to_num(np.nanmean(values, axis=0))  # 先平移到平均值附近，減少大數值相減的誤差
+    blocks = [(start, min(start + chunk_size, n_cols)) for start in range(0, n_cols, chunk_size)]
+
+    def block_sums(start, stop):
+        block = values[:, start:stop] - center[start:stop]
+        mask = ~np.isnan(block)
+        filled = np.where(mask, block, 0.0)
+        return mask.astype(np.float64), filled, filled * filled
+
+    for i, (a, b) in enumerate(blocks):
+        mask_a, x_a, xx_a = block_sums(a, b)
+        for c, d in blocks[i:]:
+            mask_b, x_b, xx_b = (mask_a, x_a, xx_a) if c == a else block_sums(c, d)
+            n = mask_a.T @ mask_b
+            sum_x, sum_y = x_a.T @ mask_b, mask_a.T @ x_b
+            cov = n * (x_a.T @ x_b) - sum_x * sum_y
+            var = (n * (xx_a.T @ mask_b) - sum_x ** 2) * (n * (mask_a.T @ xx_b) - sum_y ** 2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = np.clip(cov / np.sqrt(var), -1.0, 1.0)
+            r[(n < min_periods) | ~(var > 0)] = np.nan
+            corr[a:b, c:d], corr[c:d, a:b] = r, r.T
+            counts[a:b, c:d], counts[c:d, a:b] = n, n.T
+    return corr, counts
+
+
+def _average_ranks(values):
+    # 各欄位的名次（1 起算，同值取平均名次，NaN 保持 NaN），同 DataFrame.rank(method="average")，但所有欄位一次排序
+    columns = np.ascontiguousarray(values.T)  # 每個欄位連續存放，沿最後一軸排序較快
+    n_cols, n_rows = columns.shape
+    order = np.argsort(columns, axis=1)  # NaN 排在最後
+    ordered = np.take_along_axis(columns, order, axis=1)
+    starts = np.ones_like(ordered, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    # 每個欄位的第一個值一定是新的同值組，展開後組別不會跨欄
+    group = np.cumsum(starts.ravel()) - 1
+    positions = np.tile(np.arange(1, n_rows + 1, dtype=np.float64), n_cols)
+    average = np.bincount(group, weights=positions) / np.bincount(group)
+    ranks = np.empty_like(columns)
+    np.put_along_axis(ranks, order, average[group].reshape(n_cols, n_rows), axis=1)
+    ranks[np.isnan(columns)] = np.nan
+    return ranks.T
+
+
+# 逐對重新排名時，每批中間陣列（欄位組合數 × 列數）最多的元素數
+SPEARMAN_CHUNK_ELEMENTS = 2_000_000
+
+
+def _tie_term(t):
+    # 大小為 t 的同值組讓名次平方和減少 (t³ - t) / 12
+    return t ** 3 - t
+
+
+def _pairwise_spearman_fix(ranks, corr, counts, min_periods=3):
+    # 缺值位置不同的欄位組合，Spearman 必須只在兩者皆有值的列上重新排名（同 DataFrame.corr("spearman")）；
+    # 就地覆寫 corr 中這些組合的結果。ranks 為 _average_ranks 的全欄名次，counts 為各組合的共同列數
+    # 共同列中的名次 = 全欄名次 - 比它小的被排除列數（同值的被排除列算一半），被排除的列通常很少，
+    # 依全欄名次累加即可，不必逐對排序。缺值列的名次與位移都記為 0，兩欄位名次的乘積和自然只剩共同列；
+    # 名次的平均與平方和由共同列數與同值組大小直接算出
+    n_rows, n_cols = ranks.shape
+    by_col = np.ascontiguousarray(ranks.T)
+    present = ~np.isnan(by_col)
+    n_valid = present.sum(axis=1)
+    excluded = n_valid[:, None] - counts  # [s, t]：s 有值但 t 缺值的列數
+    np.fill_diagonal(excluded, 0)
+    if not excluded.any():
+        return
+    # 以兩倍名次計算，同值的平均名次也是整數
+    ranks2 = np.where(present, 2 * by_col, 0.0)
+    # 同值組的最小名次作為組別編號（依值遞增，0 代表缺值）；同值組大小 = 兩倍名次 - 2 × 編號 + 1
+    floor_keys = np.where(present, by_col, 0).astype(np.int64)
+    keys = np.zeros((n_cols, n_rows), dtype=np.int32)
+    tie_totals = np.zeros(n_cols)
+    for j in range(n_cols):
+        sizes = np.bincount(floor_keys[j], minlength=n_rows + 1)
+        sizes[0] = 1
+        keys[j] = np.where(present[j], ranks2[j] / 2 - (sizes[floor_keys[j]] - 1) / 2, 0)
+        tie_totals[j] = _tie_term(sizes[1:].astype(np.float64)).sum()
+    del floor_keys
+    missing_rows = [np.flatnonzero(~present[j]) for j in range(n_cols)]
+    chunk = max(1, SPEARMAN_CHUNK_ELEMENTS // max(n_rows, 1))
+
+    def tie_change(columns, label, rows, k):
+        # 第 label 個欄位排除 rows 這些列後，同值修正量的變化；同值組大小 = 兩倍名次 - 2 × 編號 + 1
+        column = columns[label]
+        group = keys[column, rows]
+        size = ranks2[column, rows] - 2 * group + 1
+        _, where, removed = np.unique(label * (n_rows + 1) + group, return_inverse=True, return_counts=True)
+        removed = removed[where]
+        # 同一組有幾個被排除列就出現幾次，各分攤一份
+        return np.bincount(label, (_tie_term(size - removed) - _tie_term(size)) / removed, minlength=k)
+
+    def shifts(columns, label, rows):
+        # 第 label 個欄位排除 rows 這些列 -> 各同值組的兩倍位移（比它小的被排除列 ×2 + 同值的被排除列）
+        k = len(columns)
+        cnt = np.bincount(label * (n_rows + 1) + keys[columns[label], rows], minlength=k * (n_rows + 1))
+        cnt = cnt.astype(np.int32).reshape(k, n_rows + 1)
+        shift = np.cumsum(cnt, axis=1, dtype=np.int32)
+        shift <<= 1
+        shift -= cnt
+        return shift
+
+    def assign(s, ts, cross, ties_s, ties_t):
+        n = counts[s, ts].astype(np.float64)
+        cov = cross - n * ((n + 1) / 2) ** 2
+        var_s = (_tie_term(n) - ties_s) / 12
+        var_t = (_tie_term(n) - ties_t) / 12
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.clip(cov / np.sqrt(var_s * var_t), -1.0, 1.0)
+        r[(n < min_periods) | ~(var_s > 0) | ~(var_t > 0)] = np.nan
+        corr[s, ts] = corr[ts, s] = r
+
+    def one_sided(a, b):
+        # 只有 a 需要排除列（a 有值、b 缺值的列），b 在共同列中的名次不變：
+        # Σ 共同列 a 的位移 × b 的名次 = Σ 被排除列 q（a 中比 q 大的列的 b 名次和 + 同值列的一半）
+        rows = missing_rows[b][present[a, missing_rows[b]]]
+        group = keys[a, rows]
+        above = np.cumsum(np.bincount(keys[a], weights=ranks2[b], minlength=n_rows + 1))
+        above = above[-1] - (above[group] + above[group - 1]) / 2
+        cross = (ranks2[a] @ ranks2[b] / 2 - above.sum()) / 2
+        return cross, tie_change(np.array([a]), np.zeros(len(rows), dtype=np.intp), rows, 1)[0]
+
+    for s in range(n_cols - 1):
+        later = np.arange(s + 1, n_cols)
+        drop_s = excluded[s, later] > 0  # s 需要排除 t 缺值的列
+        drop_t = excluded[later, s] > 0  # t 需要排除 s 缺值的列
+        # 只有一邊需要排除列的組合逐對計算，不必建立位移陣列
+        ts = later[drop_s != drop_t]
+        if len(ts):
+            cross, ties_s, ties_t = np.zeros(len(ts)), np.full(len(ts), tie_totals[s]), tie_totals[ts].copy()
+            for idx, t in enumerate(ts):
+                if excluded[s, t]:
+                    cross[idx], change = one_sided(s, t)
+                    ties_s[idx] += change
+                else:
+                    cross[idx], change = one_sided(t, s)
+                    ties_t[idx] += change
+            assign(s, ts, cross, ties_s, ties_t)
+        # 兩邊都需要排除列的組合：以兩倍名次減去位移，缺值列的名次與位移都是 0，乘積和自然只剩共同列
+        partners = later[drop_s & drop_t]
+        for c in range(0, len(partners), chunk):
+            ts = partners[c:c + chunk]
+            k = len(ts)
+            label, rows = np.nonzero(present[s] & ~present[ts])
+            x = ranks2[s] - shifts(np.full(k, s), label, rows)[:, keys[s]]
+            ties_s = tie_totals[s] + tie_change(np.full(k, s), label, rows, k)
+            missing = missing_rows[s]
+            label, idx = np.nonzero(present[ts][:, missing])
+            flat = keys[ts] + (np.arange(k, dtype=np.int32) * (n_rows + 1))[:, None]
+            y = ranks2[ts] - shifts(ts, label, missing[idx]).ravel().take(flat)
+            ties_t = tie_totals[ts] + tie_change(ts, label, missing[idx], k)
+            assign(s, ts, np.einsum("ij,ij->i", x, y) / 4, ties_s, ties_t)
+
+
+def prepare_correlation(df, method="pearson", industry=None, min_periods=3, top_pairs=200, chunk_size=256):
+    # 相關係數矩陣：所有數值欄位兩兩之間的 Pearson 或 Spearman 相關係數，缺值逐對排除
+    # Spearman 先對各欄位分別排名（同值取平均名次）再計算 Pearson；缺值位置不同的欄位組合
+    # 再由 _pairwise_spearman_fix 在共同列上重新排名，結果與 DataFrame.corr("spearman") 相同
+    # industry 不為 None 時只使用該產業的公司
+    if industry is not None:
+        df = df[df["Industry"].astype(str) == industry]
+    numeric_cols = [c for c in df.columns
+                    if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    values = compaction.restore_values(df, numeric_cols, df[numeric_cols].to_numpy(dtype=float, na_value=np.nan, copy=True))
+    values[~np.isfinite(values)] = np.nan
+    if method == "spearman":
+        ranks = _average_ranks(values)
+        corr, counts = _pairwise_pearson(ranks, min_periods=min_periods, chunk_size=chunk_size)
+        _pairwise_spearman_fix(ranks, corr, counts, min_periods=min_periods)
+    else:
+        corr, counts = _pairwise_pearson(values, min_periods=min_periods, chunk_size=chunk_size)
+
+    # 依 |r| 排序的欄位組合（上三角，不含對角線）
+    rows, cols = np.triu_indices(len(numeric_cols), k=1)
+    r = corr[rows, cols]
+    valid = np.flatnonzero(~np.isnan(r))
+    if len(valid) > top_pairs:
+        valid = valid[np.argpartition(-np.abs(r[valid]), top_pairs - 1)[:top_pairs]]
+    valid = valid[np.argsort(-np.abs(r[valid]), kind="stable")]
+    names = np.asarray(numeric_cols, dtype=object)
+    pairs = pd.DataFrame({"x": names[rows[valid]], "y": names[cols[valid]], "r": r[valid], "n": counts[rows[valid], cols[valid]]})
+    return {
+        "matrix": pd.DataFrame(corr, index=numeric_cols, columns=numeric_cols),
+        "pairs": pairs,
+        "n_rows": len(df),
+        "method": method,
+    }
+
+
+# 程序池以名稱分派工作，避免傳遞函數物件
+PREP_FUNCTIONS = {
+    "overview": prepare_overview,
+    "scatter": prepare_scatter,
+    "industry_market": prepare_industry_market,
+    "top_n": prepare_top_n,
+    "histogram": prepare_histogram,
+    "category_counts": prepare_category_counts,
+    "anomalies": prepare_anomalies,
+    "correlation": prepare_correlation,
+}
+
+
+def run_prep(name, df, params):
+    return PREP_FUNCTIONS[name](df, **params)
+
+
+# 各準備函數讀取的欄位 {名稱: 函數(params) -> 欄位}；資料被編輯時只有讀取到被修改欄位的結果需要重新計算
+# 不在表中的準備函數（例如資料概覽）視為讀取所有欄位
+PREP_COLUMNS = {
+    "scatter": lambda params: {params["x"], params["y"], *params.get("required", ()), *params.get("extra_cols", ()),
+                               *(c for c in (params.get("hover_name"), params.get("color")) if c)},
+    "industry_market": lambda params: {"Industry", "Market Capitalization"},
+    "top_n": lambda params: {"Name", params["metric"]},
+    "histogram": lambda params: {params["column"]},
+    "category_counts": lambda params: {params["column"]},
+}
+
+
+def prep_columns(name, params, columns):
+    if name in PREP_COLUMNS:
+        return PREP_COLUMNS[name](params)
+    return set(columns)
@@ -0,0 +1,96 @@
+# chat_store.py
+# AI 聊天室的對話紀錄：存放在本機 SQLite，重新整理頁面後仍可依對話 ID 取回
+# - (session_id, created_at) 上有索引，只讀取畫面需要的最近幾則訊息
+# - 較長的回覆以 zlib 壓縮後存放
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DB_PATH = os.environ.get("CHAT_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".chat_history.sqlite3"))
+# 超過此位元組數的內容才壓縮，短訊息壓縮後反而更大
+COMPRESS_MIN_BYTES = 2048
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    role TEXT NOT NULL,
+    content BLOB NOT NULL,
+    compressed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session_time ON messages (session_id, created_at, id);
+"""
+
+
+def _encode(content):
+    data = content.encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return zlib.compress(data, 6), 1
+    return data, 0
+
+
+def _decode(content, compressed):
+    return (zlib.decompress(content) if compressed else bytes(content)).decode("utf-8")
+
+
+class ChatStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        # Streamlit 的各工作階段在不同執行緒執行，共用一個連線並以鎖保護
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def append(self, session_id, role, content):
+        data, compressed = _encode(content)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, created_at, role, content, compressed) VALUES (?, ?, ?, ?, ?)",
+                (session_id, time.time(), role, data, compressed))
+        return cursor.lastrowid
+
+    def count(self, session_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def recent(self, session_id, limit):
+        # 最近 limit 則訊息，依時間由舊到新排列
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, role, content, compressed FROM messages WHERE session_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?", (session_id, limit)).fetchall()
+        return [{"id": row[0], "created_at": row[1], "role": row[2], "content": _decode(row[3], row[4])}
+                for row in reversed(rows)]
+
+    def history(self, session_id):
+        # 完整對話紀錄（送給模型當作上下文）
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, compressed FROM messages WHERE session_id = ? ORDER BY created_at, id",
+                (session_id,)).fetchall()
+        return [{"role": row[0], "content": _decode(row[1], row[2])} for row in rows]
+
+    def clear(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # 全程序共用一個 ChatStore
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
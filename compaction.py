@@ -0,0 +1,130 @@
+# compaction.py
+# 處理後資料集的記憶體壓縮：上傳的資料集在全程序共用並常駐記憶體，壓縮後可容納更多工作階段與更大的資料集
+# - float64 欄位在 float32 能還原每個原始數值時（依欄位的小數位數取整，最多 FLOAT32_MAX_DECIMALS 位）改存 float32；
+#   小數位數寫在 df.attrs，切片、篩選與 pickle 後仍保留
+# - Industry 與其他重複值多的文字欄位以字典編碼 (category) 存放；Name 使用 Arrow 字串型別
+# - 圖表資料與顯示用的數值以 widen() / restore_values() 還原成 float64，與壓縮前的數值相同
+import lazy_imports
+
+pd = lazy_imports.lazy("pandas")
+np = lazy_imports.lazy("numpy")
+ingest = lazy_imports.lazy("ingest")
+
+# float32 欄位的原始小數位數 {欄位: 位數}
+DECIMALS_ATTR = "float32_decimals"
+# 超過此小數位數的欄位（例如計算出的比率）維持 float64
+FLOAT32_MAX_DECIMALS = 4
+# 不重複值占非空值的比例不超過此值的文字欄位改以字典編碼
+CATEGORY_MAX_RATIO = 0.5
+# 一律以字典編碼的文字欄位
+CATEGORY_COLUMNS = ("Industry",)
+
+
+def _decimals(values):
+    # 能以 d 位小數精確表示所有值的最小 d；超過 FLOAT32_MAX_DECIMALS 時回傳 None
+    for d in range(FLOAT32_MAX_DECIMALS + 1):
+        if np.array_equal(np.round(values, d), values):
+            return d
+    return None
+
+
+def float32_decimals(series):
+    # 可改存 float32 時回傳還原用的小數位數，否則回傳 None
+    values = series.to_numpy(dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if values.size and np.abs(values).max() > np.finfo(np.float32).max:
+        return None
+    d = _decimals(values)
+    if d is None:
+        return None
+    # float32 轉回 float64 後依小數位數取整，必須得到完全相同的數值
+    if not np.array_equal(np.round(values.astype(np.float32).astype(np.float64), d), values):
+        return None
+    return d
+
+
+def _is_text(series):
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+
+def compact_frame(df):
+    # 回傳 (壓縮後的 DataFrame, 各欄位的壓縮報告)；不修改傳入的 DataFrame
+    before = df.memory_usage(index=False, deep=True)
+    dtypes = df.dtypes.astype(str)
+    compacted = df.copy(deep=False)
+    decimals = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == np.float64:
+            d = float32_decimals(series)
+            if d is not None:
+                compacted[col] = series.astype(np.float32)
+                decimals[col] = d
+        elif col == "Name" and _is_text(series):
+            compacted[col] = series.astype(ingest.arrow_string_dtype())
+        elif _is_text(series):
+            non_null = series.count()
+            if col in CATEGORY_COLUMNS or (non_null and series.nunique() <= CATEGORY_MAX_RATIO * non_null):
+                compacted[col] = series.astype("category")
+    compacted.attrs[DECIMALS_ATTR] = decimals
+
+    after = compacted.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({
+        "column": df.columns,
+        "before": dtypes.to_numpy(),
+        "after": compacted.dtypes.astype(str).to_numpy(),
+        "bytes_before": before.to_numpy(),
+        "bytes_after": after.to_numpy(),
+    })
+    report["saved"] = report["bytes_before"] - report["bytes_after"]
+    return compacted, report.sort_values("saved", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def summary(report):
+    # 壓縮報告的總計（效能面板顯示用）
+    before, after = int(report["bytes_before"].sum()), int(report["bytes_after"].sum())
+    return {
+        "before_mb": before / 1024 / 1024,
+        "after_mb": after / 1024 / 1024,
+        "saved_pct": (1 - after / before) * 100 if before else 0.0,
+        "float32_columns": int((report["after"] == "float32").sum()),
+        "category_columns": int((report["after"] == "category").sum()),
+    }
+
+
+def restore_column(df, col):
+    # 把壓縮過的欄位還原：float32 依原始小數位數還原成 float64，字典編碼還原成原本的字串型別
+    series = df[col]
+    if series.dtype == np.float32:
+        values = series.to_numpy(dtype=np.float64)
+        d = df.attrs.get(DECIMALS_ATTR, {}).get(col)
+        return pd.Series(np.round(values, d) if d is not None else values, index=series.index, name=col)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+def is_compacted(series):
+    return series.dtype == np.float32 or isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def widen(df, columns=None):
+    # 還原所有壓縮過的欄位（圖表資料、表格與單一公司的數值）；columns 指定時只保留這些欄位（不存在的略過）
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    compacted = [c for c in df.columns if is_compacted(df[c])]
+    if not compacted:
+        return df
+    df = df.copy(deep=False)
+    for col in compacted:
+        df[col] = restore_column(df, col)
+    return df
+
+
+def restore_values(df, columns, values):
+    # values 為 df[columns].to_numpy(dtype=float) 的結果；就地把 float32 欄位依原始小數位數還原
+    decimals = df.attrs.get(DECIMALS_ATTR, {})
+    for j, col in enumerate(columns):
+        if col in decimals and df[col].dtype == np.float32:
+            values[:, j] = np.round(values[:, j], decimals[col])
+    return values
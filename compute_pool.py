@@ -0,0 +1,331 @@
+# compute_pool.py
+# 背景程序池：把較重的圖表資料準備（groupby、OLS、describe 等）移出 Streamlit 腳本執行緒
+# - 資料集只透過共享記憶體發佈一次，工作程序以零複製方式掛載數值欄位
+# - 較大的結果 DataFrame 也經由共享記憶體傳回
+# - 結果依 (資料集指紋, 準備函數, 參數) 快取，同一工作槽被新請求取代時取消舊請求
+# - 資料經過編輯時，呼叫端可另外指定只涵蓋該準備函數讀取欄位的快取鍵 (cache_key)，未受影響的結果仍命中快取
+# - 相同的請求由多個工作階段（與背景預先計算）共用；只有最後一個等待者放棄時才取消該請求
+# - 被淘汰的共享記憶體區塊在仍有請求使用時保留，最後一個請求結束後才釋放
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import chart_prep
+
+# 小於此列數的資料集直接在腳本執行緒計算，程序間傳輸的成本反而比計算高
+INLINE_ROW_THRESHOLD = 20_000
+# 結果 DataFrame 超過此列數時改以共享記憶體傳回
+SHM_RESULT_MIN_ROWS = 5_000
+# 同時保留在共享記憶體中的資料集數量
+MAX_PUBLISHED_DATASETS = 4
+
+
+# ---------- 共享記憶體上的 DataFrame ----------
+
+def _is_packable(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_extension_array_dtype(series)
+
+
+def pack_frame(df, name=None):
+    # 數值欄位以 float64 欄優先 (column-major) 寫入同一塊共享記憶體，其他欄位以 pickle 附在後面
+    numeric_cols = [c for c in df.columns if _is_packable(df[c])]
+    other_cols = [c for c in df.columns if c not in set(numeric_cols)]
+    block = np.asfortranarray(df[numeric_cols].to_numpy(dtype=np.float64)) if numeric_cols else np.empty((len(df), 0))
+    extra = pickle.dumps(df[other_cols], protocol=pickle.HIGHEST_PROTOCOL) if other_cols else b""
+
+    shm = shared_memory.SharedMemory(create=True, size=max(block.nbytes + len(extra), 1), name=name)
+    view = np.ndarray(block.shape, dtype=np.float64, buffer=shm.buf, order="F")
+    view[:] = block
+    shm.buf[block.nbytes:block.nbytes + len(extra)] = extra
+    handle = {
+        "shm": shm.name,
+        "shape": block.shape,
+        "numeric_cols": numeric_cols,
+        "extra_size": len(extra),
+        "columns": list(df.columns),
+        "dtypes": {c: str(df[c].dtype) for c in numeric_cols},
+        "index": df.index if not isinstance(df.index, pd.RangeIndex) else None,
+        "attrs": dict(df.attrs),  # 例如壓縮欄位的小數位數
+    }
+    return shm, handle
+
+
+def attach_frame(handle, copy=False):
+    # 依 handle 掛載共享記憶體並重建 DataFrame；copy=False 時數值欄位直接引用共享記憶體
+    shm = shared_memory.SharedMemory(name=handle["shm"])
+    rows, cols = handle["shape"]
+    block = np.ndarray((rows, cols), dtype=np.float64, buffer=shm.buf, order="F")
+    data = {}
+    for i, col in enumerate(handle["numeric_cols"]):
+        values = block[:, i]
+        dtype = handle["dtypes"][col]
+        if dtype != "float64":
+            values = values.astype(dtype)
+        elif copy:
+            values = values.copy()
+        data[col] = values
+    if handle["extra_size"]:
+        start = block.nbytes
+        others = pickle.loads(bytes(shm.buf[start:start + handle["extra_size"]]))
+        for col in others.columns:
+            data[col] = others[col].array  # 保留字典編碼與 Arrow 字串型別
+    df = pd.DataFrame({col: data[col] for col in handle["columns"]}, copy=False)
+    if handle["index"] is not None:
+        df.index = handle["index"]
+    df.attrs.update(handle.get("attrs", {}))
+    return shm, df
+
+
+def _pack_result(result):
+    # 工作程序端：把大型結果 DataFrame 換成共享記憶體 handle
+    packed = {}
+    for key, value in result.items():
+        if isinstance(value, pd.DataFrame) and len(value) >= SHM_RESULT_MIN_ROWS:
+            shm, handle = pack_frame(value)
+            shm.close()  # 由主程序讀取後負責 unlink
+            packed[key] = ("__shm_frame__", handle)
+        else:
+            packed[key] = value
+    return packed
+
+
+def _unpack_result(result):
+    # 主程序端：複製出共享記憶體中的結果並釋放該區塊
+    unpacked = {}
+    for key, value in result.items():
+        if isinstance(value, tuple) and len(value) == 2 and value[0] == "__shm_frame__":
+            shm, df = attach_frame(value[1], copy=True)
+            shm.close()
+            shm.unlink()
+            unpacked[key] = df
+        else:
+            unpacked[key] = value
+    return unpacked
+
+
+# ---------- 工作程序端 ----------
+
+# 每個工作程序已掛載的資料集 {共享記憶體名稱: (shm, DataFrame)}
+_worker_datasets = {}
+
+
+def _worker_run(handle, prep_name, params):
+    name = handle["shm"]
+    if name not in _worker_datasets:
+        # 只保留最近掛載的幾個資料集，避免工作程序長期佔用已被主程序釋放的區塊
+        while len(_worker_datasets) >= MAX_PUBLISHED_DATASETS:
+            old_shm, old_df = _worker_datasets.pop(next(iter(_worker_datasets)))
+            del old_df
+            try:
+                old_shm.close()
+            except BufferError:
+                # 仍有陣列引用此區塊時保留映射，待程序結束時釋放
+                pass
+        _worker_datasets[name] = attach_frame(handle)
+    _, df = _worker_datasets[name]
+    return _pack_result(chart_prep.run_prep(prep_name, df, params))
+
+
+# ---------- 主程序端 ----------
+
+class ComputePool:
+    def __init__(self, max_workers=None, memo_size=64):
+        self.max_workers = max_workers if max_workers is not None else max(1, min(4, (os.cpu_count() or 1) - 1))
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+        self._executor = None
+        self._lock = threading.RLock()
+        self._memo = OrderedDict()
+        self._published = OrderedDict()  # {資料集指紋: (shm, handle)}
+        self._shm_refs = {}  # {共享記憶體名稱: 使用中的請求數}
+        self._retired = {}  # {共享記憶體名稱: shm}，已淘汰但仍有請求使用的區塊
+        self._inflight = {}  # {快取鍵: (工作程序 Future, 結果 Future)}，讓同時發出的相同請求共用結果
+        self._waiters = {}  # {快取鍵: 等待結果的呼叫端數}
+        self._slots = {}  # {(工作階段, 工作槽): (快取鍵, 結果 Future)}
+
+    def _get_executor(self):
+        if self._executor is None and self.max_workers > 0:
+            # Streamlit 伺服器是多執行緒程序，使用 spawn 避免 fork 後的鎖狀態問題
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @staticmethod
+    def _free_shm(shm):
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _publish(self, dataset_key, df):
+        # 每個資料集只寫入共享記憶體一次；超過 MAX_PUBLISHED_DATASETS 時淘汰最舊的區塊，
+        # 仍有排隊或執行中的請求使用時先移到 _retired，由 _release_shm 在最後一個請求結束後釋放
+        with self._lock:
+            if dataset_key in self._published:
+                self._published.move_to_end(dataset_key)
+                return self._published[dataset_key][1]
+            shm, handle = pack_frame(df, name=f"fin_{uuid.uuid4().hex[:16]}")
+            self._published[dataset_key] = (shm, handle)
+            while len(self._published) > MAX_PUBLISHED_DATASETS:
+                old_shm, _ = self._published.popitem(last=False)[1]
+                if self._shm_refs.get(old_shm.name):
+                    self._retired[old_shm.name] = old_shm
+                else:
+                    self._free_shm(old_shm)
+            return handle
+
+    def _release_shm(self, name):
+        # 使用該區塊的請求結束（完成、失敗或取消）
+        with self._lock:
+            self._shm_refs[name] -= 1
+            if self._shm_refs[name] == 0:
+                del self._shm_refs[name]
+                if name in self._retired:
+                    self._free_shm(self._retired.pop(name))
+
+    def _abandon(self, key, future, slot=None):
+        # 一個等待 future 的呼叫端放棄等待；沒有其他等待者時才取消尚未開始的請求
+        with self._lock:
+            if slot is not None and self._slots.get(slot) == (key, future):
+                del self._slots[slot]
+            entry = self._inflight.get(key)
+            if entry is None or entry[1] is not future:
+                return
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                entry[0].cancel()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def submit(self, dataset_key, df, prep_name, params, slot=None, cache_key=None):
+        # 回傳 (快取結果, None) 或 (None, Future)；Future 的結果是已從共享記憶體取回的資料
+        # dataset_key 識別整個 df（決定是否需要重新寫入共享記憶體），cache_key 預設與其相同
+        key = (dataset_key if cache_key is None else cache_key, prep_name, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self._memo:
+                self.hits += 1
+                self._memo.move_to_end(key)
+                return self._memo[key], None
+            self.misses += 1
+
+            # 同一工作槽出現新的請求時，放棄等待舊請求（沒有其他等待者時取消）
+            if slot is not None:
+                previous = self._slots.pop(slot, None)
+                if previous is not None and previous[0] != key:
+                    self._abandon(*previous)
+
+            if key in self._inflight:
+                outer = self._inflight[key][1]
+                self._waiters[key] += 1
+                if slot is not None:
+                    self._slots[slot] = (key, outer)
+                return None, outer
+
+            executor = self._get_executor()
+            if executor is None or len(df) < INLINE_ROW_THRESHOLD:
+                inner = None
+            else:
+                handle = self._publish(dataset_key, df)
+                inner = executor.submit(_worker_run, handle, prep_name, params)
+                self._shm_refs[handle["shm"]] = self._shm_refs.get(handle["shm"], 0) + 1
+                outer = concurrent.futures.Future()
+                self._inflight[key] = (inner, outer)
+                self._waiters[key] = 1
+                if slot is not None:
+                    self._slots[slot] = (key, outer)
+
+        if inner is None:
+            value = chart_prep.run_prep(prep_name, df, params)
+            self._remember(key, value)
+            return value, None
+
+        def _done(fut):
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._waiters.pop(key, None)
+            self._release_shm(handle["shm"])
+            if fut.cancelled():
+                outer.cancel()
+                outer.set_running_or_notify_cancel()
+            elif fut.exception() is not None:
+                outer.set_exception(fut.exception())
+            else:
+                value = _unpack_result(fut.result())
+                self._remember(key, value)
+                outer.set_result(value)
+
+        inner.add_done_callback(_done)
+        return None, outer
+
+    def cancel(self, dataset_key, prep_name, params, cache_key=None, slot=None):
+        # 呼叫端放棄等待請求；只有沒有其他等待者時才取消尚未開始執行的請求
+        # （已在工作程序中執行的請求無法中途停止，其結果仍會寫入快取）
+        key = (dataset_key if cache_key is None else cache_key, prep_name, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self._inflight:
+                self._abandon(key, self._inflight[key][1], slot=slot)
+
+    def run(self, dataset_key, df, prep_name, params, slot=None, on_wait=None, cache_key=None):
+        # 送出並等待結果；等待期間定期呼叫 on_wait，讓 Streamlit 有機會中斷被取代的 rerun
+        while True:
+            value, future = self.submit(dataset_key, df, prep_name, params, slot=slot, cache_key=cache_key)
+            if future is None:
+                return value
+            try:
+                while True:
+                    try:
+                        return future.result(timeout=0.1)
+                    except concurrent.futures.TimeoutError:
+                        if on_wait is not None:
+                            on_wait()
+            except concurrent.futures.CancelledError:
+                # 共用的請求已被取消（例如程序池關閉），重新送出
+                continue
+            except BaseException:
+                # rerun 被新的 widget 變更中斷（Streamlit 以 BaseException 控制流程）時放棄等待；
+                # 其他工作階段仍在等待同一請求時不取消
+                key = (dataset_key if cache_key is None else cache_key, prep_name, tuple(sorted(params.items())))
+                self._abandon(key, future, slot=slot)
+                raise
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "inflight": len(self._inflight),
+                "memo_entries": len(self._memo),
+                "retired_datasets": len(self._retired),
+            }
+
+    def shutdown(self):
+        # 由 app.py 在程序結束時呼叫 (atexit)；可重複呼叫
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            for shm, _ in self._published.values():
+                self._free_shm(shm)
+            for shm in self._retired.values():
+                self._free_shm(shm)
+            self._published.clear()
+            self._retired.clear()
@@ -0,0 +1,154 @@
+# data_edits.py
+# 可編輯資料模式：分析師在儀表板中修正的數值以差異層 (diff layer) 疊加在共用的處理後資料集上
+# - 基礎資料集不會被修改，各工作階段只保存自己的修改 {(列索引, 欄位): 新值}
+# - 修改原始欄位時，只重新計算被修改的資料列中依賴該欄位的衍生指標（例如 Debt → 負債比率 (%)）
+# - token(columns) 只涵蓋指定欄位（含衍生欄位的來源欄位）的修改，作為圖表資料與圖表快取的鍵：
+#   未讀取被修改欄位的快取仍然命中，改回原值後也會回到原本的快取
+# - 基礎資料集可能經過記憶體壓縮 (compaction.py)：被修改與重新計算的欄位先還原成原本的型別再寫入
+# - 寫入前一律以新的陣列取代被修改的欄位 (_own_column)，不依賴 pandas 3 的 Copy-on-Write；
+#   pandas 2.x 的淺複製與基礎資料集共用陣列，直接寫入會改到所有工作階段共用的資料集
+import hashlib
+import time
+
+import compaction
+import lazy_imports
+import pipeline
+
+pd = lazy_imports.lazy("pandas")
+np = lazy_imports.lazy("numpy")
+
+
+def _same_value(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return a == b
+
+
+class EditLayer:
+    def __init__(self, base, dataset_key=None):
+        self.base = base  # 共用的處理後資料集（唯讀）
+        self.dataset_key = dataset_key
+        self.sources = pipeline.derived_sources(base.columns)  # {衍生欄位: 來源欄位}
+        self.edits = {}  # {(列索引, 欄位): 新值}，只保存與基礎資料集不同的值
+        self.version = 0
+        self.last_recompute = None  # 最近一次套用修改的 {"rows", "columns", "ms"}
+        self._frame = base
+
+    @property
+    def derived_columns(self):
+        return set(self.sources)
+
+    def dependents(self, columns):
+        # 修改這些原始欄位後需要重新計算的衍生欄位
+        columns = set(columns)
+        return {name for name, cols in self.sources.items() if columns & set(cols)}
+
+    def _coerce(self, column, value):
+        # 修改後的值沿用原欄位的型別，避免改變可用圖表與快取的判斷
+        series = self.base[column]
+        if pd.api.types.is_bool_dtype(series):
+            return bool(value)
+        if pd.api.types.is_numeric_dtype(series):
+            value = pd.to_numeric(value, errors="coerce")
+            return np.nan if pd.isna(value) or np.isinf(value) else float(value)
+        if column == "Name":
+            return str(value).strip()
+        return value
+
+    def _original(self, index, column):
+        # 基礎資料集的值；float32 欄位依原始小數位數還原，與壓縮前的值相同
+        value = self.base.at[index, column]
+        decimals = self.base.attrs.get(compaction.DECIMALS_ATTR, {}).get(column)
+        if decimals is not None and self.base[column].dtype == np.float32 and not pd.isna(value):
+            return float(np.round(np.float64(value), decimals))
+        return value
+
+    @staticmethod
+    def _own_column(frame, column, owned):
+        # 以新的陣列取代欄位（壓縮過的欄位同時還原），之後的寫入不會影響其他 DataFrame；每次套用只複製一次
+        if column not in owned:
+            if compaction.is_compacted(frame[column]):
+                frame[column] = compaction.restore_column(frame, column)
+            else:
+                frame[column] = frame[column].copy()
+            owned.add(column)
+
+    def apply(self, changes):
+        # changes: {(列索引, 欄位): 新值}；回傳受影響的欄位（被修改的欄位與重新計算的衍生欄位）
+        start = time.perf_counter()
+        frame = self._frame.copy(deep=False)  # 只複製欄位清單；被修改的欄位由 _own_column 複製後才寫入
+        owned = set()
+        rows, columns = set(), set()
+        for (index, column), value in changes.items():
+            if column in self.sources:
+                raise ValueError(f"衍生欄位 '{column}' 由其他欄位計算而來，無法直接修改")
+            if column not in self.base.columns:
+                raise KeyError(column)
+            value = self._coerce(column, value)
+            if _same_value(value, self._original(index, column)):
+                self.edits.pop((index, column), None)
+            else:
+                self.edits[(index, column)] = value
+            self._own_column(frame, column, owned)
+            if frame[column].dtype.kind in "iu" and not (float(value).is_integer()):
+                # 整數欄位填入小數或空值時改為浮點數
+                frame[column] = frame[column].astype(float)
+            frame.at[index, column] = value
+            rows.add(index)
+            columns.add(column)
+
+        derived = self.dependents(columns)
+        if rows and derived:
+            # 只重新計算被修改的資料列
+            subset = compaction.widen(frame.loc[sorted(rows)])
+            for name in derived:
+                self._own_column(frame, name, owned)
+                frame.loc[subset.index, name] = pipeline.compute_derived(subset, name, self.sources)
+        self._frame = frame
+        self.version += 1
+        self.last_recompute = {"rows": len(rows), "columns": sorted(columns | derived),
+                               "ms": (time.perf_counter() - start) * 1000}
+        return columns | derived
+
+    def revert(self, keys):
+        # 把指定的修改改回基礎資料集的值
+        return self.apply({key: self._original(*key) for key in keys if key in self.edits})
+
+    def reset(self):
+        self.edits.clear()
+        self._frame = self.base
+        self.version += 1
+
+    def frame(self):
+        # 疊加所有修改後的資料集；沒有修改時就是基礎資料集本身
+        return self._frame
+
+    def token(self, columns=None):
+        # 修改內容的摘要；columns 為 None 時涵蓋所有修改
+        # 沒有相關修改時回傳空字串，與未編輯的資料集共用快取
+        if not self.edits:
+            return ""
+        if columns is None:
+            relevant = self.edits
+        else:
+            columns = set(columns)
+            for name in columns & set(self.sources):
+                columns.update(self.sources[name])
+            relevant = {key: value for key, value in self.edits.items() if key[1] in columns}
+        if not relevant:
+            return ""
+        payload = repr(sorted((repr(key), repr(value)) for key, value in relevant.items()))
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+    def diff(self):
+        # 修改清單（列索引、公司名稱、欄位、原值、新值），依列索引排序
+        return [{"index": index, "Name": self.base.at[index, "Name"] if "Name" in self.base.columns else index,
+                 "column": column, "original": self._original(index, column), "edited": value}
+                for (index, column), value in sorted(self.edits.items())]
+
+    def stats(self):
+        stats = {"edits": len(self.edits), "edited_rows": len({index for index, _ in self.edits}), "version": self.version}
+        if self.last_recompute is not None:
+            stats["last_recompute_rows"] = self.last_recompute["rows"]
+            stats["last_recompute_ms"] = self.last_recompute["ms"]
+        return stats
@@ -0,0 +1,159 @@
+# figure_cache.py
+# Plotly 圖表快取：以 (資料集指紋, 圖表, 參數) 為鍵，儲存序列化後重建的圖表
+# 數值陣列以 plotly.js 支援的 typed array (base64 二進位) 格式編碼，
+# 圖表與參數未變時直接送出快取內容，不必重新執行 px.* 建圖
+# 快取的圖表以不驗證的方式建立 (_validate=False)：內容在寫入前已由 plotly 驗證過，
+# 命中時 st.plotly_chart 只需複製與序列化，不必把 dict 重建成 go.Figure 並逐一驗證每個屬性
+import base64
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+# plotly.py 6 起的驗證器才接受 {"dtype", "bdata"} 形式的陣列
+TYPED_ARRAYS_SUPPORTED = int(plotly.__version__.split(".")[0]) >= 6
+# 少於此長度的陣列直接以 JSON 清單輸出，base64 反而較長
+TYPED_ARRAY_MIN_LENGTH = 16
+
+# plotly.js 支援的 typed array 型別（不支援 64 位元整數）
+_DTYPE_CODES = {
+    np.dtype("float64"): "f8", np.dtype("float32"): "f4",
+    np.dtype("int32"): "i4", np.dtype("uint32"): "u4",
+    np.dtype("int16"): "i2", np.dtype("uint16"): "u2",
+    np.dtype("int8"): "i1", np.dtype("uint8"): "u1",
+}
+
+
+def _typed_array(values):
+    # 將數值陣列轉為 {"dtype", "bdata"}；無法安全轉換時回傳 None
+    if values.dtype.kind == "b":
+        values = values.astype(np.uint8)
+    elif values.dtype.kind in "iu" and values.dtype not in _DTYPE_CODES:
+        # 64 位元整數：範圍允許時降為 int32，否則改用 float64
+        if values.size and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+            values = values.astype(np.int32)
+        else:
+            values = values.astype(np.float64)
+    elif values.dtype.kind == "f" and values.dtype not in _DTYPE_CODES:
+        values = values.astype(np.float64)
+    code = _DTYPE_CODES.get(values.dtype)
+    if code is None:
+        return None
+    values = np.ascontiguousarray(values).astype(values.dtype.newbyteorder("<"), copy=False)
+    return {"dtype": code, "bdata": base64.b64encode(values.tobytes()).decode("ascii")}
+
+
+def encode_typed_arrays(obj):
+    # 遞迴走訪 figure.to_plotly_json() 的結果，把一維數值陣列換成 typed array
+    if isinstance(obj, dict):
+        return {k: encode_typed_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        if len(obj) >= TYPED_ARRAY_MIN_LENGTH and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in obj
+        ):
+            encoded = _typed_array(np.asarray(obj))
+            if encoded is not None:
+                return encoded
+        return [encode_typed_arrays(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        if obj.ndim == 1 and obj.size >= TYPED_ARRAY_MIN_LENGTH and obj.dtype.kind in "biuf":
+            encoded = _typed_array(obj)
+            if encoded is not None:
+                return encoded
+        return obj
+    return obj
+
+
+def serialize_figure(fig):
+    spec = fig.to_plotly_json()
+    if TYPED_ARRAYS_SUPPORTED:
+        spec = encode_typed_arrays(spec)
+    return json.dumps(spec, cls=PlotlyJSONEncoder, separators=(",", ":"))
+
+
+def deserialize_figure(payload):
+    # typed array 維持 base64 字串，送出時不必重新編碼
+    return go.Figure(json.loads(payload), _validate=False)
+
+
+def _deep_sizeof(obj, seen=None):
+    # 巢狀 dict / list 實際佔用的記憶體；共用的物件（例如單字元字串）只計算一次
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    return size
+
+
+class FigureCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {快取鍵: (圖表, 佔用的記憶體)}；容量以快取中圖表物件的大小計算，
+        # 而非序列化 JSON 的長度（解析後的 dict / list 約為 JSON 的 1.2 到 8 倍）
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        # 多個工作階段共用同一個圖表物件；st.plotly_chart 只讀取 (to_dict 會先複製)，不會修改
+        return entry[0]
+
+    def __contains__(self, key):
+        # 只檢查是否已快取，不計入命中率（背景預先計算用來略過已建好的圖表）
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, fig):
+        # 回傳快取的圖表佔用的記憶體 (bytes)：以建立圖表的 dict 計算，typed array 的 base64 字串與圖表共用
+        spec = json.loads(serialize_figure(fig))
+        nbytes = _deep_sizeof(spec)
+        cached = go.Figure(spec, _validate=False)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (cached, nbytes)
+            self._bytes += nbytes
+            # 超過容量時依最久未使用 (LRU) 淘汰
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return nbytes
+
+    def get_or_build(self, key, build):
+        # 命中時回傳快取的圖表；未命中時呼叫 build() 建圖、存入快取並回傳新建的圖表
+        fig = self.get(key)
+        if fig is None:
+            fig = build()
+            self.put(key, fig)
+        return fig
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
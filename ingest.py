@@ -0,0 +1,77 @@
+# ingest.py
+# 讀取上傳的資料檔：CSV、Parquet、Feather 與 XLSX
+# - CSV 以 pyarrow 的多執行緒解析器讀取；檔案編碼或格式不符時改用 pandas 預設的 C 解析器
+# - Parquet / Feather 直接以 Arrow 讀取，保留原本的欄位型別，數值欄位不必再由文字轉換
+# - Name / Industry 使用 Arrow 字串型別，比 Python 物件字串節省記憶體，篩選與分組也較快
+import importlib.util
+import io
+import os
+
+import lazy_imports
+
+pd = lazy_imports.lazy("pandas")
+np = lazy_imports.lazy("numpy")
+
+SUPPORTED_EXTENSIONS = ("csv", "parquet", "feather", "xlsx")
+# 以 Arrow 字串型別存放的文字欄位
+ARROW_STRING_COLUMNS = ("Name", "Industry")
+
+
+def file_format(name):
+    # 由副檔名判斷格式；不支援時回傳 None
+    ext = os.path.splitext(name)[1].lower().lstrip(".")
+    return ext if ext in SUPPORTED_EXTENSIONS else None
+
+
+def arrow_string_dtype():
+    # pandas 2.3 以後可指定缺值為 NaN，與其他欄位及 pandas 3 的預設字串型別一致
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype("pyarrow")
+
+
+def _read_csv(buffer):
+    try:
+        return pd.read_csv(io.BytesIO(buffer), engine="pyarrow")
+    except Exception:
+        # pyarrow 只接受 UTF-8，且不容許欄位數不一致的資料列；這些檔案沿用原本的讀取方式
+        return pd.read_csv(io.BytesIO(buffer))
+
+
+def _read_xlsx(buffer):
+    # 有安裝 python-calamine 時使用（以 Rust 解析，比 openpyxl 快數倍），否則使用 openpyxl
+    engine = "calamine" if importlib.util.find_spec("python_calamine") is not None else "openpyxl"
+    return pd.read_excel(io.BytesIO(buffer), engine=engine)
+
+
+_READERS = {
+    "csv": _read_csv,
+    "parquet": lambda buffer: pd.read_parquet(io.BytesIO(buffer)),
+    "feather": lambda buffer: pd.read_feather(io.BytesIO(buffer)),
+    "xlsx": _read_xlsx,
+}
+
+
+def to_arrow_strings(df, columns=ARROW_STRING_COLUMNS):
+    # 只轉換文字欄位；數值型的欄位（例如以代號作為名稱）維持原樣，交給後續的名稱欄位辨識處理
+    dtype = arrow_string_dtype()
+    for col in columns:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]) and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def read_table(buffer, name):
+    # buffer 為檔案內容 (bytes)；回傳清理過欄位名稱的 DataFrame
+    fmt = file_format(name)
+    if fmt is None:
+        raise ValueError(f"不支援的檔案格式：{name}（支援 {', '.join(SUPPORTED_EXTENSIONS)}）")
+    df = _READERS[fmt](buffer)
+    df.columns = df.columns.astype(str).str.strip()  # 清理欄位名稱的空白字符
+    return to_arrow_strings(df)
+
+
+def read_path(path):
+    with open(path, "rb") as f:
+        return read_table(f.read(), os.path.basename(path))
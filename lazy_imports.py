@@ -0,0 +1,61 @@
+# lazy_imports.py
+# 延遲匯入：pandas、plotly、Gemini 客戶端 (google.ai.generativelanguage) 等較重的套件等到第一次真正使用時才匯入
+# 每個模組在整個程序中只匯入一次，並記錄匯入耗時與觸發的執行緒，供效能面板顯示
+import importlib
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+# 由本模組載入過的模組 {模組名稱: {"duration_ms", "loaded_at", "thread", "preloaded"}}
+_import_log = {}
+
+
+def load(name):
+    # 已載入時只做兩次 dict 查詢；第一次載入時計時並記錄
+    module = sys.modules.get(name)
+    if module is not None and name in _import_log:
+        return module
+    with _lock:
+        if name not in _import_log:
+            preloaded = name in sys.modules  # 已被其他模組匯入時，耗時已在別處支付
+            start = time.perf_counter()
+            importlib.import_module(name)
+            _import_log[name] = {
+                "duration_ms": (time.perf_counter() - start) * 1000,
+                "loaded_at": start,
+                "thread": threading.get_ident(),
+                "preloaded": preloaded,
+            }
+    return sys.modules[name]
+
+
+class LazyModule:
+    # 模組代理：第一次存取屬性時才匯入真正的模組，之後的存取直接轉給該模組
+    __slots__ = ("_name",)
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(load(self._name), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._name in _import_log else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def import_log():
+    # 依載入順序回傳 [(模組名稱, 記錄)]
+    with _lock:
+        return sorted(((name, dict(entry)) for name, entry in _import_log.items()), key=lambda item: item[1]["loaded_at"])
+
+
+def imports_since(start, thread=None):
+    # 回傳在 start (time.perf_counter()) 之後、由指定執行緒觸發的匯入
+    return [(name, entry) for name, entry in import_log()
+            if entry["loaded_at"] >= start and (thread is None or entry["thread"] == thread)]
@@ -0,0 +1,319 @@
+# llm_scheduler.py
+# 全程序共用的 LLM 請求排程器：所有頁面的 Gemini 呼叫都經由這裡送出
+# - 每個 API Key 一個權杖桶 (token bucket) 限制請求速率，超過配額 (429) 時退避重試
+# - 同時執行的請求數有上限；互動聊天優先於長篇報告
+# - 相同的請求（同一 API Key、模型與內容）仍在排隊或執行中時，共用同一個結果
+# - 記錄排隊深度與等待時間，供效能除錯面板顯示
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+
+import lazy_imports
+
+# 數字越小越優先
+PRIORITY_CHAT = 0
+PRIORITY_REPORT = 10
+
+# 可由環境變數調整；預設值大致對應 Gemini 免費方案的每分鐘請求數
+DEFAULT_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "10"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+# 最多保留的 Gemini 客戶端數（每個 API Key 一個）；每個工作階段都可能輸入不同的 Key，不設上限會一直累積連線
+DEFAULT_MAX_CLIENTS = int(os.environ.get("LLM_MAX_CLIENTS", "32"))
+
+
+# ---------- 預設的 Gemini 呼叫 ----------
+
+_client_lock = threading.Lock()
+_clients = OrderedDict()  # {API Key: 綁定該 Key 的 Gemini 客戶端}，依最久未使用 (LRU) 淘汰
+
+
+def _client_for(api_key):
+    # 每個 Key 各自建立 GenerativeServiceClient（google.generativeai 底層使用的公開客戶端），
+    # 不經過全程序共用的 genai.configure()，不同 Key 的請求同時執行也不會互相覆蓋
+    with _client_lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _clients.move_to_end(api_key)
+        else:
+            glm = lazy_imports.load("google.ai.generativelanguage")
+            options = {"api_key": api_key}
+            kwargs = {}
+            # 設定 GEMINI_API_ENDPOINT 時改以 REST 連到該端點（例如本機的假模型伺服器 benchmarks/fake_llm_server.py）
+            endpoint = os.environ.get("GEMINI_API_ENDPOINT")
+            if endpoint:
+                options["api_endpoint"] = endpoint
+                kwargs["transport"] = "rest"
+            client = _clients[api_key] = glm.GenerativeServiceClient(client_options=options, **kwargs)
+            # 被淘汰的客戶端不主動關閉：進行中的請求仍持有它，結束後連線隨物件回收
+            while len(_clients) > max(DEFAULT_MAX_CLIENTS, 1):
+                _clients.popitem(last=False)
+        return client
+
+
+def gemini_generate(api_key, model, contents):
+    # contents: [{"role": "user" | "model", "parts": [文字]}]，聊天時包含完整對話紀錄
+    glm = lazy_imports.load("google.ai.generativelanguage")
+    request = glm.GenerateContentRequest(
+        model=model if model.startswith("models/") else f"models/{model}",
+        contents=[glm.Content(role=message["role"], parts=[glm.Part(text=part) for part in message["parts"]])
+                  for message in contents],
+    )
+    response = _client_for(api_key).generate_content(request=request)
+    if not response.candidates or not response.candidates[0].content.parts:
+        # 與 google.generativeai 的 response.text 相同：被安全設定擋下或沒有內容時視為錯誤
+        raise ValueError(f"模型沒有回傳內容：{response.prompt_feedback}")
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+def is_retryable(exc):
+    # 配額用盡 (429) 或服務暫時無法使用 (503) 時值得重試
+    return getattr(exc, "code", None) in (429, 503) or type(exc).__name__ in (
+        "ResourceExhausted", "TooManyRequests", "ServiceUnavailable")
+
+
+# ---------- 排程器 ----------
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now):
+        # 取得一個權杖時回傳 0；否則回傳還要等待的秒數
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class LLMJob:
+    def __init__(self, key, api_key, model, contents, priority, seq):
+        self.key = key
+        self.api_key = api_key
+        self.model = model
+        self.contents = contents
+        self.priority = priority
+        self.seq = seq
+        self.future = concurrent.futures.Future()
+        self.waiters = 1
+        self.attempts = 0
+        self.not_before = 0.0  # 重試退避期間不得早於此時間派送
+        self.rate_limited = False  # 是否曾因權杖用完而延後派送
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def wait_ms(self):
+        # 從送出到第一次開始執行的排隊時間
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return (end - self.submitted_at) * 1000
+
+
+class LLMScheduler:
+    def __init__(self, call=gemini_generate, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=None,
+                 max_retries=3, backoff=2.0, wait_samples=500):
+        self.call = call
+        self.max_concurrency = max_concurrency
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst if burst is not None else max(1.0, min(requests_per_minute, max_concurrency))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._cond = threading.Condition()
+        self._queue = []  # 等待派送的 LLMJob
+        self._inflight = {}  # {請求鍵: LLMJob}，排隊中與執行中的請求，供合併相同請求
+        self._buckets = {}  # {API Key: TokenBucket}
+        self._running = 0
+        self._seq = itertools.count()
+        self._closed = False
+        self._waits = {PRIORITY_CHAT: deque(maxlen=wait_samples), PRIORITY_REPORT: deque(maxlen=wait_samples)}
+        self.counters = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0,
+                         "retries": 0, "rate_limited": 0, "cancelled": 0}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="llm-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    @staticmethod
+    def request_key(api_key, model, contents):
+        payload = json.dumps([api_key, model, contents], ensure_ascii=False, sort_keys=True)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def submit(self, api_key, model, contents, priority=PRIORITY_REPORT):
+        key = self.request_key(api_key, model, contents)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LLM 排程器已關閉")
+            job = self._inflight.get(key)
+            if job is not None:
+                # 相同請求仍在排隊或執行中：共用結果；若新請求較優先則提高排隊優先權
+                job.waiters += 1
+                job.priority = min(job.priority, priority)
+                self.counters["coalesced"] += 1
+                self._cond.notify_all()
+                return job
+            job = LLMJob(key, api_key, model, contents, priority, next(self._seq))
+            self._inflight[key] = job
+            self._queue.append(job)
+            self.counters["submitted"] += 1
+            self._cond.notify_all()
+        return job
+
+    def wait(self, job, on_wait=None, poll=0.1):
+        # 等待結果；等待期間定期呼叫 on_wait，讓 Streamlit 有機會中斷被取代的 rerun
+        try:
+            while True:
+                try:
+                    return job.future.result(timeout=poll)
+                except concurrent.futures.TimeoutError:
+                    if on_wait is not None:
+                        on_wait()
+        except BaseException:
+            # rerun 被中斷（Streamlit 以 BaseException 控制流程）時，沒有其他人在等的排隊請求直接撤銷
+            self.release(job)
+            raise
+
+    def run(self, api_key, model, contents, priority=PRIORITY_REPORT, on_wait=None):
+        return self.wait(self.submit(api_key, model, contents, priority), on_wait=on_wait)
+
+    def release(self, job):
+        with self._cond:
+            if job.future.done():
+                return
+            job.waiters -= 1
+            if job.waiters <= 0 and job in self._queue:
+                self._queue.remove(job)
+                self._inflight.pop(job.key, None)
+                self.counters["cancelled"] += 1
+                job.future.cancel()
+
+    def queue_position(self, job):
+        # 派送順序中排在此請求之前的請求數（不含執行中的請求）
+        with self._cond:
+            if job not in self._queue:
+                return 0
+            return sum(1 for other in self._queue if (other.priority, other.seq) < (job.priority, job.seq))
+
+    def _bucket(self, api_key):
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job, wake = None, None
+                while job is None:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    wake = None
+                    if self._running < self.max_concurrency:
+                        for candidate in sorted(self._queue, key=lambda j: (j.priority, j.seq)):
+                            if candidate.not_before > now:
+                                wake = candidate.not_before if wake is None else min(wake, candidate.not_before)
+                                continue
+                            delay = self._bucket(candidate.api_key).try_acquire(now)
+                            if delay == 0:
+                                job = candidate
+                                break
+                            # 此 Key 的權杖用完：跳過，讓其他 Key 的請求先走
+                            if not candidate.rate_limited:
+                                candidate.rate_limited = True
+                                self.counters["rate_limited"] += 1
+                            wake = now + delay if wake is None else min(wake, now + delay)
+                    if job is None:
+                        self._cond.wait(timeout=None if wake is None else max(wake - now, 0.001))
+                self._queue.remove(job)
+                self._running += 1
+                if job.started_at is None:
+                    job.started_at = time.monotonic()
+                    self._waits[PRIORITY_CHAT if job.priority <= PRIORITY_CHAT else PRIORITY_REPORT].append(job.wait_ms)
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            result = self.call(job.api_key, job.model, job.contents)
+        except Exception as exc:
+            with self._cond:
+                self._running -= 1
+                if is_retryable(exc) and job.attempts < self.max_retries and not self._closed:
+                    # 指數退避後重新排隊，保留原本的優先順序
+                    job.attempts += 1
+                    job.not_before = time.monotonic() + self.backoff * 2 ** (job.attempts - 1)
+                    self._queue.append(job)
+                    self.counters["retries"] += 1
+                    self._cond.notify_all()
+                    return
+                self._inflight.pop(job.key, None)
+                self.counters["failed"] += 1
+                job.finished_at = time.monotonic()
+                self._cond.notify_all()
+            job.future.set_exception(exc)
+            return
+        with self._cond:
+            self._running -= 1
+            self._inflight.pop(job.key, None)
+            self.counters["completed"] += 1
+            job.finished_at = time.monotonic()
+            self._cond.notify_all()
+        job.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            depth = {PRIORITY_CHAT: 0, PRIORITY_REPORT: 0}
+            for job in self._queue:
+                depth[PRIORITY_CHAT if job.priority <= PRIORITY_CHAT else PRIORITY_REPORT] += 1
+            waits = {p: list(samples) for p, samples in self._waits.items()}
+            counters = dict(self.counters)
+            running = self._running
+        stats = {
+            # hits / misses 讓效能面板可把合併請求當成快取命中率顯示
+            "hits": counters["coalesced"],
+            "misses": counters["submitted"],
+            "queue_depth": depth[PRIORITY_CHAT] + depth[PRIORITY_REPORT],
+            "queue_depth_chat": depth[PRIORITY_CHAT],
+            "queue_depth_report": depth[PRIORITY_REPORT],
+            "running": running,
+            **counters,
+        }
+        for priority, name in ((PRIORITY_CHAT, "chat"), (PRIORITY_REPORT, "report")):
+            samples = waits[priority]
+            stats[f"wait_ms_p50_{name}"] = statistics.median(samples) if samples else 0.0
+            stats[f"wait_ms_p95_{name}"] = statistics.quantiles(samples, n=20, method="inclusive")[-1] if len(samples) >= 2 else (samples[0] if samples else 0.0)
+            stats[f"wait_ms_max_{name}"] = max(samples) if samples else 0.0
+        return stats
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            pending, self._queue = self._queue, []
+            self._inflight.clear()
+            self._cond.notify_all()
+        for job in pending:
+            job.future.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    # 各頁面共用同一個排程器（st.cache_resource 以函數為單位快取，無法跨頁面共用）
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
@@ -1,61 +1,119 @@
 # pages/2_💰_財務機器人.py
 import os
+import uuid
 import streamlit as st
-import google.generativeai as genai
+
+import chat_store
+import llm_scheduler
+import perf
+import semantic_cache
+
+# 每次只顯示最近幾則訊息，較早的訊息按需要再載入
+CHAT_PAGE_SIZE = 20
 
 st.set_page_config(page_title="💰 財務機器人", layout="wide")
 st.title("💰 AI 財務聊天機器人")
 
+# --- 效能量測（在首頁側邊欄開啟） ---
+recorder = perf.get_recorder(st.session_state)
+recorder.begin_run("AI聊天室")
+
+# --- LLM 排程器（全程序共用，Gemini 客戶端在第一次送出請求時才匯入） ---
+scheduler = llm_scheduler.get_scheduler()
+recorder.register_cache("LLM 請求合併", scheduler.stats)
+recorder.register_metrics("LLM 排程器", lambda: {k: v for k, v in scheduler.stats().items() if k not in ("hits", "misses")})
+
+# --- 相似問題快取（全程序共用） ---
+answer_cache = semantic_cache.get_cache()
+recorder.register_cache("相似問題快取", answer_cache.stats)
+
 # --- 檢查首頁是否有輸入 API Key ---
 if "GOOGLE_API_KEY" not in st.session_state or not st.session_state["GOOGLE_API_KEY"]:
     st.error("⚠️ 請先在首頁輸入 Gemini API Key")
     st.stop()
 
-# --- 設定環境變數 & SDK ---
+# --- 設定環境變數 ---
 os.environ["GOOGLE_API_KEY"] = st.session_state["GOOGLE_API_KEY"]
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
-# --- 初始化對話紀錄 ---
-if "finance_chat_history" not in st.session_state:
-    st.session_state.finance_chat_history = []
+# --- 初始化對話紀錄（存放在 SQLite；對話 ID 放在網址參數中，重新整理後仍可取回） ---
+store = chat_store.get_store()
+if "chat" not in st.query_params:
+    st.query_params["chat"] = uuid.uuid4().hex
+chat_id = st.query_params["chat"]
+if st.session_state.get("chat_visible_for") != chat_id:
+    st.session_state.chat_visible_for = chat_id
+    st.session_state.chat_visible = CHAT_PAGE_SIZE
 
 # --- 側邊欄工具 ---
 with st.sidebar:
     st.subheader("⚙️ 工具")
     if st.button("🧹 清除對話", use_container_width=True):
-        st.session_state.finance_chat_history = []
+        store.clear(chat_id)
+        st.session_state.chat_visible = CHAT_PAGE_SIZE
         st.success("對話已清除，開始新的聊天吧！")
+    use_answer_cache = st.toggle("💡 相似問題直接使用快取回覆", value=True,
+                                 help="在相同的對話脈絡下，措辭相近的問題直接使用先前的 AI 回覆")
 
 # --- 使用者輸入 ---
 user_input = st.chat_input("輸入你的財務問題...")
 
 if user_input:
-    # 存使用者訊息
-    st.session_state.finance_chat_history.append({"role": "user", "content": user_input})
+    # 對話紀錄只讀取一次：同時用於相似問題快取的脈絡與送出的對話內容
+    history = store.history(chat_id)
+
+    # 相同對話脈絡下的相似問題直接使用快取回覆
+    scope = semantic_cache.chat_scope("gemini-2.5-flash", history)
+    cached = answer_cache.lookup(scope, user_input) if use_answer_cache else None
 
-    # 建立 Gemini 模型
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    # 對話內容（含歷史與本次問題）
+    contents = [
+        {"role": msg["role"], "parts": [msg["content"]]}
+        for msg in history
+        if msg["role"] in ["user", "model"]
+    ]
+    contents.append({"role": "user", "parts": [user_input]})
 
-    # 建立對話（含歷史）
-    chat = model.start_chat(
-        history=[
-            {"role": msg["role"], "parts": [msg["content"]]}
-            for msg in st.session_state.finance_chat_history
-            if msg["role"] in ["user", "model"]
-        ]
-    )
+    reply = None
+    if cached is not None:
+        reply, similarity, _ = cached
+        st.toast(f"💡 使用相似問題的快取回覆（相似度 {similarity:.0%}）")
+    else:
+        # 經由排程器送出（聊天優先於報告），等待期間顯示排隊位置
+        placeholder = st.empty()
+        try:
+            job = scheduler.submit(os.environ["GOOGLE_API_KEY"], "gemini-2.5-flash", contents,
+                                   priority=llm_scheduler.PRIORITY_CHAT)
+            with recorder.span("llm:chat"):
+                reply = scheduler.wait(job, on_wait=lambda: placeholder.caption(
+                    f"⏳ 等待 AI 回覆...（前方還有 {scheduler.queue_position(job)} 個請求）"))
+            recorder.add_span("llm:queue_wait", job.wait_ms)
+            answer_cache.put(scope, user_input, reply)
+        except Exception as e:
+            st.error(f"❌ AI 回覆失敗（這次的問題沒有加入對話紀錄）：{e}")
+        finally:
+            placeholder.empty()
 
-    # 發送訊息並取得回覆
-    response = chat.send_message(user_input)
+    # 取得回覆後才同時寫入使用者訊息與 AI 回覆；失敗或 rerun 被中斷時不會留下沒有回覆的使用者訊息
+    if reply is not None:
+        store.append(chat_id, "user", user_input)
+        store.append(chat_id, "model", reply)
 
-    # 存 AI 回覆
-    st.session_state.finance_chat_history.append({"role": "model", "content": response.text})
+# --- 顯示對話紀錄（只讀取並顯示最近的訊息） ---
+def show_older_messages():
+    st.session_state.chat_visible += CHAT_PAGE_SIZE
 
-# --- 顯示對話紀錄 ---
-for msg in st.session_state.finance_chat_history:
+hidden = store.count(chat_id) - st.session_state.chat_visible
+if hidden > 0:
+    st.button(f"⬆️ 載入較早的訊息（還有 {hidden} 則）", on_click=show_older_messages)
+for msg in store.recent(chat_id, st.session_state.chat_visible):
     if msg["role"] == "user":
         with st.chat_message("user"):
             st.write(msg["content"])
     else:
         with st.chat_message("assistant"):
             st.write(msg["content"])
+
+# --- 效能除錯面板 ---
+recorder.end_run()
+if recorder.enabled:
+    perf.render_panel(st.sidebar, recorder)
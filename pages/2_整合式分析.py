@@ -1,6 +1,12 @@
 # pages/2_整合式分析.py
+import functools
+
 import streamlit as st
-import google.generativeai as genai
+
+import batch_reports
+import llm_scheduler
+import perf
+import semantic_cache
 
 st.set_page_config(page_title="AI 專業經理人團隊整合分析", layout="wide")
 st.title("📈 AI 專業經理人團隊整合分析")
@@ -12,25 +18,40 @@ st.markdown(
 - 單次請求生成完整報告
 - 報告包含 CFO、COO、CEO 三個層次的分析
 - 顯示生成進度，並在完成後呈現整合結果
+- 產業批次報告：為產業內每家公司各產生一份報告，在背景執行並存到磁碟
 """
 )
 
+# --- 效能量測（在首頁側邊欄開啟） ---
+recorder = perf.get_recorder(st.session_state)
+recorder.begin_run("整合式分析")
+
+# --- LLM 排程器（全程序共用，Gemini 客戶端在第一次送出請求時才匯入） ---
+scheduler = llm_scheduler.get_scheduler()
+recorder.register_cache("LLM 請求合併", scheduler.stats)
+recorder.register_metrics("LLM 排程器", lambda: {k: v for k, v in scheduler.stats().items() if k not in ("hits", "misses")})
+
+# --- 相似問題快取（全程序共用） ---
+answer_cache = semantic_cache.get_cache()
+recorder.register_cache("相似問題快取", answer_cache.stats)
+
 # --- 檢查 API Key ---
 if "GOOGLE_API_KEY" not in st.session_state or not st.session_state["GOOGLE_API_KEY"]:
     st.info("請先在首頁輸入 API Key")
     st.stop()
 else:
     api_key = st.session_state["GOOGLE_API_KEY"]
-    genai.configure(api_key=api_key)
 
 # --- 使用者輸入 ---
 business_question = st.text_area(
     "請輸入您的商業問題或分析需求",
     placeholder="例如：請分析新產品的投資回報與營運風險..."
 )
+use_answer_cache = st.checkbox("💡 相似問題直接使用快取報告", value=True,
+                               help="措辭相近的問題直接使用先前產生的報告，不再呼叫 AI")
 
 # --- 單次請求生成整合報告 ---
-def single_call_analysis(question: str):
+def single_call_analysis(question: str, on_wait=None):
     prompt = f"""
 模擬一個由 CFO、COO、CEO 組成的專家團隊，針對以下商業問題生成完整整合報告：
 商業問題: {question}
@@ -40,20 +61,97 @@ def single_call_analysis(question: str):
 2. 🏭 COO 分析: 營運可行性、流程與風險。
 3. 👑 CEO 最終決策: 綜合以上觀點，提供戰略總結與後續行動建議。
 """
-    # 使用 Gemini 模型
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    response = model.generate_content(contents=prompt)
-    return response.text
+    # 經由排程器使用 Gemini 模型（報告的優先權低於聊天；相同問題同時送出時只呼叫一次）
+    job = scheduler.submit(api_key, "gemini-1.5-flash", [{"role": "user", "parts": [prompt]}],
+                           priority=llm_scheduler.PRIORITY_REPORT)
+    text = scheduler.wait(job, on_wait=on_wait)
+    recorder.add_span("llm:queue_wait", job.wait_ms)
+    return text
 
 # --- 按鈕觸發 ---
 if st.button("生成整合報告") and business_question.strip():
+    placeholder = st.empty()
+    report_scope = "report:gemini-1.5-flash"
+    cached = answer_cache.lookup(report_scope, business_question) if use_answer_cache else None
     with st.spinner("AI 專業經理人團隊正在進行全面分析..."):
         try:
-            report = single_call_analysis(business_question)
+            if cached is not None:
+                report, similarity, original_question = cached
+                st.info(f"💡 使用相似問題的快取報告（相似度 {similarity:.0%}，原問題：{original_question}）")
+            else:
+                with recorder.span("llm:report"):
+                    # 等待期間更新畫面，讓 Streamlit 可中斷被取代的 rerun
+                    report = single_call_analysis(business_question, on_wait=lambda: placeholder.caption(
+                        f"⏳ 目前排隊中的 AI 請求：{scheduler.stats()['queue_depth']} 個"))
+                placeholder.empty()
+                answer_cache.put(report_scope, business_question, report)
             st.success("📈 AI 專業經理人團隊整合報告完成！")
             st.markdown(report)
         except Exception as e:
             st.error(f"❌ 發生錯誤：{e}")
 
+# --- 產業批次報告 ---
+st.markdown("---")
+st.subheader("🏢 產業批次報告")
+st.caption("依首頁上傳資料中每家公司的財務數據各產生一份報告。批次在背景執行，完成的報告會存到磁碟；"
+           "離開頁面或重新整理都不影響，伺服器重啟後也可以繼續未完成的公司。")
+manager = batch_reports.get_manager()
+
+processed_df = st.session_state.get("processed_df")
+if processed_df is None or not {"Name", "Industry"}.issubset(processed_df.columns):
+    st.info("請先在首頁上傳包含 Name 與 Industry 欄位的資料，才能建立新的批次。")
+else:
+    industries = sorted(processed_df["Industry"].dropna().unique().tolist(), key=str)
+    selected_industry = st.selectbox("選擇產業", industries, key="batch_industry")
+    industry_names = processed_df.loc[processed_df["Industry"] == selected_industry, "Name"].dropna().unique().tolist()
+    selected_names = st.multiselect("選擇公司（預設為該產業全部公司）", industry_names, default=industry_names, key="batch_names")
+    concurrency = st.slider("同時產生的報告數上限", min_value=1, max_value=8,
+                            value=batch_reports.DEFAULT_CONCURRENCY, key="batch_concurrency")
+    if st.button("📝 開始批次產生報告", disabled=not selected_names):
+        batch_id = batch_reports.create_batch(processed_df, selected_industry, selected_names)
+        manager.start(batch_id, api_key, concurrency=concurrency)
+        st.success(f"已建立批次 {batch_id}，共 {len(selected_names)} 家公司。")
+
+# 函數：顯示所有批次的進度；有批次在執行時每 2 秒自動更新
+# run_every 只在整頁 rerun 時決定：批次開始或全部結束時整頁重新執行，開始或停止自動更新
+def show_batches():
+    if manager.any_running() != st.session_state.get("batch_polling"):
+        st.rerun()
+    batches = batch_reports.list_batches()
+    if not batches:
+        st.caption("目前沒有任何批次。")
+        return
+    for batch in batches:
+        running = manager.is_running(batch["id"])
+        finished = batch["done"] == batch["total"]
+        state = "執行中" if running else ("已完成" if finished else "已暫停，可繼續")
+        with st.expander(f"{batch['industry']}｜{batch['id']}｜{batch['done']}/{batch['total']}｜{state}", expanded=running):
+            st.progress(batch["done"] / batch["total"] if batch["total"] else 1.0,
+                        text=f"完成 {batch['done']} / {batch['total']}，失敗 {batch['failed']}")
+            if running:
+                if st.button("⏸️ 暫停", key=f"stop_{batch['id']}"):
+                    manager.stop(batch["id"])
+            elif not finished:
+                if st.button("▶️ 繼續未完成的公司", key=f"resume_{batch['id']}"):
+                    manager.start(batch["id"], api_key, concurrency=st.session_state.get("batch_concurrency", batch_reports.DEFAULT_CONCURRENCY))
+                    st.rerun()
+            options = [i for i, status in sorted(batch["status"].items())]
+            if options:
+                index = st.selectbox("檢視報告", options, format_func=lambda i: batch["names"][i], key=f"view_{batch['id']}")
+                report = batch_reports.read_report(batch["id"], index)
+                if report is not None:
+                    st.markdown(report)
+                else:
+                    st.error(f"❌ 產生失敗：{batch_reports.read_error(batch['id'], index)}")
+            if batch["done"]:
+                # 按下時才讀取並合併報告，自動更新時不必每次讀取所有報告
+                st.download_button("⬇️ 下載已完成的報告 (Markdown)", functools.partial(batch_reports.combined_report, batch["id"]),
+                                   file_name=f"reports_{batch['id']}.md", mime="text/markdown", key=f"download_{batch['id']}")
 
+st.session_state.batch_polling = manager.any_running()
+st.fragment(run_every=2 if st.session_state.batch_polling else None)(show_batches)()
 
+# --- 效能除錯面板 ---
+recorder.end_run()
+if recorder.enabled:
+    perf.render_panel(st.sidebar, recorder)
@@ -0,0 +1,236 @@
+# perf.py
+# 熱路徑效能量測：具名計時區段 (span)、記憶體變化與快取命中率
+# 關閉時 span() 只回傳共用的 nullcontext，幾乎沒有額外成本
+import contextlib
+import json
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+from collections import deque
+
+import lazy_imports
+
+_NULL_SPAN = contextlib.nullcontext()
+# tracemalloc 是整個程序共用的，會拖慢所有工作階段的記憶體配置：只在開啟面板的工作階段「執行 rerun 期間」追蹤，
+# 記錄正在量測的 rerun 數，全部結束後停止追蹤
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+
+
+def _acquire_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _release_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs = max(0, _tracing_runs - 1)
+        if _tracing_runs == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "record")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        self.record = self.recorder.start_span(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.end_span(self.record, error=exc_type.__name__ if exc_type else None)
+        return False
+
+
+class PerfRecorder:
+    def __init__(self, max_runs=50):
+        self.enabled = False
+        self.runs = deque(maxlen=max_runs)  # 已完成的 rerun 記錄
+        self._current = None
+        self._stack = []
+        self._cache_sources = {}  # {快取名稱: 回傳 {"hits", "misses"} 的函數}
+        self._metric_sources = {}  # {名稱: 回傳 {指標: 數值} 的函數}，例如排隊深度
+        self._tracing = None  # 本記錄器持有追蹤時為 weakref.finalize；工作階段結束、記錄器被回收時也會釋放
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            self._stop_tracing()
+
+    def _start_tracing(self):
+        if self._tracing is None or not self._tracing.alive:
+            _acquire_tracing()
+            self._tracing = weakref.finalize(self, _release_tracing)
+
+    def _stop_tracing(self):
+        if self._tracing is not None:
+            self._tracing()  # 只會釋放一次
+
+    def register_cache(self, name, stats_fn):
+        self._cache_sources[name] = stats_fn
+
+    def register_metrics(self, name, metrics_fn):
+        self._metric_sources[name] = metrics_fn
+
+    def metrics_summary(self):
+        return {name: metrics_fn() for name, metrics_fn in self._metric_sources.items()}
+
+    def _cache_counts(self):
+        counts = {}
+        for name, stats_fn in self._cache_sources.items():
+            stats = stats_fn()
+            counts[name] = (stats["hits"], stats["misses"])
+        return counts
+
+    def begin_run(self, page):
+        # 上一次 rerun 若被 st.stop() 或新的 rerun 中斷，直接捨棄
+        self._current = None
+        self._stack = []
+        if not self.enabled:
+            self._stop_tracing()
+            return
+        self._start_tracing()
+        self._current = {"run_id": uuid.uuid4().hex[:12], "page": page, "started_at": time.time(), "spans": []}
+        self._run_start = time.perf_counter()
+        self._run_thread = threading.get_ident()
+
+    def end_run(self):
+        if self._current is None:
+            return
+        # 本次 rerun 中第一次用到而觸發的延遲匯入，以 import:模組名稱 記錄
+        for name, entry in lazy_imports.imports_since(self._run_start, thread=self._run_thread):
+            self._current["spans"].append({
+                "span": f"import:{name}", "parent": None,
+                "start_ms": (entry["loaded_at"] - self._run_start) * 1000,
+                "duration_ms": entry["duration_ms"], "mem_delta_kb": None, "cache": {},
+            })
+        # 因例外而沒有結束的區段，在 rerun 結束時補上
+        for record in reversed(list(self._stack)):
+            self.end_span(record, error="unfinished")
+        self._current["duration_ms"] = (time.perf_counter() - self._run_start) * 1000
+        self.runs.append(self._current)
+        self._current = None
+        self._stack = []
+        self._stop_tracing()
+
+    def span(self, name):
+        if self._current is None:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def start_span(self, name):
+        # 供無法以 with 包住的長區塊使用；關閉時回傳 None
+        if self._current is None:
+            return None
+        record = {
+            "span": name,
+            "parent": self._stack[-1]["span"] if self._stack else None,
+            "start_ms": (time.perf_counter() - self._run_start) * 1000,
+            "_t0": time.perf_counter(),
+            "_mem0": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            "_cache0": self._cache_counts(),
+        }
+        self._stack.append(record)
+        return record
+
+    def end_span(self, record, error=None):
+        if record is None or self._current is None:
+            return
+        record["duration_ms"] = (time.perf_counter() - record.pop("_t0")) * 1000
+        mem0 = record.pop("_mem0")
+        record["mem_delta_kb"] = (tracemalloc.get_traced_memory()[0] - mem0) / 1024 if mem0 is not None and tracemalloc.is_tracing() else None
+        # 快取計數是全程序累計的，同時執行的其他工作階段造成的命中與未命中也會計入
+        cache0 = record.pop("_cache0")
+        cache = {}
+        for name, (hits, misses) in self._cache_counts().items():
+            dh, dm = hits - cache0.get(name, (0, 0))[0], misses - cache0.get(name, (0, 0))[1]
+            if dh or dm:
+                cache[name] = {"hits": dh, "misses": dm}
+        record["cache"] = cache
+        if error:
+            record["error"] = error
+        if record in self._stack:
+            self._stack.remove(record)
+        self._current["spans"].append(record)
+
+    def add_span(self, name, duration_ms, **attrs):
+        # 記錄在其他地方量好的時間（例如延遲 import 的耗時）
+        if self._current is None:
+            return
+        self._current["spans"].append({
+            "span": name, "parent": self._stack[-1]["span"] if self._stack else None,
+            "start_ms": (time.perf_counter() - self._run_start) * 1000,
+            "duration_ms": duration_ms, "mem_delta_kb": None, "cache": {}, **attrs,
+        })
+
+    def cache_summary(self):
+        summary = {}
+        for name, stats_fn in self._cache_sources.items():
+            stats = stats_fn()
+            total = stats["hits"] + stats["misses"]
+            summary[name] = {"hits": stats["hits"], "misses": stats["misses"], "hit_rate": stats["hits"] / total if total else 0.0}
+        return summary
+
+    def export_jsonl(self):
+        # 每個 span 一行 JSON，附上所屬 rerun 的資訊，方便離線分析
+        lines = []
+        for run in self.runs:
+            for span in run["spans"]:
+                lines.append(json.dumps({
+                    "run_id": run["run_id"], "page": run["page"], "started_at": run["started_at"],
+                    "run_duration_ms": run["duration_ms"], **span,
+                }, ensure_ascii=False))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+def get_recorder(session_state):
+    # 每個工作階段一個記錄器，存放在 st.session_state，各頁面共用
+    if "_perf_recorder" not in session_state:
+        session_state["_perf_recorder"] = PerfRecorder()
+    return session_state["_perf_recorder"]
+
+
+def render_panel(container, recorder):
+    # 在側邊欄顯示最近一次 rerun 的各區段耗時與快取命中率
+    container.markdown("### 🛠️ 效能除錯")
+    if not recorder.runs:
+        container.caption("尚無量測資料，請再操作一次頁面。")
+        return
+    last = recorder.runs[-1]
+    container.caption(f"{last['page']} 最近一次執行：{last['duration_ms']:.1f} ms")
+    container.dataframe([
+        {
+            "區段": span["span"],
+            "耗時 (ms)": round(span["duration_ms"], 2),
+            "記憶體變化 (KB)": round(span["mem_delta_kb"], 1) if span["mem_delta_kb"] is not None else None,
+            "快取（全程序）": ", ".join(f"{name} {c['hits']}/{c['hits'] + c['misses']}" for name, c in span["cache"].items()),
+        }
+        for span in last["spans"]
+    ], hide_index=True)
+    summary = recorder.cache_summary()
+    if summary:
+        container.markdown("**快取命中率（全程序累計）**")
+        for name, stats in summary.items():
+            container.caption(f"{name}: {stats['hits']} 命中 / {stats['misses']} 未命中 ({stats['hit_rate']:.0%})")
+    for name, metrics in recorder.metrics_summary().items():
+        container.markdown(f"**{name}**")
+        container.caption("、".join(f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+                                   for key, value in metrics.items()))
+    imports = lazy_imports.import_log()
+    if imports:
+        container.markdown("**延遲匯入（全程序，各只匯入一次）**")
+        for name, entry in imports:
+            note = "（已由其他模組載入）" if entry["preloaded"] else ""
+            container.caption(f"{name}: {entry['duration_ms']:.1f} ms{note}")
+    container.download_button("⬇️ 匯出量測資料 (JSON Lines)", recorder.export_jsonl(),
+                              file_name="perf_spans.jsonl", mime="application/jsonl")
@@ -0,0 +1,318 @@
+# pipeline.py
+# 財務資料處理流程（不依賴 Streamlit）：數值轉換、公司名稱欄位辨識、衍生指標與可用圖表判斷
+# app.py、批次分析命令列工具 (analytics.py) 與效能基準測試 (benchmarks/) 共用這些函數
+import numpy as np
+import pandas as pd
+
+import compaction
+
+
+# 函數：將 DataFrame 欄位穩健地轉換為數值型
+def coerce_numeric(df_input):
+    df_output = df_input.copy() # 在副本上操作
+    for col in df_output.columns:
+        series = df_output[col]
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            # 原生數值欄位（Parquet / Feather，或 CSV 解析時已判斷為數值）不必再由文字轉換，只需處理無限值
+            if series.dtype.kind == "f":
+                df_output[col] = series.replace([np.inf, -np.inf], np.nan)
+            continue
+        try:
+            # 嘗試將欄位轉換為數值類型，無法轉換的設為 NaN
+            temp_series = pd.to_numeric(df_output[col], errors='coerce')
+            original_non_null_count = df_output[col].count()
+            converted_non_null_count = temp_series.count()
+            
+            # 啟發式判斷：如果大部分（例如 > 70%）數據能轉換為數值，則假定它是數值欄位
+            # 並確保它原本不是純粹的物件/布林欄位，除非它確實包含數字
+            if original_non_null_count > 0 and converted_non_null_count / original_non_null_count > 0.7:
+                # 檢查轉換後是否有足夠的非空數值
+                if temp_series.dropna().shape[0] > 0: # 確保有實際的數值數據
+                    # 將無限值替換為 NaN，以避免繪圖或計算錯誤
+                    df_output[col] = temp_series.replace([np.inf, -np.inf], np.nan)
+            elif original_non_null_count == 0 and pd.api.types.is_numeric_dtype(df_output[col]):
+                # 如果欄位是空的數值類型，也保持為數值，只是所有值為 NaN
+                df_output[col] = temp_series.replace([np.inf, -np.inf], np.nan)
+        except Exception:
+            # 如果轉換失敗，則跳過此欄位，保持其原始類型
+            pass
+    return df_output
+
+
+# 函數：確保 'Name' 欄位存在且為字串；回傳 (df, 提示訊息)，提示訊息為 (層級, 文字) 或 None
+def ensure_name_column(df):
+    notice = None
+    # 嘗試尋找 'Name' 或 'name' 欄位作為公司名稱
+    if 'Name' not in df.columns and 'name' in df.columns:
+        df = df.rename(columns={'name': 'Name'})
+    
+    # 如果依然沒有 'Name' 欄位，嘗試尋找其他可能的公司名稱欄位，或設定一個預設
+    if 'Name' not in df.columns:
+        # 尋找包含 '公司', '企業', '名稱' 等關鍵字的欄位
+        potential_name_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in ['公司', '企業', '名稱', 'entity', 'company'])]
+        if potential_name_cols:
+            df = df.rename(columns={potential_name_cols[0]: 'Name'})
+            notice = ("info", f"已將 '{potential_name_cols[0]}' 欄位識別為公司名稱 'Name'。")
+        else:
+            # 如果沒有找到，就創建一個索引作為名稱
+            df['Name'] = [f"公司_{i+1}" for i in range(len(df))]
+            notice = ("warning", "檔案中缺少 'Name' (或 'name') 欄位，已自動創建 '公司_X' 作為公司名稱。")
+    
+    # 確保 'Name' 欄位是字符串類型
+    df['Name'] = df['Name'].astype(str).str.strip()
+    return df, notice
+
+
+# 衍生指標及其來源欄位：依資料集實際擁有的欄位決定計算方式
+# 回傳 {衍生欄位: 來源欄位}；來源欄位為空代表無法計算（整欄為 NaN）
+def derived_sources(columns):
+    columns = set(columns)
+    sources = {}
+    sources["負債比率 (%)"] = ("Debt", "Balance sheet total") if {"Balance sheet total", "Debt"} <= columns else ()
+    if {"Equity capital", "Reserves", "Preference capital"} <= columns:
+        sources["總股東權益"] = ("Equity capital", "Reserves", "Preference capital")
+    elif {"Balance sheet total", "Debt"} <= columns:
+        # 如果沒有詳細股權資訊，則用資產總計減負債估算
+        sources["總股東權益"] = ("Balance sheet total", "Debt")
+    else:
+        sources["總股東權益"] = ()
+    sources["流動比率"] = ("Current assets", "Current liabilities") if {"Current assets", "Current liabilities"} <= columns else ()
+    return sources
+
+
+# 函數：計算單一衍生欄位，回傳與 df 索引相同的 Series（df 可以只是部分資料列，用於資料編輯後的增量重算）
+def compute_derived(df, name, sources=None):
+    if sources is None:
+        sources = derived_sources(df.columns)
+    cols = sources[name]
+    if not cols or df.empty:
+        return pd.Series(np.nan, index=df.index, dtype=float)
+    if name == "負債比率 (%)":
+        # 避免除以零
+        values = df.apply(lambda row: (row["Debt"] / row["Balance sheet total"]) * 100 if row["Balance sheet total"] != 0 else np.nan, axis=1)
+        return values.replace([np.inf, -np.inf], np.nan)
+    if name == "總股東權益":
+        if cols == ("Equity capital", "Reserves", "Preference capital"):
+            return df["Equity capital"] + df["Reserves"] + df["Preference capital"]
+        return df["Balance sheet total"] - df["Debt"]
+    if name == "流動比率":
+        values = df.apply(lambda row: row["Current assets"] / row["Current liabilities"] if row["Current liabilities"] != 0 else np.nan, axis=1)
+        return values.replace([np.inf, -np.inf], np.nan)
+    raise KeyError(name)
+
+
+# 函數：預先計算可能用到的欄位 (確保原始欄位存在才計算，否則為 NaN)
+def add_derived_metrics(df):
+    sources = derived_sources(df.columns)
+    for name in sources:
+        df[name] = compute_derived(df, name, sources)
+    return df
+
+
+# 函數：完整處理流程（欄位名稱清理 → 數值轉換 → 名稱欄位 → 衍生指標），與儀表板的步驟相同
+# 回傳 (df, 提示訊息)
+def process_frame(df):
+    df = df.copy()
+    df.columns = df.columns.str.strip() # 清理欄位名稱的空白字符
+    df = coerce_numeric(df)
+    df, notice = ensure_name_column(df)
+    df = add_derived_metrics(df)
+    return df, notice
+
+
+# 「財務比率表格」顯示的欄位
+RATIO_TABLE_COLUMNS = ["Name", "負債比率 (%)", "流動比率", "總股東權益", "Balance sheet total"]
+
+
+# 函數：財務比率表格（只保留存在的欄位，四捨五入到小數點後兩位）；沒有任何欄位時回傳 None
+def ratio_table(df):
+    available_cols = [col for col in RATIO_TABLE_COLUMNS if col in df.columns]
+    if not available_cols:
+        return None
+    return compaction.widen(df, available_cols).round(2)
+
+
+# 排名長條圖與產業市值圖的參數 {排名名稱: (指標欄位, 前 N 名)}
+TOP_N_RANKINGS = {
+    "top_sales_growth": ("Sales growth 3Years", 20),
+    "top_profit_growth": ("Profit growth 3Years", 20),
+    "top_roe_avg": ("Average return on equity 5Years", 20),
+}
+INDUSTRY_MARKET_TOP_N = 8
+
+
+# ----------------------------------------------------
+# 定義圖表需求 (基於欄位存在性，以字典儲存，方便動態檢查)
+# 移除了原先硬性定義的檔案名，現在完全基於當前上傳的df來判斷
+# 新增了更通用的圖表類型，增加彈性
+# ----------------------------------------------------
+CHART_REQUIREMENTS = {
+    "資料概覽表格": {
+        "required": set(), # 無需特定欄位，顯示前幾行
+        "description": "顯示所有數據，並可滑動查看，同時包含數據類型和描述性統計。", # 更新描述
+        "type": "table_overview"
+    },
+    "數值欄位分佈直方圖": {
+        "required": set(), # 需要至少一個數值欄位，但不指定名稱
+        "description": "選擇一個數值型欄位，顯示其數據分佈的直方圖。",
+        "type": "dynamic_numeric_hist"
+    },
+    "類別欄位計數長條圖": {
+        "required": set(), # 需要至少一個類別欄位，但不指定名稱
+        "description": "選擇一個類別型欄位，顯示各類別項目數量最多的前20名長條圖。",
+        "type": "dynamic_categorical_bar"
+    },
+    "任意兩數值欄位散佈圖": { # 新增的通用散佈圖
+        "required": set(), # 需要至少兩個數值欄位
+        "description": "選擇任意兩個數值型欄位，分析它們之間的關係。",
+        "type": "dynamic_scatter"
+    },
+    "相關係數矩陣": {
+        "required": set(), # 需要至少兩個數值欄位
+        "description": "一次計算所有數值欄位兩兩之間的 Pearson / Spearman 相關係數，以熱度圖與最強相關排名呈現，可直接開啟該組合的散佈圖。",
+        "type": "correlation"
+    },
+    "異常公司": {
+        "required": set(), # 需要至少一個數值欄位
+        "description": "依產業找出數值明顯偏離同業（穩健 Z 分數或 IQR）或股東權益為負的公司，可篩選並下載明細。",
+        "type": "anomalies"
+    },
+    "產業市值長條圖（前 8 名）": {
+        "required": {"Industry", "Market Capitalization"},
+        "description": "展示各產業的總市值分佈。",
+        "type": "bar"
+    },
+    "資產結構圓餅圖（單一公司）": {
+        "required": {"Name", "Net block", "Current assets", "Investments"},
+        "description": "顯示單一公司的淨固定資產、流動資產和投資在總資產中的佔比。",
+        "type": "pie"
+    },
+    "負債 vs 營運資金（散佈圖）": {
+        "required": {"Debt", "Working capital", "Name"},
+        "description": "分析負債與營運資金之間的關係，並識別特定公司。",
+        "type": "scatter"
+    },
+    "財務比率表格": {
+        "required": {"Name", "負債比率 (%)", "流動比率", "總股東權益", "Balance sheet total"},
+        "description": "顯示計算後的關鍵財務比率和基本資產負債數據。",
+        "type": "table"
+    },
+    "各年度營收趨勢圖（單一公司）": {
+        "required": {"Name", "Sales", "Sales last year", "Sales preceding year"},
+        "description": "追蹤單一公司在過去三個會計年度的營收變化。",
+        "type": "line"
+    },
+    "各年度淨利潤趨勢圖（單一公司）": {
+        "required": {"Name", "Profit after tax", "Profit after tax last year", "Profit after tax preceding year"},
+        "description": "追蹤單一公司在過去三個會計年度的淨利潤變化。",
+        "type": "line"
+    },
+    "各年度EPS趨勢圖（單一公司）": {
+        "required": {"Name", "EPS", "EPS last year", "EPS preceding year"},
+        "description": "追蹤單一公司在過去三個會計年度的每股盈餘 (EPS) 變化。",
+        "type": "line"
+    },
+    "ROE與ROCE比較圖（單一公司，最新年度）": {
+        "required": {"Name", "Return on equity", "Return on capital employed"},
+        "description": "比較單一公司最新年度的股東權益報酬率 (ROE) 和資本運用報酬率 (ROCE)。",
+        "type": "bar"
+    },
+    "本益比與股東權益報酬率散佈圖": {
+        "required": {"Price to Earning", "Return on equity", "Name"},
+        "description": "分析所有公司在本益比和股東權益報酬率之間的關係，有助於投資者評估。",
+        "type": "scatter"
+    },
+    "銷售額成長率排名（前20）": {
+        "required": {"Name", "Sales growth 3Years"},
+        "description": "列出過去三年銷售額成長最快的前 20 家公司。",
+        "type": "bar"
+    },
+    "利潤成長率排名（前20）": {
+        "required": {"Name", "Profit growth 3Years"},
+        "description": "列出過去三年利潤成長最快的前 20 家公司。",
+        "type": "bar"
+    },
+    "現金流量概覽圓餅圖（單一公司，最近一年）": {
+        "required": {"Name", "Cash from operations last year", "Cash from investing last year", "Cash from financing last year"},
+        "description": "展示單一公司最近一個會計年度的營運、投資和融資現金流分佈。",
+        "type": "pie"
+    },
+    "自由現金流趨勢圖（單一公司）": {
+        "required": {"Name", "Free cash flow last year", "Free cash flow preceding year", "Free cash flow 3years", "Free cash flow 5years", "Free cash flow 7years", "Free cash flow 10years"},
+        "description": "追蹤單一公司過去多年的自由現金流趨勢。",
+        "type": "line"
+    },
+    "股價相對表現趨勢圖（單一公司）": {
+        "required": {"Name", "Current Price", "t_1_price", "Return over 1year", "Return over 3years", "Return over 5years"},
+        "description": "展示單一公司在不同時間段的股價回報率。",
+        "type": "bar" 
+    },
+    "市值分佈直方圖": {
+        "required": {"Market Capitalization"},
+        "description": "顯示市場資本化的分佈情況。",
+        "type": "histogram"
+    },
+    "銷售額與淨利潤關係散佈圖": {
+        "required": {"Sales", "Net profit", "Name"},
+        "description": "分析公司銷售額與淨利潤之間的關係。",
+        "type": "scatter"
+    },
+    "平均股東權益報酬率排名（前20）": {
+        "required": {"Name", "Average return on equity 5Years"},
+        "description": "列出過去五年平均股東權益報酬率最高的前 20 家公司。",
+        "type": "bar"
+    },
+    "發起人持股比例分佈（圓餅圖）": {
+        "required": {"Promoter holding", "FII holding", "DII holding", "Public holding"},
+        "description": "顯示所有公司平均或單一公司發起人、外資、本土機構和公眾持股比例。",
+        "type": "pie"
+    }
+}
+
+
+# 通用圖表選項，在側邊欄中排在最前面
+GENERIC_CHARTS = ["資料概覽表格", "數值欄位分佈直方圖", "類別欄位計數長條圖", "任意兩數值欄位散佈圖", "相關係數矩陣", "異常公司"]
+
+
+# 函數：動態判斷可用的圖表，回傳依顯示順序排列的圖表名稱
+def find_available_charts(df):
+    available_charts = []
+    numeric_cols_df = df.select_dtypes(include=['number']).columns.tolist()
+    categorical_cols_df = df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
+
+    for chart_name, details in CHART_REQUIREMENTS.items():
+        required_cols = details["required"]
+        
+        # 對於動態分佈圖，只需要有數值或類別欄位即可
+        if details["type"] == "table_overview":
+            available_charts.append(chart_name) # 資料概覽始終可用
+        elif details["type"] == "dynamic_numeric_hist" and numeric_cols_df:
+            available_charts.append(chart_name)
+        elif details["type"] == "dynamic_categorical_bar" and categorical_cols_df:
+            available_charts.append(chart_name)
+        elif details["type"] in ("dynamic_scatter", "correlation") and len(numeric_cols_df) >= 2:
+            available_charts.append(chart_name)
+        elif details["type"] == "anomalies" and numeric_cols_df:
+            available_charts.append(chart_name)
+        elif required_cols.issubset(df.columns): # 對於其他特定欄位圖表
+            # 額外檢查關鍵欄位是否至少有非NaN值，避免繪製空圖
+            if all(df[col].dropna().empty for col in required_cols if col in df.columns):
+                continue # 如果所有關鍵欄位都為空，則跳過此圖表
+            available_charts.append(chart_name)
+
+    # 將通用圖表選項排在最前面
+    return [c for c in GENERIC_CHARTS if c in available_charts] + \
+           sorted([c for c in available_charts if c not in GENERIC_CHARTS])
+
+
+# 圖表除了必要欄位之外可能用到的欄位（懸停提示、顏色、點的大小）
+CHART_CONTEXT_COLUMNS = {"Name", "Industry", "Market Capitalization"}
+# 可用圖表判斷讀取的欄位（資料編輯不改變欄位型別，只有這些欄位的內容會影響判斷結果）
+AVAILABILITY_COLUMNS = set().union(*(details["required"] for details in CHART_REQUIREMENTS.values()))
+
+
+# 函數：圖表讀取的欄位（必要欄位、可能用到的欄位，以及參數中指定的欄位）；讀取所有欄位的圖表回傳 None
+def chart_columns(chart, params=()):
+    if CHART_REQUIREMENTS[chart]["type"] in ("table_overview", "anomalies", "correlation"):
+        return None
+    return set(CHART_REQUIREMENTS[chart]["required"]) | CHART_CONTEXT_COLUMNS | {p for p in params if isinstance(p, str)}
@@ -0,0 +1,160 @@
+# prefetch.py
+# 背景預先計算：上傳檔案後，在使用者瀏覽預覽時先準備可能會點選的圖表資料與圖表
+# - 依序執行工作（通用圖表，以及估計成本最低的幾個特定圖表），一次只執行一個，最多佔用一個核心
+# - 累計耗時超過 CPU 預算、或預先計算的結果超過記憶體預算時停止，不影響使用者的互動
+# - 結果寫入背景程序池與圖表快取，使用者點選圖表時直接命中快取
+# - 上傳新檔案時由呼叫端 stop()：尚未開始的工作不再執行，排隊中的背景計算請求一併取消
+# - 工作階段持有 PrefetchHandle 而不是執行緒本身：工作階段結束、handle 被回收時同樣會停止
+import os
+import threading
+import time
+import weakref
+
+import lazy_imports
+
+pd = lazy_imports.lazy("pandas")
+np = lazy_imports.lazy("numpy")
+
+# 預先計算的特定圖表數（依估計成本由低到高）
+DEFAULT_SPECIFIC_CHARTS = int(os.environ.get("PREFETCH_SPECIFIC_CHARTS", "3"))
+# 每個資料集最多花費的計算時間（秒）
+DEFAULT_CPU_BUDGET_S = float(os.environ.get("PREFETCH_CPU_BUDGET_S", "10"))
+# 預先計算的結果（圖表資料與快取的圖表）最多佔用的記憶體
+DEFAULT_MEMORY_BUDGET_BYTES = int(os.environ.get("PREFETCH_MEMORY_BUDGET_MB", "32")) * 1024 * 1024
+
+# 各資料準備函數每列的估計成本（微秒，含建圖與序列化），依 benchmarks 在 100k 列的量測；
+# 只用來排序與判斷是否超出預算，不需精確
+COST_US_PER_ROW = {
+    "histogram": 0.15,
+    "category_counts": 0.2,
+    "top_n": 0.9,
+    "industry_market": 0.9,
+    "scatter": 8.0,
+    "correlation": 2.5,
+    "overview": 5.0,
+    "anomalies": 15.0,
+}
+
+
+class PrefetchCancelled(Exception):
+    pass
+
+
+def estimate_cost(task, rows):
+    # 估計的耗時（秒）
+    return rows * COST_US_PER_ROW.get(task["prep"], 10.0) / 1e6
+
+
+def result_nbytes(result):
+    # 圖表資料佔用的記憶體（只計算 DataFrame 與陣列，其他值很小）
+    total = 0
+    for value in result.values():
+        if isinstance(value, pd.DataFrame):
+            total += int(value.memory_usage(index=True, deep=True).sum())
+        elif isinstance(value, np.ndarray):
+            total += value.nbytes
+    return total
+
+
+def cheapest(tasks, rows, n):
+    # 估計成本最低的 n 個圖表的工作（同一圖表的工作一起保留）
+    costs = {}
+    for task in tasks:
+        costs[task["chart"]] = costs.get(task["chart"], 0.0) + estimate_cost(task, rows)
+    charts = set(sorted(costs, key=costs.get)[:n])
+    return [task for task in tasks if task["chart"] in charts]
+
+
+class Prefetcher(threading.Thread):
+    # tasks: [{"chart", "prep", "params", "figure_params", "build"}]，依序執行
+    # build(prepared) 回傳圖表，資料不足時回傳 None；figure_params 為 None 的工作只準備資料
+    def __init__(self, dataset_key, df, tasks, pool, figure_cache,
+                 cpu_budget_s=DEFAULT_CPU_BUDGET_S, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES):
+        super().__init__(name=f"prefetch-{dataset_key[:8]}", daemon=True)
+        self.dataset_key = dataset_key
+        self.df = df
+        self.tasks = tasks
+        self.pool = pool
+        self.figure_cache = figure_cache
+        self.cpu_budget_s = cpu_budget_s
+        self.memory_budget_bytes = memory_budget_bytes
+        self.elapsed_s = 0.0
+        self.used_bytes = 0
+        self.status = {}  # {圖表: "done" | "skipped (原因)" | "failed (例外)" | "cancelled"}
+        self._stop_event = threading.Event()
+
+    def _over_budget(self, task):
+        if self.used_bytes >= self.memory_budget_bytes:
+            return "memory"
+        if self.elapsed_s + estimate_cost(task, len(self.df)) > self.cpu_budget_s:
+            return "cpu"
+        return None
+
+    def _check_stop(self):
+        # 等待背景計算結果期間定期呼叫；已停止時中斷等待，程序池會取消尚未開始的請求
+        if self._stop_event.is_set():
+            raise PrefetchCancelled()
+
+    def _run_task(self, task):
+        prepared = self.pool.run(self.dataset_key, self.df, task["prep"], task["params"], on_wait=self._check_stop)
+        self.used_bytes += result_nbytes(prepared)
+        if task["figure_params"] is None or self.used_bytes >= self.memory_budget_bytes:
+            return
+        key = (self.dataset_key, task["chart"], task["figure_params"])
+        if key in self.figure_cache:
+            return
+        fig = task["build"](prepared)
+        if fig is not None:
+            self.used_bytes += self.figure_cache.put(key, fig)
+
+    def run(self):
+        for task in self.tasks:
+            chart = task["chart"]
+            if self._stop_event.is_set():
+                self.status.setdefault(chart, "cancelled")
+                continue
+            reason = self._over_budget(task)
+            if reason is not None:
+                self.status[chart] = f"skipped ({reason})"
+                continue
+            start = time.perf_counter()
+            try:
+                self._run_task(task)
+                self.status[chart] = "done"
+            except PrefetchCancelled:
+                self.status[chart] = "cancelled"
+            except Exception as exc:
+                self.status[chart] = f"failed ({type(exc).__name__})"
+            finally:
+                self.elapsed_s += time.perf_counter() - start
+
+    def stop(self):
+        # 不再執行新的工作，並取消排隊中的背景計算請求；已在工作程序中執行的請求完成後結果仍會寫入快取
+        self._stop_event.set()
+
+    def stats(self):
+        done = sum(1 for status in self.status.values() if status == "done")
+        return {
+            "charts": len({task["chart"] for task in self.tasks}),
+            "done": done,
+            "skipped": sum(1 for status in self.status.values() if status.startswith("skipped")),
+            "running": self.is_alive(),
+            "elapsed_s": self.elapsed_s,
+            "used_mb": self.used_bytes / 1024 / 1024,
+        }
+
+
+class PrefetchHandle:
+    # 存放在 session_state 的控制物件：執行中的執行緒由 threading 模組持有、不會被回收，
+    # 改由 handle 的 weakref.finalize 在工作階段結束（session_state 被回收）時停止背景預先計算
+    def __init__(self, prefetcher):
+        self.prefetcher = prefetcher
+        self.dataset_key = prefetcher.dataset_key
+        self._finalizer = weakref.finalize(self, prefetcher.stop)
+        prefetcher.start()
+
+    def stop(self):
+        self._finalizer()  # 只會停止一次
+
+    def stats(self):
+        return self.prefetcher.stats()
@@ -0,0 +1,228 @@
+# semantic_cache.py
+# 相似問題的回覆快取：問題正規化後以字元 n-gram 的 MinHash 表示（完全在本機計算，不需要網路）
+# - 以 LSH 分段 (banding) 建立索引，分段數依門檻調整，快取成長到數萬筆時仍只需比對少數候選
+# - 候選數有上限，所有候選的簽章以一次 NumPy 運算比對
+# - 估計的 Jaccard 相似度達到門檻、且否定詞與數字完全相同時直接回傳快取的回覆
+# - 依最久未使用 (LRU) 淘汰，每筆另有存活時間 (TTL)
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+import lazy_imports
+
+np = lazy_imports.lazy("numpy")
+
+DEFAULT_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+DEFAULT_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "20000"))
+# 每次查詢最多比對的候選數（依共同分段數由多到少）
+DEFAULT_MAX_CANDIDATES = int(os.environ.get("SEMANTIC_CACHE_MAX_CANDIDATES", "256"))
+
+# 大於 2^32 的質數，MinHash 的雜湊族 (a * h + b) % P
+_PRIME = 4294967311
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+_LATIN_WORD = re.compile(r"[a-z0-9]+")
+# 不影響問題內容的客套語與虛詞；連接詞統一成「與」
+_FILLERS = re.compile(r"請問|請|幫我|幫忙|麻煩|一下|可以|能否|如何|怎麼樣|怎樣|嗎|呢|吧|的")
+_CONJUNCTIONS = re.compile(r"以及|和|及|跟")
+# 只差在否定詞或數字的問題 n-gram 幾乎相同，意思卻相反或指向不同的數值（例如「是否穩健」與「是否不穩健」、前 10 名與前 20 名）
+# 非、無、未、別 單獨出現多半不是否定（非常、無形資產、未來、產業別），只比對否定詞；
+# 不、沒 幾乎都是否定，只排除不表示否定的詞（不動產、不斷、不過…）
+_NEGATIONS = re.compile(
+    r"不(?!動產|动产|斷|断|少|過|过|僅|仅|論|论|管|只|但)|沒|没|勿"
+    r"|[並并絕绝而]非|非屬|非属"
+    r"|無法|无法|無須|无须|無需|无需|[毫並并]無|[毫并]无|無任何|无任何"
+    r"|[尚並并從从還还]未|未曾|未能|未達|未达|未有"
+    r"|\b(?:not|no|never|without|cannot)\b|n't"
+)
+_NUMBERS = re.compile(r"\d+(?:\.\d+)?|[零〇一二兩两三四五六七八九十百千萬万億亿]+")
+
+
+def normalize(text):
+    # 全形轉半形、轉小寫，去掉標點、空白與客套語，讓措辭略有不同的問題得到相同的 n-gram
+    text = _NON_WORD.sub(" ", unicodedata.normalize("NFKC", text).lower())
+    return _CONJUNCTIONS.sub("與", _FILLERS.sub("", text)).strip()
+
+
+def guard_tokens(text):
+    # 問題中的否定詞與數字（依出現順序以外的方式比較）；兩個問題的這些字必須完全相同才會命中
+    text = _FILLERS.sub("", unicodedata.normalize("NFKC", text).lower())
+    return tuple(sorted(_NEGATIONS.findall(text) + _NUMBERS.findall(text)))
+
+
+def shingles(text, n=2):
+    # 中文沒有空白斷詞，以去掉空白後的字元 n-gram 為主，另外加入完整的英數單字（例如股票代號、指標縮寫）
+    normalized = normalize(text)
+    compact = normalized.replace(" ", "")
+    grams = {compact[i:i + n] for i in range(max(len(compact) - n + 1, 1))} if compact else set()
+    grams.update(f"w:{word}" for word in _LATIN_WORD.findall(normalized))
+    return grams
+
+
+class SemanticCache:
+    # bands × rows：相似度 s 的條目成為候選的機率為 1 - (1 - s^rows)^bands，
+    # 16 × 8 的轉折點約在 (1/16)^(1/8) ≈ 0.71，門檻 0.8 的條目約 95% 會成為候選，相似度 0.5 以下的幾乎不會
+    def __init__(self, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 num_perm=128, bands=16, seed=1, max_candidates=DEFAULT_MAX_CANDIDATES):
+        assert num_perm % bands == 0
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seed = seed
+        self.max_candidates = max_candidates
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lookup_ms = 0.0
+        self._candidates = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {條目 ID: {"scope", "question", "answer", "guards", "slot", "expires_at"}}
+        self._buckets = {}  # {(範圍, 段落編號, 段落雜湊): {條目 ID: None}}，依寫入順序，最新的在最後
+        self._signatures = None  # (容量, num_perm) 的簽章矩陣，每個條目佔一列 (slot)
+        self._free_slots = []
+        self._ids = 0
+        self._perm = None  # MinHash 的 (a, b) 參數，第一次使用時才建立（延遲匯入 numpy）
+
+    # ---------- MinHash 與 LSH ----------
+
+    def signature(self, text):
+        if self._perm is None:
+            rng = np.random.default_rng(self.seed)
+            # a、b 與雜湊值都小於 2^32，a * h + b 不會超出 uint64
+            self._perm = (rng.integers(1, 2 ** 32, self.num_perm, dtype=np.uint64),
+                          rng.integers(0, 2 ** 32, self.num_perm, dtype=np.uint64))
+        a, b = self._perm
+        grams = shingles(text)
+        if not grams:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+            dtype=np.uint64, count=len(grams))
+        return ((a[:, None] * hashes[None, :] + b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, scope, signature):
+        return [(scope, i, signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def _allocate_slot(self):
+        if self._free_slots:
+            return self._free_slots.pop()
+        used = len(self._entries)
+        if self._signatures is None or used >= len(self._signatures):
+            # 容量不足時加倍，已寫入的簽章一起複製
+            grown = np.empty((max(64, used * 2), self.num_perm), dtype=np.uint64)
+            if self._signatures is not None:
+                grown[:used] = self._signatures[:used]
+            self._signatures = grown
+        return used
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for band_key in self._band_keys(entry["scope"], self._signatures[entry["slot"]]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.pop(entry_id, None)
+                if not bucket:
+                    del self._buckets[band_key]
+        self._free_slots.append(entry["slot"])
+
+    def _candidates_for(self, scope, signature):
+        # 依共同分段數排序的候選；每個分段只取最新的 max_candidates 筆，非常相似的條目很多時也不必走訪整個分段
+        counts = Counter()
+        for band_key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                counts.update(itertools.islice(reversed(bucket), self.max_candidates))
+        return [entry_id for entry_id, _ in counts.most_common(self.max_candidates)]
+
+    # ---------- 查詢與寫入 ----------
+
+    def lookup(self, scope, question):
+        # 回傳 (回覆, 相似度, 原本的問題)；沒有夠相似的條目時回傳 None
+        start = time.perf_counter()
+        signature = self.signature(question)
+        guards = guard_tokens(question)
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for entry_id in self._candidates_for(scope, signature):
+                entry = self._entries[entry_id]
+                if entry["expires_at"] <= now:
+                    self._remove(entry_id)
+                    self.expirations += 1
+                elif entry["guards"] == guards:
+                    candidates.append(entry_id)
+            best_id, best_score = None, 0.0
+            if candidates:
+                slots = [self._entries[entry_id]["slot"] for entry_id in candidates]
+                scores = (self._signatures[slots] == signature).mean(axis=1)
+                best = int(scores.argmax())
+                best_id, best_score = candidates[best], float(scores[best])
+            self._candidates += len(candidates)
+            self._lookup_ms += (time.perf_counter() - start) * 1000
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            return entry["answer"], best_score, entry["question"]
+
+    def put(self, scope, question, answer, ttl=None):
+        signature = self.signature(question)
+        with self._lock:
+            self._ids += 1
+            entry_id = self._ids
+            slot = self._allocate_slot()
+            self._signatures[slot] = signature
+            self._entries[entry_id] = {
+                "scope": scope, "question": question, "answer": answer, "guards": guard_tokens(question),
+                "slot": slot, "expires_at": time.time() + (self.ttl if ttl is None else ttl),
+            }
+            for band_key in self._band_keys(scope, signature):
+                self._buckets.setdefault(band_key, {})[entry_id] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry_id
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "avg_lookup_ms": self._lookup_ms / total if total else 0.0,
+                "avg_candidates": self._candidates / total if total else 0.0,
+            }
+
+
+def chat_scope(model, history):
+    # 聊天的回覆取決於先前的對話，只有上下文完全相同時才共用快取
+    digest = hashlib.blake2b(repr([(m["role"], m["content"]) for m in history]).encode("utf-8"), digest_size=8).hexdigest()
+    return f"chat:{model}:{digest}"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # 各頁面與工作階段共用同一個快取
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+        return _cache
@@ -0,0 +1,25 @@
+# 測試直接匯入專案根目錄的模組（與 python -m benchmarks.run / python -m analytics 相同的匯入方式）
+import collections
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_glm(monkeypatch):
+    # 以假的 google.ai.generativelanguage 取代真正的 Gemini 客戶端，測試結束後還原 sys.modules
+    import llm_scheduler
+    from benchmarks import stubs
+
+    saved = {name: sys.modules.get(name) for name in ("google", "google.ai", "google.ai.generativelanguage")}
+    monkeypatch.setattr(llm_scheduler, "_clients", collections.OrderedDict())
+    monkeypatch.delenv("GEMINI_API_ENDPOINT", raising=False)
+    yield stubs.install_fake_genai()
+    for name, module in saved.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
@@ -0,0 +1,33 @@
+import pandas as pd
+
+import analytics
+import ingest
+import pipeline
+from benchmarks.synthetic import generate_dataset
+
+
+def run_cli(tmp_path, *args):
+    return analytics.main([str(tmp_path / "in"), str(tmp_path / "out"), "--workers", "1", *args])
+
+
+def test_files_with_same_stem_get_separate_outputs(tmp_path):
+    (tmp_path / "in").mkdir()
+    df = generate_dataset(120, seed=3)
+    df.to_csv(tmp_path / "in" / "a.csv", index=False)
+    df.head(40).to_parquet(tmp_path / "in" / "a.parquet", index=False)
+    assert run_cli(tmp_path) == 0
+    assert len(pd.read_parquet(tmp_path / "out" / "a.csv" / "processed.parquet")) == 120
+    assert len(pd.read_parquet(tmp_path / "out" / "a.parquet" / "processed.parquet")) == 40
+
+
+def test_cli_tables_match_pipeline(tmp_path):
+    (tmp_path / "in").mkdir()
+    path = tmp_path / "in" / "data.csv"
+    generate_dataset(300, seed=4).to_csv(path, index=False)
+    assert run_cli(tmp_path) == 0
+
+    expected, _ = pipeline.process_frame(ingest.read_path(path))
+    out = tmp_path / "out" / "data.csv"
+    pd.testing.assert_frame_equal(pd.read_parquet(out / "processed.parquet"), expected.reset_index(drop=True))
+    pd.testing.assert_frame_equal(pd.read_parquet(out / "ratios.parquet"),
+                                  pipeline.ratio_table(expected).reset_index(drop=True))
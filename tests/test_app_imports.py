@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在新的程序中匯入 app（沒有上傳檔案的首次載入），列出 app 本身額外載入的模組；
+# streamlit 自己會載入部分 plotly，因此與只匯入 streamlit 時比較
+SCRIPT = """
+import json, sys
+import streamlit
+before = set(sys.modules)
+import app
+print(json.dumps({"all": sorted(sys.modules), "new": sorted(set(sys.modules) - before)}))
+"""
+
+HEAVY = ("pandas", "numpy", "plotly", "statsmodels", "google")
+
+
+def test_import_app_defers_heavy_modules():
+    result = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    modules = json.loads(result.stdout.strip().splitlines()[-1])
+    assert "pandas" not in modules["all"]
+    assert "plotly.express" not in modules["all"]
+    assert [name for name in modules["new"] if name.split(".")[0] in HEAVY] == []
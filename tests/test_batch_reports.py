@@ -0,0 +1,41 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+import batch_reports
+import compaction
+
+
+def test_prompt_uses_fixed_point_for_large_values():
+    row = {"Name": "台積電", "Industry": "半導體", "Market Capitalization": 1234567.891, "Sales": 9876543210.5,
+           "流動比率": 1.5, "Debt": math.nan, "Listed": True}
+    prompt = batch_reports.build_company_prompt(row, "半導體")
+    assert "- Market Capitalization: 1,234,567.89" in prompt
+    assert "- Sales: 9,876,543,210.50" in prompt
+    assert "- 流動比率: 1.50" in prompt
+    assert "e+" not in prompt
+    assert "Debt" not in prompt
+    assert "- Listed: True" in prompt
+
+
+def test_create_batch_restores_compacted_values(tmp_path):
+    df = pd.DataFrame({"Name": ["A", "B"], "Industry": ["半導體", "半導體"],
+                       "Market Capitalization": [1234567.1, 2.5]})
+    compacted, _ = compaction.compact_frame(df)
+    assert compacted["Market Capitalization"].dtype == np.float32
+    batch_id = batch_reports.create_batch(compacted, "半導體", ["A"], jobs_dir=str(tmp_path))
+    items = batch_reports.load_items(batch_id, jobs_dir=str(tmp_path))
+    assert [item["name"] for item in items] == ["A"]
+    # float32 存的是 1234567.125，未還原時會顯示成 1,234,567.12
+    assert "- Market Capitalization: 1,234,567.10" in items[0]["prompt"]
+
+
+def test_combined_report_includes_only_finished_reports(tmp_path):
+    df = pd.DataFrame({"Name": ["A", "B", "C"], "Industry": ["半導體"] * 3, "Sales": [1.0, 2.0, 3.0]})
+    batch_id = batch_reports.create_batch(df, "半導體", ["A", "B", "C"], jobs_dir=str(tmp_path))
+    reports = tmp_path / batch_id / "reports"
+    (reports / "0.md").write_text("報告 A", encoding="utf-8")
+    (reports / "2.md").write_text("報告 C", encoding="utf-8")
+    (reports / "1.err").write_text("quota", encoding="utf-8")
+    assert batch_reports.combined_report(batch_id, jobs_dir=str(tmp_path)) == "# A\n\n報告 A\n\n---\n\n# C\n\n報告 C"
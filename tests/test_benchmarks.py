@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASE = "rows=200,extra_cols=0"
+
+
+def run_bench(tmp_path, *args):
+    # 在獨立程序執行（benchmarks.run 會以假的 Gemini 客戶端取代 google.ai.generativelanguage）
+    cmd = [sys.executable, "-m", "benchmarks.run", "--sizes", "200", "--widths", "0", "--repeat", "1",
+           "--data-dir", str(tmp_path / "data"), "--baseline", str(tmp_path / "baseline.json"), *args]
+    return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, encoding="utf-8", timeout=600)
+
+
+def test_save_and_compare_against_baseline(tmp_path):
+    saved = run_bench(tmp_path, "--save-baseline")
+    assert saved.returncode == 0, saved.stdout + saved.stderr
+    baseline = json.loads((tmp_path / "baseline.json").read_text(encoding="utf-8"))
+    stages = baseline["results"][CASE]
+    assert {"ingest", "compaction", "prep:overview", "figure:dynamic_scatter", "figure_hit:dynamic_scatter"} <= set(stages)
+
+    # 容許範圍很大時不會有退步
+    same = run_bench(tmp_path, "--tolerance", "1000")
+    assert same.returncode == 0, same.stdout + same.stderr
+    assert "✅" in same.stdout
+
+    # 把基準改成幾乎為 0，每個階段都應該被判定為退步
+    for stage in stages:
+        stages[stage] = 1e-6
+    (tmp_path / "baseline.json").write_text(json.dumps(baseline), encoding="utf-8")
+    slower = run_bench(tmp_path, "--noise-floor-ms", "0")
+    assert slower.returncode == 1, slower.stdout + slower.stderr
+    assert f"{CASE} ingest" in slower.stdout
+
+
+def test_case_missing_from_baseline_is_reported(tmp_path):
+    (tmp_path / "baseline.json").write_text(json.dumps({"meta": {}, "results": {}}), encoding="utf-8")
+    result = run_bench(tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert f"基準中沒有 {CASE}" in result.stdout
+
+
+def test_committed_baseline_covers_committed_cases():
+    # 提交的基準以 --sizes 1k,100k 產生（1M 列需要的記憶體超過產生基準的機器）
+    with open(os.path.join(ROOT, "benchmarks", "baseline.json"), encoding="utf-8") as f:
+        baseline = json.load(f)
+    for rows in (1_000, 100_000):
+        for width in (0, 100):
+            stages = baseline["results"][f"rows={rows},extra_cols={width}"]
+            assert {"ingest", "compaction", "figure_hit:dynamic_scatter"} <= set(stages)
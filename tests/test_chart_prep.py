@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import chart_prep
+
+
+@pytest.mark.parametrize("dtype", ["float64", "int64", "Int64", "Float64", "object", "string"])
+def test_top_n_matches_sort_values_for_any_dtype(dtype):
+    values = [5, 3, 9, 1, 7, 9, 2]
+    df = pd.DataFrame({"Name": list("abcdefg"), "Sales growth 3Years": pd.Series(values).astype(dtype)})
+    result = chart_prep.prepare_top_n(df, "Sales growth 3Years", n=3)["data"]
+    expected = df.sort_values("Sales growth 3Years", ascending=False, kind="stable").head(3)
+    assert list(result["Sales growth 3Years"]) == list(expected["Sales growth 3Years"])
+    assert set(result["Name"]) == set(expected["Name"]) == {"c", "e", "f"}
+
+
+def test_top_n_drops_missing_values():
+    df = pd.DataFrame({"Name": ["a", "b", "c"], "m": [np.nan, 2.0, 1.0]})
+    assert list(chart_prep.prepare_top_n(df, "m", n=5)["data"]["Name"]) == ["b", "c"]
+
+
+def _correlation_frame(seed=0, n=400):
+    # 四捨五入製造同值，並讓各欄位的缺值位置不同；含一個常數欄位與一個幾乎全缺的欄位
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=n)
+    data = {f"c{i}": np.round(base * (i % 3 - 1) + rng.normal(size=n), 1) for i in range(6)}
+    df = pd.DataFrame(data)
+    for i, column in enumerate(df.columns):
+        df.loc[rng.random(n) < 0.05 * i, column] = np.nan
+    df["const"] = 1.0
+    df["sparse"] = np.nan
+    df.loc[:1, "sparse"] = [1.0, 2.0]
+    df["Industry"] = "x"
+    return df
+
+
+@pytest.mark.parametrize("method", ["pearson", "spearman"])
+def test_correlation_matches_pandas_with_missing_values_and_ties(method):
+    df = _correlation_frame()
+    result = chart_prep.prepare_correlation(df, method=method, min_periods=3, chunk_size=3)["matrix"]
+    expected = df.drop(columns="Industry").corr(method, min_periods=3)
+    pd.testing.assert_frame_equal(result, expected.loc[result.index, result.columns], check_exact=False, atol=1e-12)
+
+
+@pytest.mark.parametrize("binning", ["linear", "log", "quantile"])
+def test_histogram_counts_sum_to_n(binning):
+    rng = np.random.default_rng(1)
+    values = np.r_[rng.lognormal(size=500), -rng.random(20), 0.0, np.nan, np.inf, -np.inf]
+    result = chart_prep.prepare_histogram(pd.DataFrame({"v": values}), "v", bins=17, binning=binning)
+    assert result["counts"].sum() == result["n"]
+    assert result["n"] + result["dropped"] == 521
+    assert result["dropped"] == (21 if binning == "log" else 0)
+    assert len(result["edges"]) == len(result["counts"]) + 1
+
+
+@pytest.mark.parametrize("binning", ["linear", "log", "quantile"])
+def test_histogram_of_constant_column_keeps_every_value(binning):
+    result = chart_prep.prepare_histogram(pd.DataFrame({"v": [2.5] * 40}), "v", bins=10, binning=binning)
+    assert result["counts"].sum() == result["n"] == 40
+
+
+def _anomaly_frame(seed=2):
+    # 兩個大產業、一個少於 min_group_size 的產業與沒有產業的公司；b 欄位過半為 0（MAD 為 0）
+    rng = np.random.default_rng(seed)
+    industry = np.r_[["A"] * 60, ["B"] * 40, ["C"] * 5, [None] * 4]
+    n = len(industry)
+    df = pd.DataFrame({
+        "Name": [f"n{i}" for i in range(n)],
+        "Industry": industry,
+        "a": rng.standard_t(2, size=n) + (industry == "B") * 5,
+        "b": np.where(rng.random(n) < 0.6, 0.0, rng.normal(size=n) * 10),
+        "c": np.round(rng.lognormal(size=n), 1),
+    })
+    df.loc[rng.random(n) < 0.1, "a"] = np.nan
+    return df
+
+
+def _reference_scores(frame, method):
+    # 以 pandas 計算一組公司各欄位的分數
+    if method == "iqr":
+        q1, q3 = frame.quantile(0.25), frame.quantile(0.75)
+        scale = (q3 - q1).where(q3 > q1)
+        return (frame - q3).div(scale).where(frame > q3, (frame - q1).div(scale).where(frame < q1, 0.0))
+    deviation = (frame - frame.median()).abs()
+    mad = deviation.median()
+    scale = (mad / 0.6745).where(mad > 0, 1.253314 * deviation.mean())
+    return (frame - frame.median()).div(scale.where(scale > 0))
+
+
+@pytest.mark.parametrize("method", ["robust_z", "iqr"])
+def test_anomaly_flags_match_pandas_reference(method):
+    df = _anomaly_frame()
+    numeric = df[["a", "b", "c"]]
+    overall = _reference_scores(numeric, method)
+    scores = overall.copy()
+    for _, rows in df.groupby("Industry").groups.items():
+        if len(rows) >= 8:
+            scores.loc[rows] = _reference_scores(numeric.loc[rows], method)
+    threshold = chart_prep.ANOMALY_DEFAULT_THRESHOLDS[method]
+    flagged = scores.abs().gt(threshold).stack()
+    expected = sorted(flagged[flagged].index)
+
+    details = chart_prep.prepare_anomalies(df, method=method)["details"]
+    details = details[details["reason"] == "超出產業分佈"]
+    assert expected
+    assert sorted(zip(details["index"], details["column"])) == expected
+    np.testing.assert_allclose(details["score"], [scores.at[i, c] for i, c in zip(details["index"], details["column"])])
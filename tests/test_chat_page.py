@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import chat_store
+import semantic_cache
+from benchmarks import stubs
+
+PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pages", "1_AI聊天室.py")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, fake_glm):
+    store = chat_store.ChatStore(str(tmp_path / "chat.sqlite3"))
+    monkeypatch.setattr(chat_store, "_store", store)
+    monkeypatch.setattr(semantic_cache, "_cache", semantic_cache.SemanticCache())
+    yield store
+    store.close()
+
+
+def _open_page():
+    at = AppTest.from_file(PAGE, default_timeout=30)
+    at.session_state["GOOGLE_API_KEY"] = "test-key"
+    at.run()
+    return at
+
+
+def _ask(at, text):
+    at.chat_input[0].set_value(text)
+    at.run()
+
+
+def test_failed_reply_leaves_no_orphan_user_turn(store, fake_glm, monkeypatch):
+    def fail(self, request=None, **kwargs):
+        raise RuntimeError("quota")
+
+    monkeypatch.setattr(fake_glm.GenerativeServiceClient, "generate_content", fail)
+    at = _open_page()
+    _ask(at, "台積電的負債比率？")
+    assert not at.exception
+    assert any("quota" in error.value for error in at.error)
+    assert store.count(at.query_params["chat"]) == 0
+
+
+def test_successful_reply_stores_both_turns_once(store, fake_glm, monkeypatch):
+    requests = []
+    original = fake_glm.GenerativeServiceClient.generate_content
+
+    def record(self, request=None, **kwargs):
+        requests.append([(c.role, c.parts[0].text) for c in request.contents])
+        return original(self, request=request, **kwargs)
+
+    monkeypatch.setattr(fake_glm.GenerativeServiceClient, "generate_content", record)
+    at = _open_page()
+    _ask(at, "第一個問題")
+    _ask(at, "第二個問題")
+    chat_id = at.query_params["chat"]
+    assert [(m["role"], m["content"]) for m in store.history(chat_id)] == [
+        ("user", "第一個問題"), ("model", stubs.CANNED_TEXT), ("user", "第二個問題"), ("model", stubs.CANNED_TEXT)]
+    # 第二次請求包含完整歷史，且使用者訊息不會重複
+    assert requests[-1] == [("user", "第一個問題"), ("model", stubs.CANNED_TEXT), ("user", "第二個問題")]
@@ -0,0 +1,36 @@
+import pandas as pd
+
+import compaction
+import ingest
+import pipeline
+from benchmarks.synthetic import generate_dataset
+
+
+def processed_frame(rows=300, seed=5):
+    raw = generate_dataset(rows, seed=seed).to_csv(index=False).encode("utf-8")
+    return pipeline.process_frame(ingest.read_table(raw, "data.csv"))[0]
+
+
+def test_widen_restores_compacted_frame():
+    df = processed_frame()
+    compacted, _ = compaction.compact_frame(df)
+    assert any(compaction.is_compacted(compacted[col]) for col in compacted.columns)
+    pd.testing.assert_frame_equal(compaction.widen(compacted), df)
+
+
+def test_decimals_survive_slicing_and_copy():
+    df = processed_frame()
+    compacted, _ = compaction.compact_frame(df)
+    decimals = compacted.attrs[compaction.DECIMALS_ATTR]
+    assert decimals
+    mask = (compacted["Industry"] == compacted["Industry"].iloc[0]).to_numpy()
+    cases = [
+        (compacted.head(50), df.head(50)),
+        (compacted.iloc[10:20], df.iloc[10:20]),
+        (compacted[mask], df[mask]),
+        (compacted[list(decimals)], df[list(decimals)]),
+        (compacted.copy(), df),
+    ]
+    for part, expected in cases:
+        assert part.attrs[compaction.DECIMALS_ATTR] == decimals
+        pd.testing.assert_frame_equal(compaction.widen(part), expected)
@@ -0,0 +1,95 @@
+import concurrent.futures
+from multiprocessing import shared_memory
+
+import pandas as pd
+import pytest
+
+import compute_pool
+
+
+class FakeExecutor:
+    # 不啟動工作程序：送出的請求保持排隊，由測試決定何時完成
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.submitted.append((future, args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for future, _ in self.submitted:
+            if cancel_futures:
+                future.cancel()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(compute_pool, "INLINE_ROW_THRESHOLD", 0)
+    monkeypatch.setattr(compute_pool, "MAX_PUBLISHED_DATASETS", 1)
+    pool = compute_pool.ComputePool(max_workers=1)
+    pool._executor = FakeExecutor()
+    yield pool
+    pool.shutdown()
+
+
+def _frame(value):
+    return pd.DataFrame({"Sales": [value, value + 1.0]})
+
+
+def _exists(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def test_evicted_block_is_kept_until_its_requests_finish(pool):
+    _, first = pool.submit("a", _frame(1.0), "overview", {})
+    inner_a, (handle_a, _, _) = pool._executor.submitted[0]
+    pool.submit("b", _frame(2.0), "overview", {})  # 淘汰資料集 a
+    assert "a" not in pool._published
+    assert _exists(handle_a["shm"])
+    assert pool.stats()["retired_datasets"] == 1
+
+    inner_a.set_result({"value": 1})
+    assert first.result(timeout=1) == {"value": 1}
+    assert not _exists(handle_a["shm"])
+    assert pool.stats()["retired_datasets"] == 0
+
+
+def test_shared_request_is_cancelled_only_by_last_waiter(pool):
+    df = _frame(1.0)
+    _, first = pool.submit("a", df, "overview", {}, slot=("s1", "chart"))
+    _, second = pool.submit("a", df, "overview", {}, slot=("s2", "chart"))
+    assert first is second
+    inner, _ = pool._executor.submitted[0]
+
+    pool.cancel("a", "overview", {}, slot=("s1", "chart"))
+    assert not inner.cancelled()
+    # 同一工作槽改送其他請求，等同放棄等待舊請求
+    pool.submit("a", df, "top_n", {"metric": "Sales", "n": 1}, slot=("s2", "chart"))
+    assert inner.cancelled() and first.cancelled()
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_interrupted_run_keeps_other_waiters(pool):
+    df = _frame(1.0)
+    _, shared = pool.submit("a", df, "overview", {})
+
+    def interrupt():
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        pool.run("a", df, "overview", {}, on_wait=interrupt)
+    inner, _ = pool._executor.submitted[0]
+    assert not inner.cancelled()
+    inner.set_result({"value": 1})
+    assert shared.result(timeout=1) == {"value": 1}
+    # 結果寫入快取，之後的請求直接命中
+    assert pool.run("a", df, "overview", {}) == {"value": 1}
@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+import compaction
+import data_edits
+import pipeline
+from benchmarks.synthetic import generate_dataset
+
+DERIVED = ["負債比率 (%)", "總股東權益", "流動比率"]
+
+
+@pytest.fixture
+def raw():
+    return generate_dataset(300, seed=1)
+
+
+@pytest.fixture
+def base(raw):
+    # 與儀表板相同：完整處理後再做記憶體壓縮
+    return compaction.compact_frame(pipeline.process_frame(raw)[0])[0]
+
+
+def test_apply_does_not_modify_base(base):
+    before = base.copy(deep=True)
+    layer = data_edits.EditLayer(base)
+    layer.apply({(0, "Debt"): 123.45, (5, "Current assets"): 9.5, (7, "Name"): "改名公司"})
+    pd.testing.assert_frame_equal(base, before)
+    assert layer.frame() is not base
+    assert layer.frame().at[0, "Debt"] == 123.45
+
+
+def test_incremental_recompute_matches_full_process(raw, base):
+    changes = {(0, "Debt"): 123.45, (3, "Balance sheet total"): 0.0, (10, "Current liabilities"): 42.0,
+               (11, "Current assets"): 17.25, (12, "Reserves"): -5.5}
+    layer = data_edits.EditLayer(base)
+    layer.apply(changes)
+
+    edited_raw = raw.copy()
+    for (index, column), value in changes.items():
+        edited_raw.at[index, column] = value
+    expected = pipeline.process_frame(edited_raw)[0]
+    actual = compaction.widen(layer.frame())
+    for column in DERIVED + [column for _, column in changes]:
+        pd.testing.assert_series_equal(actual[column], expected[column], check_dtype=False)
+
+
+def test_revert_clears_token(base):
+    layer = data_edits.EditLayer(base)
+    assert layer.token() == ""
+    layer.apply({(0, "Debt"): 123.45})
+    assert layer.token() != ""
+    assert layer.token(["Debt"]) != "" and layer.token(["負債比率 (%)"]) != ""
+    assert layer.token(["Sales"]) == ""
+    layer.revert([(0, "Debt")])
+    assert layer.edits == {} and layer.token() == ""
+    pd.testing.assert_series_equal(compaction.widen(layer.frame())["負債比率 (%)"], compaction.widen(base)["負債比率 (%)"])
@@ -0,0 +1,51 @@
+import numpy as np
+import plotly.graph_objects as go
+
+import figure_cache
+
+
+def figure(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [f"公司{i}" for i in range(n)]
+    return go.Figure(go.Scatter(x=rng.normal(size=n), y=rng.normal(size=n), text=names, mode="markers"))
+
+
+def test_hits_and_misses():
+    cache = figure_cache.FigureCache()
+    assert cache.get("a") is None
+    built = []
+    first = cache.get_or_build("a", lambda: built.append(1) or figure())
+    second = cache.get_or_build("a", lambda: built.append(1) or figure())
+    assert built == [1]
+    assert second is cache.get("a")
+    assert first.data[0].text == second.data[0].text
+    assert "a" in cache and "b" not in cache
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 1)
+
+
+def test_budget_counts_cached_figure_not_json_length():
+    fig = figure()
+    payload = figure_cache.serialize_figure(fig)
+    nbytes = figure_cache.FigureCache().put("a", fig)
+    # 文字標籤在 JSON 中很短，解析成 Python 字串後每個都有物件的額外成本
+    assert nbytes > 2 * len(payload)
+
+
+def test_least_recently_used_is_evicted():
+    size = figure_cache.FigureCache().put("probe", figure())
+    cache = figure_cache.FigureCache(max_bytes=int(size * 2.5))
+    for key in ("a", "b"):
+        cache.put(key, figure())
+    cache.get("a")
+    cache.put("c", figure())
+    assert "a" in cache and "c" in cache and "b" not in cache
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] <= cache.max_bytes
+
+
+def test_oversized_figure_is_still_kept_alone():
+    cache = figure_cache.FigureCache(max_bytes=1)
+    cache.put("a", figure(50))
+    cache.put("b", figure(50))
+    assert "b" in cache and "a" not in cache
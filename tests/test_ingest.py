@@ -0,0 +1,51 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+import pipeline
+from benchmarks.synthetic import generate_dataset
+
+
+def encode(df, fmt):
+    buffer = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buffer, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(buffer, index=False)
+    elif fmt == "feather":
+        df.to_feather(buffer)
+    else:
+        df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def read_all(df):
+    return {fmt: ingest.read_table(encode(df, fmt), f"data.{fmt}") for fmt in ingest.SUPPORTED_EXTENSIONS}
+
+
+def typed_frame():
+    # 合成資料中有些數值以文字存放；轉成數值後各格式應讀回相同的型別
+    df = generate_dataset(200, seed=1)
+    for col in df.columns:
+        if col not in ingest.ARROW_STRING_COLUMNS and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    df.loc[::7, "Sales"] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather", "xlsx"])
+def test_formats_read_the_same_dtypes_and_values(fmt):
+    tables = read_all(typed_frame())
+    assert tables["csv"]["Name"].dtype == ingest.arrow_string_dtype()
+    pd.testing.assert_frame_equal(tables[fmt], tables["csv"])
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather", "xlsx"])
+def test_numbers_stored_as_text_match_after_processing(fmt):
+    # Parquet / Feather 保留文字型別的數值欄位，CSV / XLSX 讀取時即轉為數值；經過 process_frame 後應相同
+    tables = read_all(generate_dataset(200, seed=1))
+    processed = {name: pipeline.process_frame(df)[0] for name, df in tables.items()}
+    pd.testing.assert_frame_equal(processed[fmt], processed["csv"])
@@ -0,0 +1,52 @@
+import pytest
+
+import llm_scheduler
+from benchmarks import stubs
+
+
+def test_each_key_gets_its_own_client(fake_glm):
+    first = llm_scheduler._client_for("key-1")
+    second = llm_scheduler._client_for("key-2")
+    assert first is not second
+    assert first.client_options == {"api_key": "key-1"}
+    assert second.client_options == {"api_key": "key-2"}
+    assert llm_scheduler._client_for("key-1") is first
+
+
+def test_least_recently_used_client_is_dropped(fake_glm, monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "DEFAULT_MAX_CLIENTS", 2)
+    first = llm_scheduler._client_for("key-1")
+    llm_scheduler._client_for("key-2")
+    assert llm_scheduler._client_for("key-1") is first
+    llm_scheduler._client_for("key-3")
+    assert list(llm_scheduler._clients) == ["key-1", "key-3"]
+    assert llm_scheduler._client_for("key-1") is first
+
+
+def test_endpoint_uses_rest_transport(fake_glm, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_ENDPOINT", "http://127.0.0.1:9")
+    client = llm_scheduler._client_for("key-1")
+    assert client.client_options == {"api_key": "key-1", "api_endpoint": "http://127.0.0.1:9"}
+
+
+def test_gemini_generate_sends_history_and_returns_text(fake_glm, monkeypatch):
+    requests = []
+    original = fake_glm.GenerativeServiceClient.generate_content
+
+    def record(self, request=None, **kwargs):
+        requests.append(request)
+        return original(self, request=request, **kwargs)
+
+    monkeypatch.setattr(fake_glm.GenerativeServiceClient, "generate_content", record)
+    contents = [{"role": "user", "parts": ["hi"]}, {"role": "model", "parts": ["yo"]}, {"role": "user", "parts": ["again"]}]
+    assert llm_scheduler.gemini_generate("key-1", "gemini-2.0-flash", contents) == stubs.CANNED_TEXT
+    request = requests[0]
+    assert request.model == "models/gemini-2.0-flash"
+    assert [(c.role, [p.text for p in c.parts]) for c in request.contents] == [("user", ["hi"]), ("model", ["yo"]), ("user", ["again"])]
+
+
+def test_empty_response_raises(fake_glm, monkeypatch):
+    monkeypatch.setattr(fake_glm.GenerativeServiceClient, "generate_content",
+                        lambda self, request=None, **kwargs: stubs._Message(candidates=[], prompt_feedback="SAFETY"))
+    with pytest.raises(ValueError, match="SAFETY"):
+        llm_scheduler.gemini_generate("key-1", "gemini-2.0-flash", [{"role": "user", "parts": ["hi"]}])
@@ -0,0 +1,65 @@
+import gc
+import tracemalloc
+
+import perf
+
+
+def test_tracing_only_during_recorded_runs():
+    recorder = perf.PerfRecorder()
+    recorder.set_enabled(True)
+    assert not tracemalloc.is_tracing()
+    recorder.begin_run("page")
+    assert tracemalloc.is_tracing()
+    recorder.end_run()
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracing_stops_after_last_concurrent_run():
+    first, second = perf.PerfRecorder(), perf.PerfRecorder()
+    for recorder in (first, second):
+        recorder.set_enabled(True)
+        recorder.begin_run("page")
+    first.end_run()
+    assert tracemalloc.is_tracing()
+    second.end_run()
+    assert not tracemalloc.is_tracing()
+
+
+def test_interrupted_run_releases_tracing():
+    recorder = perf.PerfRecorder()
+    recorder.set_enabled(True)
+    recorder.begin_run("page")
+    # 被新的 rerun 中斷（沒有 end_run）後關閉面板
+    recorder.begin_run("page")
+    recorder.set_enabled(False)
+    assert not tracemalloc.is_tracing()
+
+
+def test_closed_session_releases_tracing():
+    recorder = perf.PerfRecorder()
+    recorder.set_enabled(True)
+    recorder.begin_run("page")
+    del recorder  # 工作階段在 rerun 中途結束，記錄器被回收
+    gc.collect()
+    assert not tracemalloc.is_tracing()
+
+
+def test_span_left_open_by_exception_is_closed_at_end_of_run():
+    recorder = perf.PerfRecorder()
+    recorder.set_enabled(True)
+    recorder.begin_run("page")
+    recorder.start_span("chart:x")
+    with recorder.span("after"):
+        pass
+    recorder.end_run()
+    spans = {span["span"]: span for span in recorder.runs[-1]["spans"]}
+    assert spans["chart:x"]["error"] == "unfinished"
+    assert spans["after"]["parent"] == "chart:x"
+
+
+def test_disabled_recorder_records_nothing():
+    recorder = perf.PerfRecorder()
+    recorder.begin_run("page")
+    assert recorder.span("x") is perf._NULL_SPAN
+    recorder.end_run()
+    assert not recorder.runs and not tracemalloc.is_tracing()
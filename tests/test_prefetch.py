@@ -0,0 +1,94 @@
+import gc
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import prefetch
+
+
+class FakePool:
+    # 回傳固定大小的圖表資料；block=True 時等到 on_wait 拋出 PrefetchCancelled 為止
+    def __init__(self, nbytes=800, block=False):
+        self.nbytes = nbytes
+        self.block = block
+        self.calls = []
+        self.waiting = threading.Event()
+
+    def run(self, dataset_key, df, prep, params, on_wait=None):
+        self.calls.append(prep)
+        while self.block:
+            self.waiting.set()
+            on_wait()
+            time.sleep(0.01)
+        return {"values": np.zeros(self.nbytes // 8)}
+
+
+class FakeFigureCache(dict):
+    def put(self, key, fig):
+        self[key] = fig
+        return 100
+
+
+def task(chart, prep="histogram", figure_params=("p",)):
+    return {"chart": chart, "prep": prep, "params": (), "figure_params": figure_params, "build": lambda prepared: "fig"}
+
+
+def frame(rows=1000):
+    return pd.DataFrame({"x": np.arange(rows, dtype=float)})
+
+
+def test_cheapest_keeps_all_tasks_of_the_cheapest_charts():
+    tasks = [task("a", "anomalies"), task("b", "histogram"), task("b", "scatter", None),
+             task("c", "top_n"), task("d", "correlation")]
+    kept = prefetch.cheapest(tasks, 1000, 2)
+    # b = 0.15 + 8.0, c = 0.9, d = 2.5, a = 15 微秒/列
+    assert [(t["chart"], t["prep"]) for t in kept] == [("c", "top_n"), ("d", "correlation")]
+    assert {t["chart"] for t in prefetch.cheapest(tasks, 1000, 3)} == {"b", "c", "d"}
+
+
+def test_over_budget():
+    prefetcher = prefetch.Prefetcher("k" * 16, frame(1_000_000), [], FakePool(), FakeFigureCache(),
+                                     cpu_budget_s=1.0, memory_budget_bytes=1000)
+    assert prefetcher._over_budget(task("a", "histogram")) is None  # 0.15 秒
+    assert prefetcher._over_budget(task("a", "anomalies")) == "cpu"  # 15 秒
+    prefetcher.elapsed_s = 0.9
+    assert prefetcher._over_budget(task("a", "histogram")) == "cpu"
+    prefetcher.elapsed_s = 0.0
+    prefetcher.used_bytes = 1000
+    assert prefetcher._over_budget(task("a", "histogram")) == "memory"
+
+
+def test_tasks_after_memory_budget_are_skipped():
+    cache = FakeFigureCache()
+    prefetcher = prefetch.Prefetcher("k" * 16, frame(), [task("a"), task("b")], FakePool(nbytes=800), cache,
+                                     memory_budget_bytes=850)
+    prefetcher.run()
+    assert prefetcher.status == {"a": "done", "b": "skipped (memory)"}
+    assert list(cache) == [("k" * 16, "a", ("p",))]
+    assert prefetcher.used_bytes == 900
+
+
+def test_stop_cancels_running_and_pending_tasks():
+    pool = FakePool(block=True)
+    prefetcher = prefetch.Prefetcher("k" * 16, frame(), [task("a"), task("b")], pool, FakeFigureCache())
+    prefetcher.start()
+    assert pool.waiting.wait(5)
+    prefetcher.stop()
+    prefetcher.join(5)
+    assert not prefetcher.is_alive()
+    assert prefetcher.status == {"a": "cancelled", "b": "cancelled"}
+    assert pool.calls == ["histogram"]
+
+
+def test_collected_handle_stops_prefetcher():
+    pool = FakePool(block=True)
+    handle = prefetch.PrefetchHandle(prefetch.Prefetcher("k" * 16, frame(), [task("a")], pool, FakeFigureCache()))
+    prefetcher = handle.prefetcher
+    assert pool.waiting.wait(5)
+    del handle  # 工作階段結束，session_state 被回收
+    gc.collect()
+    prefetcher.join(5)
+    assert not prefetcher.is_alive()
+    assert prefetcher.status == {"a": "cancelled"}
@@ -0,0 +1,64 @@
+import semantic_cache
+
+
+def test_similar_question_hits():
+    cache = semantic_cache.SemanticCache()
+    cache.put("s", "請問台積電的負債比率與流動比率是否代表財務結構穩健？", "answer")
+    hit = cache.lookup("s", "台積電的負債比率和流動比率，是否代表財務結構穩健")
+    assert hit is not None and hit[0] == "answer"
+
+
+def test_negated_question_is_never_a_hit():
+    cache = semantic_cache.SemanticCache()
+    cache.put("s", "請分析台積電的負債比率與流動比率是否代表財務結構穩健", "answer")
+    # n-gram 相似度高於門檻，但意思相反
+    assert cache.lookup("s", "請分析台積電的負債比率與流動比率是否不代表財務結構穩健") is None
+    assert cache.lookup("s", "請分析台積電的負債比率與流動比率是否代表財務結構不穩健") is None
+
+
+def test_different_numbers_are_never_a_hit():
+    cache = semantic_cache.SemanticCache()
+    cache.put("s", "列出電子業中市值排名前十名的公司與其股東權益報酬率", "top10")
+    assert cache.lookup("s", "列出電子業中市值排名前五名的公司與其股東權益報酬率") is None
+    cache.put("s", "台積電 2023 年的營收成長率", "2023")
+    assert cache.lookup("s", "台積電 2024 年的營收成長率") is None
+    assert cache.lookup("s", "請問台積電 2023 年的營收成長率")[0] == "2023"
+
+
+def test_guard_tokens_match_negation_words_only():
+    guard = semantic_cache.guard_tokens
+    for text in ["台積電的獲利非常穩定", "無形資產占總資產的比率", "未來的營收成長率", "各產業別的平均毛利率",
+                 "不動產投資的報酬率", "營收不斷成長的公司"]:
+        assert guard(text) == (), text
+    for text in ["毛利率是否不穩定", "沒有配息的公司", "並非長期成長", "無法支付利息", "尚未轉虧為盈", "未曾虧損"]:
+        assert guard(text), text
+
+
+def test_guard_tokens_ignore_fillers():
+    assert semantic_cache.guard_tokens("請幫我看一下台積電") == semantic_cache.guard_tokens("台積電")
+    assert semantic_cache.guard_tokens("isn't it stable") != semantic_cache.guard_tokens("is it stable")
+
+
+def test_candidates_are_capped_with_many_similar_entries():
+    cache = semantic_cache.SemanticCache(max_candidates=64)
+    names = ["台積電", "聯發科", "鴻海", "台達電"]
+    for i in range(4000):
+        cache.put("s", f"{names[i % 4]}的營收成長率和同業相比表現如何，代號{chr(0x4e00 + 0x100 + i)}", i)
+    for i in range(50):
+        cache.lookup("s", f"{names[i % 4]}的營收成長率和同業相比表現如何，代號{chr(0x4e00 + 0x100 + i)}嗎")
+    stats = cache.stats()
+    assert stats["avg_candidates"] <= 64
+    assert stats["hits"] == 50
+
+
+def test_scope_ttl_and_eviction():
+    cache = semantic_cache.SemanticCache(max_entries=2)
+    cache.put("a", "台積電的營收成長率", "a")
+    assert cache.lookup("b", "台積電的營收成長率") is None
+    cache.put("a", "鴻海的負債比率", "b", ttl=-1)
+    assert cache.lookup("a", "鴻海的負債比率") is None
+    assert cache.stats()["expirations"] == 1
+    for i, name in enumerate(["聯發科", "台達電", "大立光"]):
+        cache.put("a", f"{name}的毛利率", i)
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("a", "大立光的毛利率")[0] == 2